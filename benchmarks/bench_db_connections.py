@@ -0,0 +1,69 @@
+"""SQLite write cost: connect-per-call (before user-006) vs persistent WAL connections
+
+Runs the same users upsert through Database._get_connection of the tree
+before user-006 (loaded from git) and of the current tree, each against a
+fresh database file. Every call is its own transaction, as in the bot.
+
+    python benchmarks/bench_db_connections.py [--calls 2000] [--users 500]
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from common import load_baseline
+
+import main as current
+
+UPSERT = '''
+    INSERT INTO users (telegram_id, first_name, username)
+    VALUES (?, ?, ?)
+    ON CONFLICT(telegram_id) DO UPDATE SET
+        last_seen = CURRENT_TIMESTAMP,
+        total_msgs = total_msgs + 1,
+        first_name = excluded.first_name,
+        username = excluded.username
+'''
+
+
+def bench(module, calls: int, users: int) -> float:
+    """Seconds per single-statement write transaction on a fresh database"""
+    with tempfile.TemporaryDirectory() as workdir:
+        db = module.Database(str(Path(workdir) / "bench.db"))
+
+        def upsert(n: int):
+            with db._get_connection() as conn:
+                conn.execute(UPSERT, (n % users, f"User {n}", f"user{n}"))
+
+        try:
+            for n in range(users):  # rows exist, so the timed calls take the UPDATE path
+                upsert(n)
+            started = time.perf_counter()
+            for n in range(calls):
+                upsert(n)
+            return (time.perf_counter() - started) / calls
+        finally:
+            db._writer.shutdown()
+            db._readers.shutdown()
+            if hasattr(db, "_close_connections"):
+                db._close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    old = load_baseline("user-006")
+    logging.getLogger().setLevel(logging.WARNING)
+    before = bench(old, args.calls, args.users)
+    after = bench(current, args.calls, args.users)
+    print(f"users upsert, {args.calls} commits over {args.users} users")
+    print(f"  connect per call : {before * 1e6:8.1f} µs/call")
+    print(f"  persistent WAL   : {after * 1e6:8.1f} µs/call  ({before / after:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
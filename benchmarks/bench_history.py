@@ -0,0 +1,110 @@
+"""Per-user session memory and prompt cost: dict/list layout (before user-023) vs ChatHistory
+
+Memory: tracemalloc size of every user's chat history, summary and booking
+draft, with the message strings allocated up front and shared by both
+layouts, so only the containers are compared. Time: building the prompt
+and recording the answer for one exchange, using compact_history and
+_build_messages from the tree before user-023 (loaded from git).
+
+    python benchmarks/bench_history.py [--users 10000] [--exchanges 8]
+"""
+import argparse
+import gc
+import logging
+import random
+import time
+import tracemalloc
+
+from common import load_baseline
+
+import main as current
+
+WORDS = "الكورس بكام السعر المواعيد الاستديو التصوير الحجز العنوان فين امتى ساعة جنيه".split()
+
+
+def sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def conversation(rng: random.Random, exchanges: int):
+    return [(sentence(rng, 3, 12), sentence(rng, 20, 80)) for _ in range(exchanges)]
+
+
+def old_session(old, exchanges):
+    history, summary = [], ""
+    for question, answer in exchanges:
+        history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        history, summary = old.compact_history(history, summary)
+    session = {"chat_history": history,
+               "booking": {"type": "course", "name": "Bench", "phone": "01000000000", "details": "Python"}}
+    if summary:
+        session["chat_summary"] = summary
+    return session
+
+
+def new_session(exchanges):
+    history = current.ChatHistory()
+    for question, answer in exchanges:
+        history.add_exchange(question, answer)
+    return {"chat_history": history,
+            "booking": current.BookingDraft(type="course", name="Bench", phone="01000000000", details="Python")}
+
+
+def traced_size(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    sessions = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del sessions
+    return size
+
+
+def per_exchange(record, exchanges, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        record(exchanges)
+    return (time.perf_counter() - started) / (rounds * len(exchanges))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--exchanges", type=int, default=8, help="exchanges per user in the memory test")
+    parser.add_argument("--rounds", type=int, default=20, help="30-exchange chats timed per layout")
+    args = parser.parse_args()
+
+    old = load_baseline("user-023")
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(1)
+    chats = [conversation(rng, args.exchanges) for _ in range(args.users)]
+
+    before = traced_size(lambda: [old_session(old, chat) for chat in chats])
+    after = traced_size(lambda: [new_session(chat) for chat in chats])
+    print(f"{args.users} users x {args.exchanges} exchanges + booking draft")
+    print(f"  dicts + lists : {before / 2**20:6.1f} MB")
+    print(f"  ChatHistory   : {after / 2**20:6.1f} MB  ({after / before - 1:+.0%})")
+
+    old_ai, new_ai = old.GroqAI(), current.GroqAI()
+
+    def old_chat(exchanges):
+        history, summary = [], ""
+        for question, answer in exchanges:
+            old_ai._build_messages(question, history, summary)
+            history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+            history, summary = old.compact_history(history, summary)
+
+    def new_chat(exchanges):
+        history = current.ChatHistory()
+        for question, answer in exchanges:
+            new_ai._build_messages(question, history)
+            history.add_exchange(question, answer)
+
+    long_chat = conversation(rng, 30)
+    print("per exchange (build prompt + record answer), 30-exchange chat")
+    print(f"  dicts + lists : {per_exchange(old_chat, long_chat, args.rounds) * 1e3:6.2f} ms")
+    print(f"  ChatHistory   : {per_exchange(new_chat, long_chat, args.rounds) * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
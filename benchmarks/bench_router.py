@@ -0,0 +1,158 @@
+"""Text-update dispatch cost: regex handler chain vs per-route filters vs RouteHandler
+
+Times what Application.process_update does before a callback runs: walk the
+handlers and call check_update until one accepts the update. Every update is
+a fresh object, so the router's per-message memo never carries over.
+
+    python benchmarks/bench_router.py [--rounds 200] [--extra 0 30]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCH")
+os.environ.setdefault("KNOWLEDGE_FILE", str(ROOT / "knowledge.txt"))
+sys.path.insert(0, str(ROOT))
+
+import logging  # noqa: E402
+
+from telegram.ext import MessageHandler, filters  # noqa: E402
+
+import main  # noqa: E402
+from main import ROUTE_TRIGGERS, MessageRouter, RouteHandler, Update  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+# The chain user-017 replaced
+BOOK_TRIGGER = (
+    r"📅 احجز دلوقتي|احجز كورس|احجز جلسة تصوير|"
+    r"عايز احجز|عاوز احجز|محتاج احجز|"
+    r"حجز كورس|حجز جلسة|حجزلي|احجزلي|"
+    r"عايز موعد|عاوز موعد|ابي احجز|ابغى احجز|"
+    r"📅 احجز كورس دلوقتي|📅 احجز جلسة تصوير"
+)
+CHAT_TRIGGER = r"💬 اسألنا$|💬 اسألنا عن الكورسات|💬 اسألنا عن الاستديو"
+STATIC = [r"^📚 كورسات السنتر$", r"^📸 استديو X\.press$", r"^📞 تواصل معنا$", r"^🏠"]
+
+SAMPLES = [
+    "📅 احجز دلوقتي", "💬 اسألنا", "📚 كورسات السنتر", "📸 استديو X.press", "📞 تواصل معنا",
+    "🏠 الرئيسية", "عايز احجز كورس فوتوشوب", "احجزلي جلسة بكرة", "الكورس بكام؟",
+    "مواعيد السنتر ايه", "فين مكانكم بالظبط", "هل في شهادة بعد الكورس", "شكرا",
+    "ممكن اعرف تفاصيل باقة التصوير", "السلام عليكم", "عندكم كورس مونتاج؟",
+]
+
+
+async def noop(update, context):
+    pass
+
+
+class RouteFilter(filters.MessageFilter):
+    """The per-route filter user-017 shipped first, kept here for comparison"""
+
+    def __init__(self, router, route):
+        super().__init__(name=f"RouteFilter({route})")
+        self.router, self.route = router, route
+
+    def filter(self, message):
+        return self.router.route_message(message) == self.route
+
+
+def extra_buttons(count):
+    return [(f"extra{i}", "exact", (f"زرار رقم {i}",)) for i in range(count)]
+
+
+def regex_chain(extra):
+    handlers = [MessageHandler(filters.Regex(BOOK_TRIGGER), noop), MessageHandler(filters.Regex(CHAT_TRIGGER), noop)]
+    handlers += [MessageHandler(filters.Regex(p), noop) for p in STATIC]
+    handlers += [MessageHandler(filters.Regex(rf"^زرار رقم {i}$"), noop) for i in range(extra)]
+    names = [route for route, _, _ in ROUTE_TRIGGERS + extra_buttons(extra)]
+    return handlers + [MessageHandler(filters.TEXT & ~filters.COMMAND, noop)], names + ["ai"]
+
+
+def route_filters(extra):
+    router = MessageRouter(ROUTE_TRIGGERS + extra_buttons(extra), extra_file="")
+    handlers = [MessageHandler(RouteFilter(router, route), noop) for route in router.routes]
+    return handlers + [MessageHandler(filters.TEXT & ~filters.COMMAND, noop)], router.routes + ["ai"]
+
+
+def route_handlers(extra):
+    router = MessageRouter(ROUTE_TRIGGERS + extra_buttons(extra), extra_file="")
+    static = {route: noop for route in router.routes if route not in ("booking", "chat")}
+    handlers = [
+        RouteHandler(router, {"booking": noop}),
+        RouteHandler(router, {"chat": noop}),
+        RouteHandler(router, static, default=noop),
+    ]
+    return handlers, [None] * len(handlers)
+
+
+def make_updates(rounds):
+    updates = []
+    for n in range(rounds):
+        for i, text in enumerate(SAMPLES):
+            message = {
+                "message_id": i, "date": 0, "text": text,
+                "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "A"},
+            }
+            updates.append(Update.de_json({"update_id": n * len(SAMPLES) + i, "message": message}, None))
+    return updates
+
+
+def dispatch_all(handlers, updates):
+    picked = []
+    for update in updates:
+        for handler in handlers:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                picked.append((handler, check))
+                break
+        else:
+            picked.append(None)
+    return picked
+
+
+def chosen_routes(handlers, names, updates):
+    """Route each update ends up in, to check the setups agree"""
+    by_handler = dict(zip(map(id, handlers), names))
+    routes = []
+    for hit in dispatch_all(handlers, updates):
+        handler, check = hit
+        route = check if isinstance(handler, RouteHandler) else by_handler[id(handler)]
+        routes.append("ai" if route == RouteHandler._DEFAULT else route)
+    return routes
+
+
+def measure(handlers, updates):
+    dispatch_all(handlers, updates[: len(SAMPLES)])  # warm up
+    started = time.perf_counter()
+    dispatch_all(handlers, updates)
+    return (time.perf_counter() - started) / len(updates) * 1e6
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200, help="passes over the sample messages")
+    parser.add_argument("--extra", type=int, nargs="+", default=[0, 30], help="extra exact-match buttons")
+    args = parser.parse_args()
+
+    for extra in args.extra:
+        setups = {
+            "regex chain": regex_chain(extra),
+            "route filters": route_filters(extra),
+            "RouteHandler": route_handlers(extra),
+        }
+        print(f"{len(SAMPLES) * args.rounds} updates, {6 + extra} routes:")
+        reference = None
+        for name, (handlers, names) in setups.items():
+            routes = chosen_routes(handlers, names, make_updates(1))
+            reference = reference or routes
+            per_update = measure(handlers, make_updates(args.rounds))
+            agrees = "same routes" if routes == reference else f"DIFFERENT routes: {routes}"
+            print(f"  {name:<14} {len(handlers):>3} handlers  {per_update:6.2f} µs/update  ({agrees})")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,126 @@
+"""Webhook throughput with WORKERS=1, 2, 4...: updates/s until every reply has been sent
+
+Starts main.py in webhook mode against a fake Bot API, once per worker
+count, and posts /start updates spread over many chats from several
+client threads. Each worker is a separate process, so throughput can only
+scale with the number of CPU cores available; on a single core the run
+shows the supervisor's dispatch overhead instead.
+
+    python benchmarks/bench_workers.py [--workers 1 2 4] [--updates 2000] [--chats 200]
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import ROOT, FakeBotAPI
+
+SECRET = "bench-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def post_updates(port: int, first_id: int, count: int, chats: int, clients: int):
+    """POST `count` /start updates from `clients` keep-alive connections in parallel"""
+    def client(offset: int):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        for n in range(offset, count, clients):
+            chat = 10_000 + n % chats
+            update = {"update_id": first_id + n, "message": {
+                "message_id": first_id + n, "date": 0, "text": "/start",
+                "chat": {"id": chat, "type": "private"},
+                "from": {"id": chat, "is_bot": False, "first_name": "Bench"},
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            }}
+            while True:
+                conn.request("POST", "/telegram", body=json.dumps(update), headers={
+                    "X-Telegram-Bot-Api-Secret-Token": SECRET, "Content-Type": "application/json",
+                })
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    break
+                time.sleep(0.05)  # 503 backpressure: retry like Telegram would
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def wait_ready(port: int, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("bot did not become ready")
+
+
+def run(workers: int, updates: int, chats: int, clients: int) -> float:
+    api = FakeBotAPI()
+    port = free_port()
+    env = dict(
+        os.environ, BOT_MODE="webhook", WEBHOOK_URL="http://127.0.0.1", WEBHOOK_PORT=str(port),
+        WEBHOOK_SECRET=SECRET, TELEGRAM_API_BASE_URL=api.base_url, WORKERS=str(workers),
+        WEBHOOK_MAX_QUEUE="100000", ADMIN_ID="",
+    )
+    with tempfile.TemporaryDirectory() as workdir:  # fresh edu_bookings.db and logs/
+        bot = subprocess.Popen(
+            [sys.executable, str(ROOT / "main.py")], cwd=workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(port)
+            # Warm-up: one update per chat reaches every worker (and waits for them to boot)
+            post_updates(port, 1, chats, chats, clients)
+            if not api.wait_for_sent(chats, 120):
+                raise RuntimeError("warm-up replies missing")
+
+            started = time.perf_counter()
+            post_updates(port, chats + 1, updates, chats, clients)
+            if not api.wait_for_sent(chats + updates, 300):
+                raise RuntimeError(f"only {api.sent - chats}/{updates} replies arrived")
+            return updates / (time.perf_counter() - started)
+        finally:
+            bot.send_signal(signal.SIGTERM)
+            bot.wait(60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=8, help="parallel HTTP connections posting updates")
+    args = parser.parse_args()
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"{args.updates} updates over {args.chats} chats, {args.clients} clients, {cores} CPU cores available")
+    baseline = None
+    for workers in args.workers:
+        rate = run(workers, args.updates, args.chats, args.clients)
+        baseline = baseline or rate
+        print(f"  WORKERS={workers}: {rate:7.0f} updates/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
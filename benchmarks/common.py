@@ -0,0 +1,92 @@
+"""Shared setup for the benchmark scripts: import main.py without a real bot, fake Bot API"""
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# main.py exits at import time without a token; benchmarks never reach Telegram
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCH")
+os.environ.setdefault("KNOWLEDGE_FILE", str(ROOT / "knowledge.txt"))
+os.environ.setdefault("KNOWLEDGE_WATCH", "0")
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def load_baseline(request_id: str):
+    """Import main.py as it was just before the first commit tagged [request_id]
+
+    Lets a benchmark time the code a change replaced against the current tree.
+    """
+    log = subprocess.run(
+        ["git", "log", "--format=%H", f"--grep=^\\[{request_id}\\]"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    if not log:
+        raise SystemExit(f"no commit tagged [{request_id}] in this checkout")
+    source = subprocess.run(
+        ["git", "show", f"{log[-1]}^:main.py"], cwd=ROOT, capture_output=True, check=True,
+    ).stdout
+    path = Path(tempfile.mkdtemp()) / f"main_before_{request_id.replace('-', '_')}.py"
+    path.write_bytes(source)
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeBotAPI:
+    """Minimal Bot API on 127.0.0.1: answers getMe/sendMessage/editMessageText, counts sent messages"""
+
+    def __init__(self):
+        self.sent = 0
+        self._cond = threading.Condition()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                method = self.path.rsplit("/", 1)[-1]
+                try:
+                    data = json.loads(body) if body else {}
+                except ValueError:
+                    data = {}
+                if method == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+                elif method in ("sendMessage", "editMessageText"):
+                    chat = {"id": int(data.get("chat_id", 1)), "type": "private"}
+                    result = {"message_id": 1, "date": 0, "chat": chat, "text": data.get("text", "")}
+                else:
+                    result = True
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                if method == "sendMessage":
+                    with api._cond:
+                        api.sent += 1
+                        api._cond.notify_all()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/bot"
+
+    def wait_for_sent(self, count: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.sent >= count, timeout)
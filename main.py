@@ -11,33 +11,56 @@ FIXED VERSION - All bugs resolved and best practices implemented
 
 import os
 import sys
+import asyncio
 import sqlite3
 import logging
 import re
+import json
+import math
+import time
+import random
+import hashlib
+import hmac
+import secrets
+import signal
+import threading
+import functools
+import multiprocessing
+import queue
+import zlib
+from collections import deque, OrderedDict
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Dict, Tuple
-from contextlib import contextmanager
+from typing import Optional, List, Dict, Set, Tuple, AsyncIterator
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler,
-    ConversationHandler, CallbackQueryHandler,
+    Application, BaseUpdateProcessor, BasePersistence, PersistenceInput, BaseHandler, CommandHandler, MessageHandler,
+    ConversationHandler, CallbackQueryHandler, TypeHandler,
     filters, ContextTypes
 )
-from telegram.error import TelegramError, NetworkError, TimedOut
+from telegram.error import TelegramError, NetworkError, TimedOut, RetryAfter, BadRequest, Forbidden
+from telegram.helpers import escape_markdown
 import httpx
 from dotenv import load_dotenv
 
 # ─── Configuration Constants ──────────────────────────────────────────────────
 MAX_MESSAGE_LENGTH = 4000
-MAX_HISTORY_MESSAGES = 6
 MAX_PHONE_DIGITS = 15
 MIN_PHONE_DIGITS = 10
 MIN_NAME_LENGTH = 3
-API_TIMEOUT = 30.0
+API_TIMEOUT = 30.0          # overall deadline per AI question, shared by all attempts
 API_MAX_RETRIES = 3
+API_BACKOFF_BASE = 0.5      # seconds, decorrelated-jitter backoff between attempts
+API_BACKOFF_CAP = 8.0
+API_RETRY_BUDGET_RATIO = 0.1  # retries allowed per request, process-wide
+API_RETRY_BUDGET_RESERVE = 5  # retries available before the ratio builds up
 BOOKING_SUMMARY_MAX_LENGTH = 3900
+BOOKINGS_PAGE_SIZE = 8
+STREAM_EDIT_INTERVAL = 1.2  # seconds between progressive edits (Telegram edit rate limit)
+STREAM_PLACEHOLDER = "✍️ ..."
 
 # ─── Logging ──────────────────────────────────────────────────────────────────
 Path("logs").mkdir(exist_ok=True)
@@ -62,9 +85,118 @@ if not TELEGRAM_TOKEN:
     logger.error("❌ TELEGRAM_TOKEN is missing in .env file")
     sys.exit(1)
 
+# Deployment: "polling" (default) or "webhook" with the embedded HTTP server
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")  # e.g. a local fake Bot API for testing
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # public https base URL Telegram posts to
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")    # random per start when empty
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "100"))  # 503 at this many received but unfinished updates
+WEBHOOK_MAX_BODY = 1024 * 1024
+WEBHOOK_MAX_HEADERS = 64     # header lines per request (each line is capped by the stream's 64 KiB limit)
+WEBHOOK_IDLE_TIMEOUT = 75.0  # seconds a keep-alive connection may sit idle
+
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 GROQ_MODEL = "llama-3.3-70b-versatile"
 
+# HTTP connection pool for Groq (tunable from .env)
+GROQ_POOL_MAX_CONNECTIONS = int(os.getenv("GROQ_POOL_MAX_CONNECTIONS", "20"))
+GROQ_POOL_MAX_KEEPALIVE = int(os.getenv("GROQ_POOL_MAX_KEEPALIVE", "10"))
+GROQ_POOL_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_POOL_KEEPALIVE_EXPIRY", "60"))
+GROQ_HTTP2 = os.getenv("GROQ_HTTP2", "1") == "1"
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+
+# Database worker threads: one writer, a small reader pool, bounded pending queue
+DB_READER_THREADS = int(os.getenv("DB_READER_THREADS", "2"))
+DB_MAX_PENDING = int(os.getenv("DB_MAX_PENDING", "200"))
+DB_STATEMENT_CACHE = 128           # prepared statements kept per connection
+DB_MMAP_SIZE = 64 * 1024 * 1024    # bytes
+DB_CACHE_KB = 16 * 1024            # page cache per connection
+DB_HEALTH_CHECK_IDLE = 300.0       # seconds idle before a connection is pinged
+
+# Write-behind user activity: at most this much activity is lost on a crash
+ACTIVITY_FLUSH_INTERVAL_MS = int(os.getenv("ACTIVITY_FLUSH_INTERVAL_MS", "2000"))
+ACTIVITY_FLUSH_MAX_ENTRIES = int(os.getenv("ACTIVITY_FLUSH_MAX_ENTRIES", "500"))
+
+# Admin notification outbox
+OUTBOX_POLL_INTERVAL = 10.0   # seconds between outbox scans when idle
+OUTBOX_BASE_BACKOFF = 5.0     # seconds, doubled per failed attempt
+OUTBOX_MAX_BACKOFF = 600.0
+OUTBOX_MAX_ATTEMPTS = 10
+
+# AI response cache (memory LRU + optional SQLite tier that survives restarts)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")  # e.g. "response_cache.db"; empty = memory only
+RESPONSE_CACHE_PURGE_EVERY = 100  # disk writes between purges of expired answers
+
+# AI admission control (per-user rate limit, global concurrency, bounded queue)
+AI_RATE_PER_MINUTE = float(os.getenv("AI_RATE_PER_MINUTE", "6"))
+AI_RATE_BURST = int(os.getenv("AI_RATE_BURST", "3"))
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", "8"))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "32"))
+
+# Groq circuit breaker: trips on failure rate (slow answers count as failures)
+AI_BREAKER_WINDOW = 20          # most recent Groq requests considered (one outcome each, after retries)
+AI_BREAKER_MIN_CALLS = 5        # don't judge the error rate on fewer requests
+AI_BREAKER_FAILURE_RATE = 0.5
+AI_BREAKER_SLOW_CALL = 10.0     # seconds to first token, retries included
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+AI_FALLBACK_MAX_CHARS = 1500
+
+# Prompt token budgets (estimated tokens; older chat turns are folded into a summary)
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "3500"))   # system + summary + history + question
+AI_HISTORY_TOKEN_BUDGET = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "1200"))  # verbatim turns kept per user
+AI_SUMMARY_TOKEN_BUDGET = 300
+AI_HISTORY_CAPACITY = 16       # turns kept per user (even: user/assistant pairs); older ones are summarized
+AI_MAX_REPLY_TOKENS = 800
+
+# Local intent fast path: short, unambiguous questions are answered without Groq
+INTENT_MIN_SCORE = 2.0
+INTENT_MIN_MARGIN = 1.0
+INTENT_MAX_TOKENS = 8          # longer messages are likely real questions for the LLM
+INTENT_MAX_UNMATCHED = 1       # content words the matched phrases don't explain
+
+# Persistence of user_data and conversation states (flushed every PERSISTENCE_INTERVAL seconds)
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "15"))
+PERSISTENCE_COMPRESS_MIN = 256  # bytes of JSON before zlib is worth it
+
+# Session lifetime: unfinished conversations time out, idle users' data is evicted from memory
+BOOKING_TIMEOUT = float(os.getenv("BOOKING_TIMEOUT", "900"))       # seconds without a reply mid-booking
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "1800"))            # seconds of silence in AI chat mode
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))    # evict user_data/chat_data after this
+SESSION_REAP_INTERVAL = 300.0                                      # seconds between reaper runs
+
+# Update processing: different chats run concurrently, one chat's updates strictly in order
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "500"))  # received but unfinished updates before intake pauses
+
+# Multi-process mode: WORKERS > 1 runs a supervisor that receives updates and shards them by chat
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_QUEUE_SIZE = 1000      # updates buffered per worker before the supervisor waits
+WORKER_RESTART_DELAY = 2.0    # seconds between checks for crashed workers
+WORKER_STOP_TIMEOUT = 30.0    # seconds a worker gets to drain on shutdown
+
+# Message router: optional JSON file {"route": ["extra trigger", ...]} merged into ROUTE_TRIGGERS
+ROUTER_TRIGGERS_FILE = os.getenv("ROUTER_TRIGGERS_FILE", "")
+
+# Knowledge retrieval: only the most relevant knowledge.txt sections go into each prompt
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "4"))
+KNOWLEDGE_PINNED_SECTIONS = ("هوية", "أسلوب")  # identity/style sections, always sent
+
+# Knowledge compiler: what load_knowledge strips from knowledge.txt before it reaches the prompt
+KNOWLEDGE_LANGUAGE = os.getenv("KNOWLEDGE_LANGUAGE", "ar")   # "ar" drops English duplicates, "all" keeps both
+KNOWLEDGE_DROP_SECTIONS = ("تعليمات التحديث",)              # notes for whoever edits the file, not for the bot
+KNOWLEDGE_REQUIRED_SECTIONS = ("هوية", "الاتصال", "الكورسات", "استديو")
+
+# Knowledge hot reload: KNOWLEDGE_FILE is watched (inotify via watchfiles if installed, else mtime polling)
+KNOWLEDGE_WATCH = os.getenv("KNOWLEDGE_WATCH", "1") == "1"
+KNOWLEDGE_DEBOUNCE = 1.0        # seconds without further writes before a change is loaded
+KNOWLEDGE_POLL_INTERVAL = 2.0   # seconds between mtime checks without watchfiles
+
 # ─── بيانات السنتر ────────────────────────────────────────────────────────────
 CENTER = {
     "name": "سنتر Edu",
@@ -138,6 +270,26 @@ def validate_egyptian_phone(phone: str) -> bool:
     return False
 
 
+_ARABIC_DIACRITICS = re.compile(r"[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي",
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4",
+    "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+})
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize_arabic(text: str) -> str:
+    """Normalize Arabic text for matching: drop diacritics/tatweel, unify letter forms, strip punctuation"""
+    if not text:
+        return ""
+    text = _ARABIC_DIACRITICS.sub("", text.lower())
+    text = text.translate(_ARABIC_CHAR_MAP)
+    text = _NON_WORD.sub(" ", text).replace("_", " ")
+    return " ".join(text.split())
+
+
 def chunk_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> List[str]:
     """Split long messages into chunks that fit Telegram's message limit."""
     if len(text) <= max_length:
@@ -160,27 +312,478 @@ def chunk_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> List[str]:
     return chunks
 
 
+# ─── Metrics ──────────────────────────────────────────────────────────────────
+class Metrics:
+    """Lightweight in-process counters and latency samples shown in /stats"""
+
+    def __init__(self, window: int = 500):
+        self.counters: Dict[str, int] = {}
+        self._samples: Dict[str, deque] = {}
+        self._window = window
+
+    def incr(self, name: str, value: int = 1):
+        """Increment a counter"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        """Record a latency sample (seconds), keeping only the last `window` samples"""
+        self._samples.setdefault(name, deque(maxlen=self._window)).append(value)
+
+    def summary(self, name: str) -> Optional[Dict]:
+        """Return count/avg/p95 for a latency series, or None if nothing recorded"""
+        samples = self._samples.get(name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return {
+            "count": len(ordered),
+            "avg": sum(ordered) / len(ordered),
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        }
+
+
+metrics = Metrics()
+
+
+# ─── AI Response Cache ────────────────────────────────────────────────────────
+class ResponseCache:
+    """LRU + TTL cache of AI answers with an optional on-disk SQLite tier"""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        db_path: str = RESPONSE_CACHE_DB,
+        purge_every: int = RESPONSE_CACHE_PURGE_EVERY
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, timeout=10.0, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    " key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at)"
+                )
+                self._db.commit()
+                logger.info(f"✅ Response cache disk tier: {db_path}")
+            except sqlite3.Error as e:
+                logger.error(f"❌ Response cache disk tier disabled: {e}")
+                self._db = None
+
+    @staticmethod
+    def make_key(question: str, prompt_version: str) -> str:
+        """Cache key = normalized question + version of the system prompt"""
+        raw = f"{prompt_version}\x00{normalize_arabic(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT answer, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _disk_set(self, key: str, answer: str, expires_at: float):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, answer, expires_at) VALUES (?, ?, ?)",
+                (key, answer, expires_at)
+            )
+            # Purging is amortized over writes; get() already ignores expired rows
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._db.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    def _disk_clear(self):
+        with self._db_lock:
+            self._db.execute("DELETE FROM response_cache")
+            self._db.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return a cached answer or None (memory first, then disk)"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry and entry[1] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry:
+            del self._entries[key]
+
+        if self._db is not None:
+            try:
+                entry = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Response cache read error: {e}")
+                entry = None
+            if entry and entry[1] > now:
+                self._remember(key, entry[0], entry[1])
+                self.hits += 1
+                return entry[0]
+
+        self.misses += 1
+        return None
+
+    def _remember(self, key: str, answer: str, expires_at: float):
+        self._entries[key] = (answer, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def set(self, key: str, answer: str):
+        """Store an answer in memory and (if enabled) on disk"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, answer, expires_at)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._disk_set, key, answer, expires_at)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Response cache write error: {e}")
+
+    async def clear(self):
+        """Drop every cached answer (used when the knowledge base changes)"""
+        self._entries.clear()
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._disk_clear)
+            except sqlite3.Error as e:
+                logger.error(f"❌ Response cache clear error: {e}")
+        logger.info("🧹 Response cache flushed")
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+    def close(self):
+        """Close the disk tier connection"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+# ─── AI Admission Control ─────────────────────────────────────────────────────
+class AdmissionRejected(Exception):
+    """An AI request was refused before reaching Groq (rate limited or shed)"""
+
+    def __init__(self, reason: str, retry_after: float = 0.0, position: int = 0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.position = position
+
+
+class AdmissionController:
+    """Per-user token buckets + global in-flight limit + bounded wait queue for AI calls"""
+
+    def __init__(
+        self,
+        rate_per_minute: float = AI_RATE_PER_MINUTE,
+        burst: int = AI_RATE_BURST,
+        max_concurrent: int = AI_MAX_CONCURRENT,
+        max_queue: int = AI_MAX_QUEUE
+    ):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._buckets: Dict[int, List[float]] = {}  # user_id -> [tokens, last_refill]
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.waiting = 0
+        self.in_flight = 0
+
+    def _take_token(self, user_id: int) -> float:
+        """Consume one token; returns 0 on success or seconds until a token is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune(now)
+            bucket = self._buckets[user_id] = [float(self.burst), now]
+
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate if self.rate else float("inf")
+
+    def _prune(self, now: float):
+        """Forget buckets that have refilled completely"""
+        full_after = self.burst / self.rate if self.rate else float("inf")
+        self._buckets = {
+            uid: bucket for uid, bucket in self._buckets.items()
+            if now - bucket[1] < full_after
+        }
+
+    @asynccontextmanager
+    async def admit(self, user_id: int):
+        """Hold an AI slot for the duration of the block, or raise AdmissionRejected"""
+        # Shed before touching the bucket: a request that never reaches Groq costs no quota
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            metrics.incr("ai_shed")
+            raise AdmissionRejected("queue_full", position=self.waiting + 1)
+
+        retry_after = self._take_token(user_id)
+        if retry_after:
+            metrics.incr("ai_rate_limited")
+            raise AdmissionRejected("rate_limited", retry_after=retry_after)
+
+        if self._slots.locked():
+            metrics.incr("ai_queued")
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+
+# ─── Retry Policy & Circuit Breaker ──────────────────────────────────────────
+class RetryBudget:
+    """Process-wide token bucket that caps retries to a fraction of requests
+
+    Every request deposits `ratio` tokens and every retry withdraws one, so
+    during an outage retries can't add more than ~ratio extra load on Groq.
+    """
+
+    def __init__(self, ratio: float = API_RETRY_BUDGET_RATIO, reserve: int = API_RETRY_BUDGET_RESERVE):
+        self.ratio = ratio
+        self.reserve = float(reserve)
+        self.tokens = float(reserve)
+
+    def on_request(self):
+        self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def decorrelated_jitter(previous: float, base: float = API_BACKOFF_BASE, cap: float = API_BACKOFF_CAP) -> float:
+    """Next backoff delay: random between base and 3x the previous delay, capped"""
+    return min(cap, random.uniform(base, max(base, previous * 3)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After header as seconds (delta-seconds or HTTP date), None if absent/invalid"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CircuitBreaker:
+    """closed → open on a high failure/slow-call rate; half-open lets one probe through after the cooldown
+
+    Callers record one outcome per logical request (its final result after
+    retries), so a single user's retried failure can't fill the window alone.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        window: int = AI_BREAKER_WINDOW,
+        min_calls: int = AI_BREAKER_MIN_CALLS,
+        failure_rate: float = AI_BREAKER_FAILURE_RATE,
+        slow_call: float = AI_BREAKER_SLOW_CALL,
+        cooldown: float = AI_BREAKER_COOLDOWN
+    ):
+        self.min_calls = min_calls
+        self.threshold = failure_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_count = 0
+        self._outcomes: deque = deque(maxlen=window)  # True = failed or slow
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+
+    def failure_rate(self) -> float:
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a Groq attempt may go out now"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.cooldown:
+                return False
+            self._set_state(self.HALF_OPEN)
+        # Half-open: a single probe at a time (a probe that never reports back expires)
+        if self._probe_started is not None and now - self._probe_started < API_TIMEOUT:
+            return False
+        self._probe_started = now
+        return True
+
+    def record_success(self, latency: float):
+        if latency >= self.slow_call:
+            metrics.incr("ai_breaker_slow_calls")
+            self._record(True)
+        else:
+            self._record(False)
+
+    def record_failure(self):
+        self._record(True)
+
+    def _record(self, failed: bool):
+        if self.state == self.HALF_OPEN:
+            self._probe_started = None
+            if failed:
+                self._open()
+            else:
+                self._outcomes.clear()
+                self._set_state(self.CLOSED)
+            return
+        if self.state == self.OPEN:
+            return  # late result of an attempt started before the breaker opened
+
+        self._outcomes.append(failed)
+        if len(self._outcomes) >= self.min_calls and self.failure_rate() >= self.threshold:
+            self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self.opened_count += 1
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        logger.warning(f"🔌 Groq circuit breaker: {self.state} → {state}")
+        self.state = state
+
+
 # ─── Knowledge Base ───────────────────────────────────────────────────────────
-def load_knowledge() -> str:
-    """تحميل قاعدة المعرفة من الملف الخارجي مع معالجة الأخطاء"""
+class KnowledgeError(Exception):
+    """knowledge.txt is missing something the bot can't answer without"""
+
+
+_ARABIC_CHAR = re.compile(r"[\u0600-\u06FF]")
+_LATIN_CHAR = re.compile(r"[A-Za-z]")
+_SEPARATOR_LINE = re.compile(r"^[\s\-=_*─━═]+$")
+_LATIN_LABEL = re.compile(r" / [A-Za-z][A-Za-z .'-]*(?=[:*]+[^A-Za-z]*$)")  # "**الإصدار / Version:** 2.0"
+_LATIN_SUFFIX = re.compile(r" - [A-Za-z][A-Za-z .'-]*$")                       # "مكتبة - Library"
+
+
+def _arabic_only(line: str, heading: bool = False) -> Optional[str]:
+    """Arabic half of a bilingual line; None for English-only lines (headings are always kept)"""
+    if not _ARABIC_CHAR.search(line):
+        return None if _LATIN_CHAR.search(line) and not heading else line
+    line = _LATIN_SUFFIX.sub("", _LATIN_LABEL.sub("", line))
+    parts = [part for part in line.split(" / ") if _ARABIC_CHAR.search(part) or not _LATIN_CHAR.search(part)]
+    return " / ".join(parts)
+
+
+def compile_knowledge(text: str, language: str = KNOWLEDGE_LANGUAGE) -> str:
+    """Minimize knowledge.txt for the system prompt
+
+    Drops # comments, maintenance sections (KNOWLEDGE_DROP_SECTIONS),
+    separator lines, bold markers, indentation and blank lines; with
+    language "ar" the English duplicates go too. Raises KnowledgeError when
+    a KNOWLEDGE_REQUIRED_SECTIONS heading is missing.
+    """
+    lines: List[str] = []
+    headings: List[str] = []
+    skipping = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line or _SEPARATOR_LINE.match(line) or (line.startswith("#") and not line.startswith("##")):
+            continue
+        heading = _HEADING.match(line)
+        if heading and heading.group(1) == "##":
+            skipping = any(key in heading.group(2) for key in KNOWLEDGE_DROP_SECTIONS)
+        if skipping:
+            continue
+        if language == "ar":
+            line = _arabic_only(line, heading is not None)
+            if line is None:
+                continue
+        line = re.sub(r"\s+", " ", line.replace("**", "")).strip()
+        if line:
+            nested = raw[:2].isspace()  # keep sub-items distinguishable with a single space
+            lines.append(f" {line}" if nested else line)
+            if heading and heading.group(1) == "##":
+                headings.append(line)
+
+    missing = [key for key in KNOWLEDGE_REQUIRED_SECTIONS if not any(key in heading for heading in headings)]
+    if missing:
+        raise KnowledgeError(f"{KNOWLEDGE_FILE} is missing required sections: {', '.join(missing)}")
+
+    compiled = "\n".join(lines)
+    before, after = estimate_tokens(text), estimate_tokens(compiled)
+    logger.info(f"🗜️ Knowledge compiled: ~{before} → ~{after} tokens ({1 - after / max(before, 1):.0%} smaller)")
+    return compiled
+
+
+def load_knowledge(fallback: bool = True) -> str:
+    """تحميل قاعدة المعرفة من الملف الخارجي مع معالجة الأخطاء
+
+    With fallback=False (reloads) a missing, empty or unreadable file raises
+    KnowledgeError instead of swapping the built-in fallback in for it.
+    """
     try:
         path = Path(KNOWLEDGE_FILE)
         if path.exists() and path.is_file():
             text = path.read_text(encoding="utf-8")
             if text.strip():
                 logger.info(f"✅ تم تحميل قاعدة المعرفة من {KNOWLEDGE_FILE} ({len(text)} حرف)")
-                return text
+                return compile_knowledge(text)
             else:
                 logger.warning(f"⚠️ {KNOWLEDGE_FILE} فارغ")
         else:
             logger.warning(f"⚠️ {KNOWLEDGE_FILE} غير موجود")
+    except KnowledgeError:
+        raise  # a broken knowledge file must not silently fall back
     except UnicodeDecodeError as e:
         logger.error(f"❌ خطأ في ترميز الملف {KNOWLEDGE_FILE}: {e}")
     except PermissionError as e:
         logger.error(f"❌ لا توجد صلاحيات لقراءة {KNOWLEDGE_FILE}: {e}")
     except Exception as e:
         logger.error(f"❌ خطأ في تحميل {KNOWLEDGE_FILE}: {type(e).__name__}: {e}")
-    
+
+    if not fallback:
+        raise KnowledgeError(f"{KNOWLEDGE_FILE} is missing, empty or unreadable")
     logger.info("📝 استخدام قاعدة المعرفة الافتراضية")
     return _fallback_knowledge()
 
@@ -199,160 +802,1354 @@ def _fallback_knowledge() -> str:
 تكلم بالعامية المصرية الودودة. لو حد عايز يحجز، قوله يضغط زرار "📅 احجز دلوقتي"."""
 
 
-# ─── Groq AI with Retry Logic ────────────────────────────────────────────────
-class GroqAI:
-    """Groq AI client with retry logic and error handling"""
-    
+# ─── Knowledge Retrieval (BM25 over knowledge.txt sections) ──────────────────
+_HEADING = re.compile(r"^(#{2,3})\s+(.+?)\s*$")
+_ARABIC_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+
+_TOKEN_PIECES = re.compile(r"[\u0600-\u06FF]+|[A-Za-z]+|\d+|[^\s\w]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Prompt-token estimate that accounts for Arabic splitting into more tokens than English
+
+    Arabic words cost ~1 token per 2.5 letters, Latin words ~1 per 4,
+    numbers ~1 per 3 digits, and each symbol/emoji about one token.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text):
+        first = piece[0]
+        if "\u0600" <= first <= "\u06FF":
+            tokens += math.ceil(len(piece) / 2.5)
+        elif first.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif first.isascii() and first.isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += 1
+    return max(1, tokens)
+
+
+def tokenize_arabic(text: str) -> List[str]:
+    """Normalize and split text into search terms, stripping common Arabic prefixes"""
+    terms = []
+    for word in normalize_arabic(text).split():
+        for prefix in _ARABIC_PREFIXES:
+            if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+                word = word[len(prefix):]
+                break
+        if len(word) > 1 or word.isdigit():
+            terms.append(word)
+    return terms
+
+
+def split_knowledge_sections(text: str) -> List[Tuple[str, str]]:
+    """Split the knowledge file on its ##/### headings into (title, text) sections
+
+    ### sections carry their parent ## heading so each section reads on its
+    own. Text before the first heading (the file banner) is dropped; a file
+    without any headings becomes a single section.
+    """
+    sections: List[Tuple[str, str]] = []
+    parent = ""
+    title = None
+    lines: List[str] = []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if title is not None and body:
+            sections.append((title, body))
+
+    for line in text.splitlines():
+        match = _HEADING.match(line)
+        if not match:
+            lines.append(line)
+            continue
+        flush()
+        level, heading = match.groups()
+        if level == "##":
+            parent = heading
+            title = heading
+            lines = [line]
+        else:
+            title = f"{parent} › {heading}" if parent else heading
+            lines = [f"## {parent}", line] if parent else [line]
+
+    flush()
+    if not sections and text.strip():
+        sections.append(("", text.strip()))
+    return sections
+
+
+class KnowledgeIndex:
+    """In-memory BM25 index over knowledge sections with incremental rebuilds"""
+
+    K1 = 1.5
+    B = 0.75
+
     def __init__(self):
-        self.knowledge = load_knowledge()
-        self.system_prompt = self._build_system_prompt()
-        logger.info("🤖 Groq AI initialized")
+        self.sections: List[Tuple[str, str]] = []
+        self._term_freqs: List[Dict[str, int]] = []
+        self._lengths: List[int] = []
+        self._doc_freq: Dict[str, int] = {}
+        self._avg_length = 0.0
+        self._by_digest: Dict[str, Dict[str, int]] = {}
+        self.pinned: List[int] = []
 
-    def _build_system_prompt(self) -> str:
-        """بناء الـ system prompt للذكاء الاصطناعي"""
-        return f"""أنت "إيدو" - المساعد الذكي لسنتر Edu ومطبعة X.press.
+    @staticmethod
+    def _digest(title: str, body: str) -> str:
+        return hashlib.sha1(f"{title}\x00{body}".encode("utf-8")).hexdigest()
 
-{self.knowledge}
+    def rebuild(self, text: str) -> Tuple[int, int]:
+        """(Re)index the knowledge text; unchanged sections reuse their term stats
 
-تعليمات مهمة:
-- رد دايماً بالعربي العامي المصري
-- كن مختصر وواضح ومفيد (لا تتجاوز 500 كلمة)
-- لو حد عايز يحجز، قوله يضغط زرار "📅 احجز دلوقتي"
-- لو السؤال مش متعلق بالسنتر أو الاستديو، اعتذر بأدب وخليه يسأل عن خدماتنا
-- استخدم الإيموجي بشكل معتدل
-- لا تدعي معرفة معلومات غير موجودة في قاعدة المعرفة"""
+        Returns (total sections, sections that had to be re-tokenized).
+        """
+        sections = split_knowledge_sections(text)
+        by_digest: Dict[str, Dict[str, int]] = {}
+        term_freqs: List[Dict[str, int]] = []
+        changed = 0
 
-    async def ask(self, message: str, history: Optional[List[Dict]] = None) -> Optional[str]:
-        """إرسال سؤال للـ AI مع تاريخ المحادثة وآلية إعادة المحاولة"""
-        if not GROQ_API_KEY:
-            logger.warning("⚠️ GROQ_API_KEY not configured")
-            return f"خدمة الذكاء الاصطناعي غير متاحة دلوقتي.\nتواصل معنا مباشرة على {CENTER['phone']} 😊"
+        for title, body in sections:
+            digest = self._digest(title, body)
+            freqs = self._by_digest.get(digest)
+            if freqs is None:
+                changed += 1
+                freqs = {}
+                for term in tokenize_arabic(f"{title}\n{body}"):
+                    freqs[term] = freqs.get(term, 0) + 1
+            by_digest[digest] = freqs
+            term_freqs.append(freqs)
 
-        # Sanitize input
-        message = sanitize_input(message, max_length=1000)
-        if not message:
-            return "عذراً، لم أستطع فهم رسالتك. حاول مرة أخرى 😊"
+        doc_freq: Dict[str, int] = {}
+        for freqs in term_freqs:
+            for term in freqs:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
 
-        # Build messages
-        messages = [{"role": "system", "content": self.system_prompt}]
-        if history:
-            # Only keep last N messages to avoid token limits
-            messages.extend(history[-MAX_HISTORY_MESSAGES:])
-        messages.append({"role": "user", "content": message})
+        self.sections = sections
+        self._term_freqs = term_freqs
+        self._lengths = [sum(freqs.values()) for freqs in term_freqs]
+        self._doc_freq = doc_freq
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        self._by_digest = by_digest
+        self.pinned = [
+            i for i, (title, _) in enumerate(sections)
+            if not title or any(key in title for key in KNOWLEDGE_PINNED_SECTIONS)
+        ]
+        return len(sections), changed
 
-        # Retry logic
-        last_error = None
-        for attempt in range(1, API_MAX_RETRIES + 1):
-            try:
-                async with httpx.AsyncClient(timeout=API_TIMEOUT) as client:
-                    response = await client.post(
-                        GROQ_API_URL,
-                        headers={
-                            "Authorization": f"Bearer {GROQ_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": GROQ_MODEL,
-                            "messages": messages,
-                            "temperature": 0.7,
-                            "max_tokens": 800,
-                            "top_p": 0.9,
-                        }
-                    )
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if "choices" in result and len(result["choices"]) > 0:
-                        content = result["choices"][0]["message"]["content"]
-                        logger.info(f"✅ Groq API response received (attempt {attempt})")
-                        return content
-                    else:
-                        logger.error(f"⚠️ Unexpected Groq API response format: {result}")
-                        return None
-                        
-            except httpx.TimeoutException as e:
-                last_error = e
-                logger.warning(f"⏱️ Groq API timeout (attempt {attempt}/{API_MAX_RETRIES})")
-                if attempt < API_MAX_RETRIES:
-                    continue
-                    
-            except httpx.HTTPStatusError as e:
-                last_error = e
-                status_code = e.response.status_code
-                logger.error(f"❌ Groq HTTP error {status_code} (attempt {attempt}/{API_MAX_RETRIES}): {e}")
-                
-                # Don't retry on client errors (4xx)
-                if 400 <= status_code < 500:
-                    if status_code == 401:
-                        return "خطأ في مفتاح API. تواصل مع المسؤول."
-                    elif status_code == 429:
-                        return "تم تجاوز حد الطلبات. حاول مرة أخرى بعد قليل 🙏"
-                    return None
-                    
-                # Retry on server errors (5xx)
-                if attempt < API_MAX_RETRIES:
-                    continue
-                    
-            except httpx.RequestError as e:
-                last_error = e
-                logger.error(f"❌ Groq request error (attempt {attempt}/{API_MAX_RETRIES}): {e}")
-                if attempt < API_MAX_RETRIES:
-                    continue
-                    
-            except Exception as e:
-                last_error = e
-                logger.error(f"❌ Unexpected Groq error (attempt {attempt}/{API_MAX_RETRIES}): {type(e).__name__}: {e}")
-                if attempt < API_MAX_RETRIES:
+    def updated(self, text: str) -> Tuple["KnowledgeIndex", int]:
+        """A new index for text, reusing this one's term stats; this index stays untouched"""
+        index = KnowledgeIndex()
+        index._by_digest = self._by_digest
+        _, changed = index.rebuild(text)
+        return index, changed
+
+    def search(self, query: str, top_k: int = KNOWLEDGE_TOP_K) -> List[int]:
+        """Return indices of the top_k sections by BM25 score (score > 0 only)"""
+        terms = set(tokenize_arabic(query))
+        if not terms or not self.sections:
+            return []
+
+        total = len(self.sections)
+        scores = []
+        for i, freqs in enumerate(self._term_freqs):
+            score = 0.0
+            norm = self.K1 * (1 - self.B + self.B * self._lengths[i] / (self._avg_length or 1))
+            for term in terms:
+                tf = freqs.get(term)
+                if not tf:
                     continue
+                df = self._doc_freq[term]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                score += idf * tf * (self.K1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((score, i))
 
-        # All retries failed
-        logger.error(f"❌ All Groq API retries failed. Last error: {last_error}")
-        return "الرد بياخد وقت أكتر من المعتاد، حاول تاني بعد شوية 🙏"
+        scores.sort(reverse=True)
+        return [i for _, i in scores[:top_k]]
 
-    def reload_knowledge(self) -> bool:
-        """إعادة تحميل قاعدة المعرفة بدون ريستارت"""
-        try:
-            self.knowledge = load_knowledge()
-            self.system_prompt = self._build_system_prompt()
-            logger.info("🔄 تم إعادة تحميل قاعدة المعرفة بنجاح")
-            return True
-        except Exception as e:
-            logger.error(f"❌ فشل إعادة تحميل قاعدة المعرفة: {e}")
-            return False
+    def select(self, query: str, top_k: int = KNOWLEDGE_TOP_K) -> str:
+        """Pinned sections plus the top_k matches for the query, in file order"""
+        chosen = set(self.pinned) | set(self.search(query, top_k))
+        return "\n\n".join(self.sections[i][1] for i in sorted(chosen))
 
 
-# ─── Database with Connection Context Manager ────────────────────────────────
-class Database:
-    """Database handler with proper connection management and error handling"""
-    
-    def __init__(self, db_path: str = "edu_bookings.db"):
-        self.db_path = db_path
-        self._init_db()
+# ─── Local FAQ / Intent Fast Path ────────────────────────────────────────────
+# (intent, weight, phrases) — phrases are normalized and tokenized like queries
+INTENT_PHRASES = [
+    ("address", 2.0, ("العنوان", "عنوانكم", "مكانكم", "مكان السنتر", "لوكيشن السنتر", "اوصلكم")),
+    ("address", 1.0, ("فين", "مكان")),
+    ("phone", 2.0, ("رقم", "رقمكم", "تليفون", "تلفون", "موبايل", "واتساب", "اكلمكم", "اتصل")),
+    ("hours", 2.0, ("مواعيد", "مواعيدكم", "ساعات العمل", "فاتحين", "بتفتحوا", "بتقفلوا")),
+    ("hours", 1.0, ("امتى", "النهارده", "الجمعه")),
+    ("courses", 2.0, ("كورس", "كورسات", "الكورسات", "دوره", "دورات")),
+    ("courses", 1.0, ("بكام", "سعر", "اسعار", "تمن", "كام")),
+    ("studio", 2.0, ("استديو", "استوديو", "باقه", "باقات", "تصوير")),
+    ("studio", 1.0, ("بكام", "سعر", "اسعار", "تمن")),
+    ("greeting", 2.0, ("السلام عليكم", "اهلا", "مرحبا", "هاي", "صباح الخير", "مساء الخير")),
+]
 
-    @contextmanager
-    def _get_connection(self):
-        """Context manager for database connections"""
-        conn = None
+# Filler words that neither count towards nor against a match
+INTENT_STOPWORDS = {
+    normalize_arabic(w) for w in (
+        "هو", "هي", "ايه", "اي", "لو", "سمحت", "سمحتي", "عايز", "عاوز", "عايزه", "اعرف", "ممكن",
+        "انا", "يا", "في", "فيه", "هل", "من", "على", "عن", "ولا", "و", "بتاع", "بتاعكم", "كده",
+        "بعد", "لي", "ليا", "حضرتك", "شكرا", "مين", "ازاي", "دلوقتي",
+    )
+}
+
+
+class IntentClassifier:
+    """Token-phrase automaton + scoring over common questions, answered from local data
+
+    Phrases live in a trie keyed by normalized tokens; one pass over the
+    message collects every phrase match and scores intents. Only a clear
+    winner on a short message gets a templated answer, everything else goes
+    to the LLM.
+    """
+
+    def __init__(self):
+        self._trie: Dict = {}
+        self._answers: Dict[str, str] = {}
+
+    def _add(self, intent: str, phrase: str, weight: float):
+        terms = tokenize_arabic(phrase)
+        if not terms:
+            return
+        node = self._trie
+        for term in terms:
+            node = node.setdefault(term, {})
+        node.setdefault("$", {})[intent] = max(weight, node.get("$", {}).get(intent, 0.0))
+
+    def rebuild(self, knowledge: str):
+        """Static intents from the center data plus one intent per FAQ entry in knowledge.txt"""
+        self._trie = {}
+        self._answers = {
+            "address": f"📍 العنوان: {CENTER['address']}\n🕐 {CENTER['hours']}\n📞 {CENTER['phone']}",
+            "phone": f"📞 تقدر تكلمنا على {CENTER['phone']}\n🕐 {CENTER['hours']}",
+            "hours": f"🕐 مواعيدنا: {CENTER['hours']}\n📍 {CENTER['address']}",
+            "courses": "📚 كورسات السنتر:\n\n" + "\n".join(
+                f"{c['name']} — {c['price']} ({c['duration']})" for c in COURSES.values()
+            ) + "\n\nللحجز اضغط \"📅 احجز دلوقتي\" 😊",
+            "studio": f"📸 باقات {CENTER['studio']}:\n\n" + "\n".join(
+                f"{p['name']} — {p['hours']} — {p['price']}" for p in PACKAGES.values()
+            ) + "\n\nللحجز اضغط \"📅 احجز دلوقتي\" 😊",
+            "greeting": f"أهلاً بيك في {CENTER['name']} 👋\nاسألني عن الكورسات أو الاستديو أو المواعيد 😊",
+        }
+        for intent, weight, phrases in INTENT_PHRASES:
+            for phrase in phrases:
+                self._add(intent, phrase, weight)
+
+        # FAQ: "### س: question" headings with a "ج: answer" body
+        faqs = []
+        for title, body in split_knowledge_sections(knowledge):
+            question = title.rsplit("›", 1)[-1].strip()
+            if not question.startswith("س:"):
+                continue
+            answer = next((l.strip()[2:].strip() for l in body.splitlines() if l.strip().startswith("ج:")), "")
+            terms = [t for t in tokenize_arabic(question[2:]) if t not in INTENT_STOPWORDS]
+            if answer and terms:
+                faqs.append((f"faq:{len(faqs)}", answer, terms))
+
+        # Words unique to one FAQ entry are strong evidence for it
+        seen: Dict[str, int] = {}
+        for _, _, terms in faqs:
+            for term in set(terms):
+                seen[term] = seen.get(term, 0) + 1
+        for intent, answer, terms in faqs:
+            self._answers[intent] = answer
+            for term in set(terms):
+                self._add(intent, term, 2.0 if seen[term] == 1 else 1.0)
+
+    def classify(self, text: str) -> Optional[Tuple[str, float]]:
+        """(intent, score) when one intent clearly explains a short message, else None"""
+        terms = tokenize_arabic(text)
+        if not terms or len(terms) > INTENT_MAX_TOKENS:
+            return None
+
+        scores: Dict[str, float] = {}
+        covered = set()
+        for start in range(len(terms)):
+            node = self._trie
+            for end in range(start, len(terms)):
+                node = node.get(terms[end])
+                if node is None:
+                    break
+                for intent, weight in node.get("$", {}).items():
+                    scores[intent] = scores.get(intent, 0.0) + weight
+                    covered.update(range(start, end + 1))
+        if not scores:
+            return None
+
+        unmatched = sum(
+            1 for i, term in enumerate(terms)
+            if i not in covered and term not in INTENT_STOPWORDS
+        )
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        if best < INTENT_MIN_SCORE or best - runner_up < INTENT_MIN_MARGIN or unmatched > INTENT_MAX_UNMATCHED:
+            return None
+        return intent, best
+
+    def answer(self, text: str) -> Optional[str]:
+        """Templated answer for a confident intent match (tracks hit rate and latency)"""
+        started = time.perf_counter()
+        match = self.classify(text)
+        metrics.observe("intent_latency", time.perf_counter() - started)
+        if match is None:
+            metrics.incr("intent_misses")
+            return None
+        intent, score = match
+        metrics.incr("intent_hits")
+        logger.info(f"⚡ Local answer for intent '{intent}' (score {score:.1f})")
+        return self._answers.get(intent)
+
+
+# ─── Knowledge Hot Reload ─────────────────────────────────────────────────────
+class KnowledgeSnapshot:
+    """Everything derived from one version of the knowledge file, swapped in as a whole
+
+    Built off the event loop and never mutated afterwards, so a request that
+    picked up a snapshot keeps a consistent prompt/index/intents even if a
+    newer version is swapped in while it runs.
+    """
+
+    def __init__(self, knowledge: str, index: KnowledgeIndex, intents: IntentClassifier, system_prompt: str):
+        self.knowledge = knowledge
+        self.index = index
+        self.intents = intents
+        self.system_prompt = system_prompt
+        self.version = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:12]
+        self.loaded_at = time.time()
+        self.build_seconds = 0.0
+        self.changed_sections = len(index.sections)
+
+    @classmethod
+    def build(cls, previous: Optional["KnowledgeSnapshot"] = None) -> "KnowledgeSnapshot":
+        """Load, compile, validate and index the knowledge file (blocking; raises KnowledgeError)"""
+        started = time.perf_counter()
+        # Only the first load may fall back; a reload keeps the current version instead
+        knowledge = load_knowledge(fallback=previous is None)
+        if previous is not None:
+            index, changed = previous.index.updated(knowledge)
+        else:
+            index = KnowledgeIndex()
+            _, changed = index.rebuild(knowledge)
+        intents = IntentClassifier()
+        intents.rebuild(knowledge)
+        snapshot = cls(knowledge, index, intents, GroqAI._build_system_prompt(knowledge))
+        snapshot.changed_sections = changed
+        snapshot.build_seconds = time.perf_counter() - started
+        return snapshot
+
+
+class KnowledgeWatcher:
+    """Reloads the knowledge base when KNOWLEDGE_FILE changes on disk
+
+    Uses watchfiles (inotify on Linux) when installed and falls back to
+    polling the file's mtime/size. Bursts of writes are debounced into one
+    reload; a file that fails to load leaves the current version in place.
+    """
+
+    def __init__(self, ai: "GroqAI", path: str = KNOWLEDGE_FILE):
+        self.ai = ai
+        self.path = Path(path)
+        self.backend = ""
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="knowledge-watcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
         try:
-            conn = sqlite3.connect(self.db_path, timeout=10.0)
-            conn.row_factory = sqlite3.Row
-            yield conn
-            conn.commit()
-        except sqlite3.Error as e:
-            if conn:
-                conn.rollback()
-            logger.error(f"❌ Database error: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
+            st = self.path.stat()
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
 
-    def _init_db(self):
-        """Initialize database with proper schema and indices"""
+    async def _run(self):
         try:
-            with self._get_connection() as conn:
-                conn.executescript('''
-                    CREATE TABLE IF NOT EXISTS bookings (
+            import watchfiles  # optional: pip install watchfiles
+        except ImportError:
+            watchfiles = None
+
+        while not self._stop.is_set():
+            try:
+                if watchfiles is not None:
+                    await self._watch_inotify(watchfiles)
+                else:
+                    await self._watch_polling()
+            except Exception as e:
+                logger.error(f"❌ Knowledge watcher error: {type(e).__name__}: {e}")
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=KNOWLEDGE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _watch_inotify(self, watchfiles):
+        self.backend = "watchfiles"
+        logger.info(f"👀 Watching {self.path} for changes (watchfiles)")
+        target = str(self.path.resolve())
+        # Watch the directory: editors often save by writing a new file and renaming it over the old one.
+        # Not recursive, and only events for the target file get through (logs/, the SQLite WAL...).
+        # step = quiet period that ends a burst of writes; debounce caps how long a burst may run
+        async for _ in watchfiles.awatch(
+            Path(target).parent, stop_event=self._stop, recursive=False,
+            watch_filter=lambda change, changed: changed == target,
+            step=int(KNOWLEDGE_DEBOUNCE * 1000), debounce=int(KNOWLEDGE_DEBOUNCE * 10000)
+        ):
+            await self._reload()
+
+    async def _watch_polling(self):
+        self.backend = "polling"
+        logger.info(f"👀 Watching {self.path} for changes (polling every {KNOWLEDGE_POLL_INTERVAL:.0f}s)")
+        last = self._stat()
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=KNOWLEDGE_POLL_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            current = self._stat()
+            if current == last:
+                continue
+            # Debounce: wait until the file has stopped changing
+            while True:
+                await asyncio.sleep(KNOWLEDGE_DEBOUNCE)
+                settled = self._stat()
+                if settled == current:
+                    break
+                current = settled
+            last = current
+            await self._reload()
+
+    async def _reload(self):
+        current = self._stat()
+        if current is None or not current[1]:
+            # Deleted, or truncated mid-save; the next write triggers another reload
+            logger.warning(f"⚠️ {self.path.name} is missing or empty, keeping the current knowledge")
+            return
+        logger.info(f"📝 {self.path.name} changed, reloading knowledge")
+        await self.ai.reload_knowledge()
+
+
+# ─── Conversation History Budget ─────────────────────────────────────────────
+_SENTENCE_END = re.compile(r"(?<=[.!?؟\n])\s")
+
+
+def _first_sentence(text: str, max_chars: int = 120) -> str:
+    sentence = _SENTENCE_END.split(text.strip(), 1)[0].strip()
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "…"
+
+
+def summarize_turns(turns: List["ChatTurn"]) -> List[str]:
+    """Extractive summary lines: the gist of each question and the start of its answer"""
+    lines = []
+    for turn in turns:
+        text = _first_sentence(turn.content)
+        if not text:
+            continue
+        if turn.role == "user":
+            lines.append(f"- سأل: {text}")
+        elif lines and lines[-1].startswith("- سأل:"):
+            lines[-1] += f" ← الرد: {text}"
+        else:
+            lines.append(f"- الرد: {text}")
+    return lines
+
+
+# ─── Session Data ─────────────────────────────────────────────────────────────
+class ChatTurn:
+    """One message of a chat (role + content), with its token estimate computed once"""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = estimate_tokens(content)
+
+    def as_message(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class ChatHistory:
+    """A user's recent chat turns in a fixed-capacity ring buffer, plus the running summary
+
+    Iterating (forwards or reversed) walks the ring in place, so building
+    a prompt never copies the history. When the ring is full or over the
+    token budget, the oldest exchange is folded into the summary.
+    """
+
+    __slots__ = ("_ring", "_start", "_size", "summary")
+
+    def __init__(self, capacity: int = AI_HISTORY_CAPACITY, summary: str = ""):
+        self._ring: List[Optional[ChatTurn]] = [None] * max(2, capacity + capacity % 2)
+        self._start = 0
+        self._size = 0
+        self.summary = summary
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0 or bool(self.summary)
+
+    def __iter__(self):
+        ring, start, capacity = self._ring, self._start, len(self._ring)
+        for i in range(self._size):
+            yield ring[(start + i) % capacity]
+
+    def __reversed__(self):
+        ring, start, capacity = self._ring, self._start, len(self._ring)
+        for i in range(self._size - 1, -1, -1):
+            yield ring[(start + i) % capacity]
+
+    @property
+    def tokens(self) -> int:
+        return sum(turn.tokens for turn in self)
+
+    def _push(self, turn: ChatTurn) -> Optional[ChatTurn]:
+        """Append a turn; returns the oldest one if the ring was full"""
+        capacity = len(self._ring)
+        if self._size < capacity:
+            self._ring[(self._start + self._size) % capacity] = turn
+            self._size += 1
+            return None
+        dropped = self._ring[self._start]
+        self._ring[self._start] = turn
+        self._start = (self._start + 1) % capacity
+        return dropped
+
+    def _pop_oldest(self) -> ChatTurn:
+        turn = self._ring[self._start]
+        self._ring[self._start] = None
+        self._start = (self._start + 1) % len(self._ring)
+        self._size -= 1
+        return turn
+
+    def add_exchange(self, question: str, answer: str, max_tokens: int = AI_HISTORY_TOKEN_BUDGET):
+        """Record a question/answer pair, folding the oldest turns into the summary until it fits
+
+        The newest exchange is always kept verbatim; the summary keeps its
+        newest lines within AI_SUMMARY_TOKEN_BUDGET.
+        """
+        evicted = [turn for turn in (self._push(ChatTurn("user", question)), self._push(ChatTurn("assistant", answer))) if turn]
+        tokens = self.tokens
+        while self._size > 2 and tokens > max_tokens:
+            evicted.append(self._pop_oldest())
+            tokens -= evicted[-1].tokens
+            if self._size and self._ring[self._start].role == "assistant":
+                evicted.append(self._pop_oldest())
+                tokens -= evicted[-1].tokens
+
+        if not evicted:
+            return
+        lines = (self.summary.splitlines() if self.summary else []) + summarize_turns(evicted)
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > AI_SUMMARY_TOKEN_BUDGET:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+
+    def to_json(self) -> Dict:
+        return {"turns": [[turn.role, turn.content] for turn in self], "summary": self.summary}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "ChatHistory":
+        history = cls(summary=data.get("summary", ""))
+        for role, content in data.get("turns", []):
+            history._push(ChatTurn(role, content))
+        return history
+
+    @classmethod
+    def from_messages(cls, messages: List[Dict], summary: str = "") -> "ChatHistory":
+        """Upgrade the old list-of-dicts layout (chat_history + chat_summary)"""
+        history = cls(summary=summary)
+        for message in messages:
+            history._push(ChatTurn(message.get("role", "user"), message.get("content", "")))
+        return history
+
+
+class BookingDraft:
+    """Answers collected so far in the booking conversation"""
+
+    __slots__ = ("type", "name", "phone", "details", "date")
+
+    def __init__(self, type: str = "", name: str = "", phone: str = "", details: str = "", date: str = ""):
+        self.type = type
+        self.name = name
+        self.phone = phone
+        self.details = details
+        self.date = date
+
+    def to_json(self) -> Dict[str, str]:
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field)}
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "BookingDraft":
+        return cls(**{field: data.get(field, "") for field in cls.__slots__})
+
+
+# ─── Groq AI with Retry Logic ────────────────────────────────────────────────
+class _Flight:
+    """One in-flight Groq answer shared by every caller asking the same question"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+_FALLBACK_COURSE_WORDS = tuple(normalize_arabic(w) for w in ("كورس", "دورة", "سعر", "بكام", "تمن", "اسعار"))
+_FALLBACK_STUDIO_WORDS = tuple(normalize_arabic(w) for w in ("استديو", "استوديو", "باقة", "باقات", "تصوير"))
+_FALLBACK_CONTACT_WORDS = tuple(normalize_arabic(w) for w in ("عنوان", "مكان", "فين", "تليفون", "رقم", "مواعيد", "ساعات"))
+
+
+class GroqAI:
+    """Groq AI client with retry logic and error handling"""
+    
+    def __init__(self):
+        self.kb = KnowledgeSnapshot.build()
+        self.kb_error = ""  # why the last reload was rejected (shown in /stats)
+        self._reload_lock: Optional[asyncio.Lock] = None
+        self.cache = ResponseCache()
+        self._flights: Dict[str, _Flight] = {}
+        self.retry_budget = RetryBudget()
+        self.breaker = CircuitBreaker()
+        logger.info(f"📑 Knowledge index built ({len(self.kb.index.sections)} sections, version {self.kb.version})")
+        self._client: Optional[httpx.AsyncClient] = None
+        self._http2 = False
+        self._pool_stats = {"requests": 0, "new_connections": 0}
+        logger.info("🤖 Groq AI initialized")
+
+    # ── Connection pool lifecycle ─────────────────────────────────────────────
+    async def start(self):
+        """Open the shared pooled HTTP client (called from Application.post_init)"""
+        if self._client is not None:
+            return
+
+        http2 = GROQ_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401  (optional: pip install httpx[http2])
+            except ImportError:
+                logger.warning("⚠️ h2 package not installed, falling back to HTTP/1.1 for Groq")
+                http2 = False
+
+        self._http2 = http2
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=API_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=GROQ_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=GROQ_POOL_KEEPALIVE_EXPIRY,
+            ),
+            headers={
+                "Authorization": f"Bearer {GROQ_API_KEY}",
+                "Content-Type": "application/json"
+            },
+        )
+        logger.info(
+            f"🔌 Groq HTTP client opened (http2={http2}, "
+            f"max_connections={GROQ_POOL_MAX_CONNECTIONS}, keepalive={GROQ_POOL_MAX_KEEPALIVE})"
+        )
+
+    async def close(self):
+        """Close the shared HTTP client (called from Application.post_shutdown)"""
+        if self._client is None:
+            return
+        try:
+            await self._client.aclose()
+        except Exception as e:
+            logger.error(f"❌ Error closing Groq HTTP client: {type(e).__name__}: {e}")
+        finally:
+            self._client = None
+        logger.info(f"🔌 Groq HTTP client closed ({self.pool_stats()})")
+        self.cache.close()
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared client, opening it lazily if post_init did not run"""
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    async def _trace(self, event_name: str, info: Dict):
+        """httpcore trace hook — counts freshly opened TCP connections"""
+        if event_name == "connection.connect_tcp.complete":
+            self._pool_stats["new_connections"] += 1
+
+    def pool_stats(self) -> Dict:
+        """Connection pool statistics (requests, new connections, reuse rate)"""
+        requests = self._pool_stats["requests"]
+        new_connections = self._pool_stats["new_connections"]
+        reused = max(requests - new_connections, 0)
+        return {
+            "requests": requests,
+            "new_connections": new_connections,
+            "reuse_rate": (reused / requests) if requests else 0.0,
+            "http2": self._http2,
+        }
+
+    # Current knowledge version (requests capture self.kb once and use that throughout)
+    @property
+    def knowledge(self) -> str:
+        return self.kb.knowledge
+
+    @property
+    def index(self) -> KnowledgeIndex:
+        return self.kb.index
+
+    @property
+    def intents(self) -> IntentClassifier:
+        return self.kb.intents
+
+    @property
+    def system_prompt(self) -> str:
+        return self.kb.system_prompt
+
+    @property
+    def prompt_version(self) -> str:
+        return self.kb.version
+
+    @staticmethod
+    def _build_system_prompt(knowledge: str) -> str:
+        """بناء الـ system prompt للذكاء الاصطناعي"""
+        return f"""أنت "إيدو" - المساعد الذكي لسنتر Edu ومطبعة X.press.
+
+{knowledge}
+
+تعليمات مهمة:
+- رد دايماً بالعربي العامي المصري
+- كن مختصر وواضح ومفيد (لا تتجاوز 500 كلمة)
+- لو حد عايز يحجز، قوله يضغط زرار "📅 احجز دلوقتي"
+- لو السؤال مش متعلق بالسنتر أو الاستديو، اعتذر بأدب وخليه يسأل عن خدماتنا
+- استخدم الإيموجي بشكل معتدل
+- لا تدعي معرفة معلومات غير موجودة في قاعدة المعرفة"""
+
+    def _system_prompt_for(self, query: str, kb: KnowledgeSnapshot) -> str:
+        """System prompt containing only the knowledge sections relevant to the query"""
+        if len(kb.index.sections) <= 1:
+            return kb.system_prompt
+
+        prompt = self._build_system_prompt(kb.index.select(query))
+        full_tokens = estimate_tokens(kb.system_prompt)
+        saved = full_tokens - estimate_tokens(prompt)
+        metrics.incr("prompt_tokens_saved", max(saved, 0))
+        logger.info(f"📑 Knowledge retrieval: ~{full_tokens - saved}/{full_tokens} prompt tokens (saved ~{saved})")
+        return prompt
+
+    def _build_messages(
+        self,
+        message: str,
+        history: Optional[ChatHistory] = None,
+        kb: Optional[KnowledgeSnapshot] = None
+    ) -> List[Dict]:
+        """Build the chat completion payload within AI_PROMPT_TOKEN_BUDGET
+
+        System prompt and question always go in; the conversation summary and
+        then the newest history turns fill whatever budget is left.
+        """
+        history = history if history is not None else ChatHistory()
+        summary = history.summary
+        # Retrieval also looks at the previous user turn so follow-ups ("وده بكام؟") keep context
+        previous = next((turn.content for turn in reversed(history) if turn.role == "user"), "")
+        system = self._system_prompt_for(f"{message}\n{previous}", kb or self.kb)
+        system_tokens = estimate_tokens(system)
+        question_tokens = estimate_tokens(message)
+        remaining = AI_PROMPT_TOKEN_BUDGET - system_tokens - question_tokens
+
+        messages = [{"role": "system", "content": system}]
+        summary_tokens = estimate_tokens(summary)
+        if summary and summary_tokens <= remaining:
+            messages.append({"role": "system", "content": f"ملخص المحادثة اللي فاتت:\n{summary}"})
+            remaining -= summary_tokens
+        else:
+            summary_tokens = 0
+
+        recent: List[ChatTurn] = []
+        history_tokens = 0
+        for turn in reversed(history):
+            if history_tokens + turn.tokens > remaining:
+                break
+            recent.append(turn)
+            history_tokens += turn.tokens
+        if recent and recent[-1].role == "assistant":
+            history_tokens -= recent.pop().tokens
+        messages.extend(turn.as_message() for turn in reversed(recent))
+        messages.append({"role": "user", "content": message})
+
+        total = system_tokens + summary_tokens + history_tokens + question_tokens
+        metrics.observe("prompt_tokens", total)
+        logger.info(
+            f"🧮 Prompt ~{total}/{AI_PROMPT_TOKEN_BUDGET} tokens "
+            f"(system {system_tokens}, summary {summary_tokens}, "
+            f"history {history_tokens} in {len(recent)}/{len(history)} msgs, question {question_tokens})"
+        )
+        return messages
+
+    async def _stream_completion(self, messages: List[Dict], timeout: float = API_TIMEOUT) -> AsyncIterator[str]:
+        """Single streaming request to Groq — yields content deltas from the SSE body"""
+        client = await self._get_client()
+        self._pool_stats["requests"] += 1
+        async with client.stream(
+            "POST",
+            GROQ_API_URL,
+            json={
+                "model": GROQ_MODEL,
+                "messages": messages,
+                "temperature": 0.7,
+                "max_tokens": AI_MAX_REPLY_TOKENS,
+                "top_p": 0.9,
+                "stream": True,
+            },
+            timeout=timeout,
+            extensions={"trace": self._trace},
+        ) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    logger.warning(f"⚠️ Malformed Groq stream chunk: {data[:100]}")
+                    continue
+                choices = chunk.get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    yield delta
+
+    def _local_answer(self, question: str, kb: Optional[KnowledgeSnapshot] = None) -> str:
+        """Degraded-mode answer built from the center data and the closest knowledge sections"""
+        index = (kb or self.kb).index
+        normalized = normalize_arabic(question)
+        parts = []
+
+        if any(word in normalized for word in _FALLBACK_COURSE_WORDS):
+            parts.append("📚 الكورسات:\n" + "\n".join(
+                f"{c['name']} — {c['price']} ({c['duration']})" for c in COURSES.values()
+            ))
+        if any(word in normalized for word in _FALLBACK_STUDIO_WORDS):
+            parts.append("📸 باقات الاستديو:\n" + "\n".join(
+                f"{p['name']} — {p['hours']} — {p['price']}" for p in PACKAGES.values()
+            ))
+        if any(word in normalized for word in _FALLBACK_CONTACT_WORDS):
+            parts.append(
+                f"📍 {CENTER['address']}\n📞 {CENTER['phone']}\n🕐 {CENTER['hours']}"
+            )
+
+        pinned = set(index.pinned)
+        for i in index.search(question, top_k=3):
+            if i in pinned or len(parts) >= 3:
+                continue
+            lines = [line.lstrip("#").replace("**", "").strip() for line in index.sections[i][1].splitlines()]
+            parts.append("\n".join(line for line in lines if line and line != "---"))
+
+        body = "\n\n".join(parts)[:AI_FALLBACK_MAX_CHARS]
+        if not body:
+            body = f"📍 {CENTER['address']}\n📞 {CENTER['phone']}\n🕐 {CENTER['hours']}"
+        return (
+            "⚠️ المساعد الذكي مش متاح دلوقتي، ودي معلومات من دليل السنتر:\n\n"
+            f"{body}\n\n"
+            f"لأي استفسار تاني كلمنا على {CENTER['phone']} 😊"
+        )
+
+    async def ask_stream(self, message: str, history: Optional[ChatHistory] = None) -> AsyncIterator[str]:
+        """إرسال سؤال للـ AI وإرجاع الرد كـ stream من الأجزاء مع آلية إعادة المحاولة"""
+        if not GROQ_API_KEY:
+            logger.warning("⚠️ GROQ_API_KEY not configured")
+            yield f"خدمة الذكاء الاصطناعي غير متاحة دلوقتي.\nتواصل معنا مباشرة على {CENTER['phone']} 😊"
+            return
+
+        # Sanitize input
+        message = sanitize_input(message, max_length=1000)
+        if not message:
+            yield "عذراً، لم أستطع فهم رسالتك. حاول مرة أخرى 😊"
+            return
+
+        kb = self.kb  # a reload mid-request doesn't change the prompt under us
+        if history:
+            async for delta in self._generate(self._build_messages(message, history, kb), kb=kb):
+                yield delta
+            return
+
+        # Stateless questions (no history) are served from the response cache…
+        cache_key = ResponseCache.make_key(message, kb.version)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            logger.info("💾 Response cache hit")
+            yield cached
+            return
+
+        # …or share a single in-flight Groq request with identical concurrent questions
+        flight = self._flights.get(cache_key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[cache_key] = flight
+            messages = self._build_messages(message, kb=kb)
+            flight.task = asyncio.create_task(self._run_flight(cache_key, flight, messages, kb))
+        else:
+            metrics.incr("ai_coalesced")
+            logger.info("🔗 Joined an identical in-flight Groq request")
+
+        async for delta in self._subscribe(cache_key, flight):
+            yield delta
+
+    async def _run_flight(self, key: str, flight: "_Flight", messages: List[Dict], kb: KnowledgeSnapshot):
+        """Producer task: streams one Groq answer into a shared flight"""
+        try:
+            async for delta in self._generate(messages, cache_key=key, kb=kb):
+                flight.chunks.append(delta)
+                async with flight.changed:
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            logger.info("🔗 In-flight Groq request cancelled (no callers left)")
+        except Exception as e:
+            logger.error(f"❌ Shared Groq request failed: {type(e).__name__}: {e}")
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    async def _subscribe(self, key: str, flight: "_Flight") -> AsyncIterator[str]:
+        """Replay and follow a flight's chunks; the last subscriber to leave cancels it"""
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: len(flight.chunks) > position or flight.done)
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    return
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is waiting for this answer any more; stop paying for it
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _generate(
+        self,
+        messages: List[Dict],
+        cache_key: Optional[str] = None,
+        kb: Optional[KnowledgeSnapshot] = None
+    ) -> AsyncIterator[str]:
+        """Call Groq with retries, yielding deltas (or a user-facing error message)
+
+        All attempts share one API_TIMEOUT deadline, enforced with asyncio.timeout
+        up to each attempt's first token (httpx timeouts apply per operation, so
+        on their own a slow connect plus a slow first read could add up past it;
+        after that they bound every read). Timeouts, 5xx and 429 are
+        retried after a decorrelated-jitter backoff (or the server's Retry-After
+        on 429/503) as long as the deadline and the process-wide retry budget
+        allow. Retries only happen before the first token arrives; once text has
+        been yielded a failure ends the stream with the partial answer. Complete
+        answers are stored in the response cache under cache_key.
+
+        The circuit breaker gets one outcome per call: success (with the
+        request's time to first token) or failure once the retries are over.
+        A half-open probe is never retried. Fallback answers come from kb,
+        the snapshot the request started with.
+        """
+        request_started = time.monotonic()
+        deadline = request_started + API_TIMEOUT
+        self.retry_budget.on_request()
+        backoff = API_BACKOFF_BASE
+        last_error = None
+        rate_limited = False
+        for attempt in range(1, API_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                # Groq is failing: answer instantly from local knowledge instead of waiting
+                metrics.incr("ai_fallback_answers")
+                logger.warning("🔌 Groq circuit open, answering from local knowledge")
+                yield self._local_answer(messages[-1]["content"], kb)
+                return
+
+            started = time.monotonic()
+            remaining = deadline - started
+            if remaining <= 0:
+                break
+            received = False
+            parts = []
+            retry_after = None
+            stream = self._stream_completion(messages, timeout=remaining)
+            try:
+                async with asyncio.timeout(remaining):
+                    delta = await anext(stream, None)
+                if delta is not None:
+                    received = True
+                    ttft = time.monotonic() - started
+                    self.breaker.record_success(time.monotonic() - request_started)
+                    metrics.observe("groq_ttft", ttft)
+                    logger.info(f"⚡ Groq time-to-first-token {ttft:.2f}s (attempt {attempt})")
+                    parts.append(delta)
+                    yield delta
+                    async for delta in stream:
+                        parts.append(delta)
+                        yield delta
+
+                if received:
+                    metrics.observe("groq_total", time.monotonic() - started)
+                    logger.info(f"✅ Groq API response received (attempt {attempt})")
+                    if cache_key:
+                        await self.cache.set(cache_key, "".join(parts))
+                else:
+                    self.breaker.record_success(time.monotonic() - request_started)
+                    logger.error("⚠️ Groq API returned an empty response")
+                return
+
+            except (httpx.TimeoutException, TimeoutError) as e:
+                last_error = e
+                logger.warning(f"⏱️ Groq API timeout (attempt {attempt}/{API_MAX_RETRIES})")
+
+            except httpx.HTTPStatusError as e:
+                last_error = e
+                status_code = e.response.status_code
+                logger.error(f"❌ Groq HTTP error {status_code} (attempt {attempt}/{API_MAX_RETRIES}): {e}")
+
+                if status_code in (429, 503):
+                    retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+                rate_limited = status_code == 429
+
+                # Don't retry on other client errors (4xx) — they say nothing about Groq's health
+                if 400 <= status_code < 500 and status_code != 429:
+                    if status_code == 401:
+                        yield "خطأ في مفتاح API. تواصل مع المسؤول."
+                    self.breaker.record_success(time.monotonic() - request_started)
+                    return
+
+            except httpx.RequestError as e:
+                last_error = e
+                logger.error(f"❌ Groq request error (attempt {attempt}/{API_MAX_RETRIES}): {e}")
+
+            except Exception as e:
+                last_error = e
+                logger.error(f"❌ Unexpected Groq error (attempt {attempt}/{API_MAX_RETRIES}): {type(e).__name__}: {e}")
+
+            finally:
+                await stream.aclose()
+
+            if received:
+                # Part of the answer is already on the user's screen — don't repeat it
+                logger.error(f"❌ Groq stream interrupted after partial answer: {last_error}")
+                return
+
+            if attempt == API_MAX_RETRIES or self.breaker.state != CircuitBreaker.CLOSED:
+                break
+            backoff = decorrelated_jitter(backoff)
+            delay = retry_after if retry_after is not None else backoff
+            if time.monotonic() + delay >= deadline:
+                logger.warning(f"⏳ Not retrying Groq: a {delay:.1f}s wait would pass the request deadline")
+                break
+            if not self.retry_budget.try_spend():
+                metrics.incr("groq_retry_budget_exhausted")
+                logger.warning("🪫 Groq retry budget exhausted, not retrying")
+                break
+            metrics.incr("groq_retries")
+            logger.info(f"🔁 Retrying Groq in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        # All retries failed — one failure for the whole request
+        self.breaker.record_failure()
+        logger.error(f"❌ All Groq API retries failed. Last error: {type(last_error).__name__}: {last_error}")
+        if self.breaker.state == CircuitBreaker.OPEN:
+            metrics.incr("ai_fallback_answers")
+            yield self._local_answer(messages[-1]["content"], kb)
+        elif rate_limited:
+            yield "تم تجاوز حد الطلبات. حاول مرة أخرى بعد قليل 🙏"
+        else:
+            yield "الرد بياخد وقت أكتر من المعتاد، حاول تاني بعد شوية 🙏"
+
+    async def ask(self, message: str, history: Optional[ChatHistory] = None) -> Optional[str]:
+        """إرسال سؤال للـ AI مع تاريخ المحادثة وآلية إعادة المحاولة"""
+        parts = [delta async for delta in self.ask_stream(message, history)]
+        return "".join(parts) or None
+
+    async def reload_knowledge(self) -> bool:
+        """إعادة تحميل قاعدة المعرفة بدون ريستارت
+
+        The new snapshot is built in a worker thread and swapped in with a
+        single assignment; the old one stays valid for requests using it.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            previous = self.kb
+            try:
+                snapshot = await asyncio.to_thread(KnowledgeSnapshot.build, previous)
+            except Exception as e:
+                self.kb_error = f"{type(e).__name__}: {e}"
+                metrics.incr("knowledge_reload_failed")
+                logger.error(f"❌ فشل إعادة تحميل قاعدة المعرفة: {e}")
+                return False
+
+            self.kb = snapshot
+            self.kb_error = ""
+            metrics.incr("knowledge_reloads")
+            if snapshot.version != previous.version:
+                await self.cache.clear()
+            logger.info(
+                f"🔄 تم إعادة تحميل قاعدة المعرفة بنجاح — version {previous.version} → {snapshot.version} "
+                f"({snapshot.changed_sections}/{len(snapshot.index.sections)} sections re-indexed, "
+                f"{snapshot.build_seconds * 1000:.0f} ms off-loop)"
+            )
+            return True
+
+
+# ─── Database with Connection Context Manager ────────────────────────────────
+class Database:
+    """Database handler with proper connection management and error handling
+
+    The public API is async: writes run on a single dedicated writer thread
+    (so they never contend with each other) and reads on a small reader pool,
+    keeping sqlite3 off the event loop. At most DB_MAX_PENDING operations
+    may be queued; further callers wait for a slot.
+    """
+    
+    def __init__(self, db_path: str = "edu_bookings.db"):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        self._init_db()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix="db-reader")
+        self._pending = asyncio.Semaphore(DB_MAX_PENDING)
+        self.activity = ActivityBuffer(self)
+
+    # ── Async API ─────────────────────────────────────────────────────────────
+    async def _run(self, executor: ThreadPoolExecutor, func, *args):
+        """Run a blocking DB call on the given executor, bounded by the pending queue"""
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(func, *args))
+
+    async def _write(self, func, *args):
+        return await self._run(self._writer, func, *args)
+
+    async def _read(self, func, *args):
+        return await self._run(self._readers, func, *args)
+
+    def record_activity(self, telegram_id: int, first_name: str, username: Optional[str]):
+        """Count a message from a user; persisted in the next batched flush"""
+        self.activity.record(telegram_id, first_name, username)
+
+    def record_ai_question(self):
+        """Count a question answered by the AI; persisted in the next batched flush"""
+        self.activity.record_ai_question()
+
+    async def save_booking(
+        self,
+        telegram_id: int,
+        name: str,
+        phone: str,
+        booking_type: str,
+        details: str,
+        date: str
+    ) -> Optional[int]:
+        """Save a new booking (and its outbox entry); returns the booking id"""
+        return await self._write(self._save_booking, telegram_id, name, phone, booking_type, details, date)
+
+    async def get_due_notifications(self, limit: int = 20) -> List[sqlite3.Row]:
+        """Unsent admin notifications whose next attempt is due"""
+        return await self._read(self._get_due_notifications, limit)
+
+    async def mark_notification_sent(self, outbox_id: int) -> bool:
+        return await self._write(self._mark_notification_sent, outbox_id)
+
+    async def mark_notification_failed(
+        self, outbox_id: int, error: str, next_attempt_at: float, permanent: bool = False
+    ) -> bool:
+        """Record a failed attempt; permanent=True uses up the remaining attempts at once"""
+        return await self._write(self._mark_notification_failed, outbox_id, error, next_attempt_at, permanent)
+
+    async def update_booking_status(self, booking_id: int, status: str) -> bool:
+        """Update booking status (pending/confirmed/rejected)"""
+        return await self._write(self._update_booking_status, booking_id, status)
+
+    async def get_bookings_page(
+        self,
+        status: Optional[str] = None,
+        booking_type: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        cursor: Optional[Tuple[str, int]] = None,
+        backwards: bool = False,
+        limit: int = BOOKINGS_PAGE_SIZE
+    ) -> Tuple[List[sqlite3.Row], bool]:
+        """One keyset-paginated page of bookings; returns (rows newest-first, more_in_that_direction)"""
+        return await self._read(
+            self._get_bookings_page, status, booking_type, date_from, date_to, cursor, backwards, limit
+        )
+
+    async def get_counters(self) -> Dict[str, int]:
+        """Trigger-maintained totals (bookings_total, bookings_<status>, users_total, ai_questions_total)"""
+        return await self._read(self._get_counters)
+
+    async def get_daily_stats(self, days: int) -> List[sqlite3.Row]:
+        """Daily rollups (bookings:<type>:<status>, new_users, active_users, ai_questions)"""
+        return await self._read(self._get_daily_stats, days)
+
+    async def get_booking_by_id(self, booking_id: int) -> Optional[Tuple]:
+        """Get booking details by ID"""
+        return await self._read(self._get_booking_by_id, booking_id)
+
+    async def load_user_data(self, user_id: int) -> Optional[Tuple[bytes, bool]]:
+        """Stored (blob, compressed) user_data for one user"""
+        return await self._read(self._load_user_data, user_id)
+
+    async def load_conversations(self, name: str) -> List[Tuple[str, str]]:
+        """(key JSON, state JSON) rows of a persistent ConversationHandler"""
+        return await self._read(self._load_conversations, name)
+
+    async def save_persistence_batch(
+        self,
+        users: Dict[int, Optional[Tuple[bytes, bool]]],
+        conversations: Dict[Tuple[str, str], Optional[str]]
+    ) -> bool:
+        """Write changed user_data blobs and conversation states in one transaction (None = delete)"""
+        return await self._write(self._save_persistence_batch, users, conversations)
+
+    async def health_check(self) -> bool:
+        """Round-trip a trivial query on the writer connection (reconnects if broken)"""
+        return await self._write(self._health_check)
+
+    async def start(self):
+        """Start background database tasks (activity flushing)"""
+        await self.activity.start()
+
+    async def close(self):
+        """Wait for queued operations, stop the worker threads and close connections"""
+        await self.activity.stop()
+        await asyncio.to_thread(self._writer.shutdown, True)
+        await asyncio.to_thread(self._readers.shutdown, True)
+        self._close_connections()
+        logger.info("✅ Database workers stopped")
+
+    # ── Blocking implementations (run on worker threads) ─────────────────────
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a long-lived connection tuned for a WAL-mode bot database"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=10.0,
+            cached_statements=DB_STATEMENT_CACHE,
+            check_same_thread=False,  # only closed from another thread, never shared
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        """Per-thread persistent connection, health-checked after idle periods"""
+        local = self._local
+        conn = getattr(local, "conn", None)
+        now = time.monotonic()
+
+        if conn is not None and now - local.last_used > DB_HEALTH_CHECK_IDLE:
+            try:
+                conn.execute("SELECT 1").fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Database connection failed health check, reconnecting: {e}")
+                self._drop_thread_connection()
+                conn = None
+
+        if conn is None:
+            conn = self._connect()
+            local.conn = conn
+            with self._connections_lock:
+                self._connections.add(conn)
+
+        local.last_used = now
+        return conn
+
+    def _drop_thread_connection(self):
+        """Close and forget this thread's connection so the next call reconnects"""
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is None:
+            return
+        with self._connections_lock:
+            self._connections.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def _get_connection(self):
+        """Context manager yielding this thread's persistent connection as one transaction"""
+        conn = self._thread_connection()
+        try:
+            yield conn
+            conn.commit()
+        except sqlite3.Error as e:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            logger.error(f"❌ Database error: {e}")
+            if not isinstance(e, sqlite3.IntegrityError):
+                # Possibly a broken connection — reconnect on next use
+                self._drop_thread_connection()
+            raise
+
+    def _health_check(self) -> bool:
+        try:
+            with self._get_connection() as conn:
+                conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _close_connections(self):
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Error closing database connection: {e}")
+
+    def _init_db(self):
+        """Initialize database with proper schema and indices"""
+        try:
+            with self._get_connection() as conn:
+                conn.executescript('''
+                    CREATE TABLE IF NOT EXISTS bookings (
                         id           INTEGER PRIMARY KEY AUTOINCREMENT,
                         telegram_id  INTEGER NOT NULL,
                         name         TEXT    NOT NULL,
@@ -378,35 +2175,258 @@ class Database:
                     CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings(status);
                     CREATE INDEX IF NOT EXISTS idx_bookings_created_at ON bookings(created_at DESC);
                     CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen DESC);
+
+                    -- Keyset pagination for /bookings (optionally filtered by status or type)
+                    CREATE INDEX IF NOT EXISTS idx_bookings_created_id ON bookings(created_at, id);
+                    CREATE INDEX IF NOT EXISTS idx_bookings_status_created_id ON bookings(status, created_at, id);
+                    CREATE INDEX IF NOT EXISTS idx_bookings_type_created_id ON bookings(booking_type, created_at, id);
+
+                    -- Admin notifications written in the same transaction as the booking
+                    CREATE TABLE IF NOT EXISTS notification_outbox (
+                        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                        booking_id      INTEGER NOT NULL REFERENCES bookings(id),
+                        attempts        INTEGER DEFAULT 0,
+                        next_attempt_at REAL    DEFAULT 0,
+                        last_error      TEXT,
+                        sent_at         TIMESTAMP,
+                        created_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_outbox_pending ON notification_outbox(sent_at, next_attempt_at);
+
+                    -- Statistics maintained incrementally by triggers (O(1) reads for /stats)
+                    CREATE TABLE IF NOT EXISTS counters (
+                        name  TEXT PRIMARY KEY,
+                        value INTEGER NOT NULL DEFAULT 0
+                    );
+
+                    -- Application persistence: one compact blob per user, one row per live conversation
+                    CREATE TABLE IF NOT EXISTS user_data (
+                        user_id    INTEGER PRIMARY KEY,
+                        data       BLOB    NOT NULL,
+                        compressed INTEGER NOT NULL DEFAULT 0,
+                        updated_at TEXT    NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    );
+
+                    CREATE TABLE IF NOT EXISTS conversations (
+                        name  TEXT NOT NULL,
+                        key   TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        PRIMARY KEY (name, key)
+                    ) WITHOUT ROWID;
+
+                    CREATE TABLE IF NOT EXISTS daily_stats (
+                        day    TEXT    NOT NULL,
+                        metric TEXT    NOT NULL,
+                        value  INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, metric)
+                    ) WITHOUT ROWID;
+
+                    CREATE TRIGGER IF NOT EXISTS trg_bookings_stats_insert AFTER INSERT ON bookings
+                    BEGIN
+                        INSERT INTO counters (name, value) VALUES ('bookings_total', 1)
+                            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                        INSERT INTO counters (name, value) VALUES ('bookings_' || NEW.status, 1)
+                            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                        INSERT INTO daily_stats (day, metric, value)
+                            VALUES (date(NEW.created_at), 'bookings:' || NEW.booking_type || ':' || NEW.status, 1)
+                            ON CONFLICT(day, metric) DO UPDATE SET value = value + 1;
+                    END;
+
+                    CREATE TRIGGER IF NOT EXISTS trg_bookings_stats_status AFTER UPDATE OF status ON bookings
+                    WHEN OLD.status IS NOT NEW.status
+                    BEGIN
+                        UPDATE counters SET value = value - 1 WHERE name = 'bookings_' || OLD.status;
+                        INSERT INTO counters (name, value) VALUES ('bookings_' || NEW.status, 1)
+                            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                        UPDATE daily_stats SET value = value - 1
+                            WHERE day = date(OLD.created_at)
+                              AND metric = 'bookings:' || OLD.booking_type || ':' || OLD.status;
+                        INSERT INTO daily_stats (day, metric, value)
+                            VALUES (date(NEW.created_at), 'bookings:' || NEW.booking_type || ':' || NEW.status, 1)
+                            ON CONFLICT(day, metric) DO UPDATE SET value = value + 1;
+                    END;
+
+                    CREATE TRIGGER IF NOT EXISTS trg_bookings_stats_delete AFTER DELETE ON bookings
+                    BEGIN
+                        UPDATE counters SET value = value - 1 WHERE name IN ('bookings_total', 'bookings_' || OLD.status);
+                        UPDATE daily_stats SET value = value - 1
+                            WHERE day = date(OLD.created_at)
+                              AND metric = 'bookings:' || OLD.booking_type || ':' || OLD.status;
+                    END;
+
+                    CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+                    BEGIN
+                        INSERT INTO counters (name, value) VALUES ('users_total', 1)
+                            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                        INSERT INTO daily_stats (day, metric, value) VALUES (date(NEW.first_seen), 'new_users', 1)
+                            ON CONFLICT(day, metric) DO UPDATE SET value = value + 1;
+                        INSERT INTO daily_stats (day, metric, value) VALUES (date(NEW.last_seen), 'active_users', 1)
+                            ON CONFLICT(day, metric) DO UPDATE SET value = value + 1;
+                    END;
+
+                    -- A user counts once per day they are active
+                    CREATE TRIGGER IF NOT EXISTS trg_users_stats_active AFTER UPDATE OF last_seen ON users
+                    WHEN date(NEW.last_seen) IS NOT date(OLD.last_seen)
+                    BEGIN
+                        INSERT INTO daily_stats (day, metric, value) VALUES (date(NEW.last_seen), 'active_users', 1)
+                            ON CONFLICT(day, metric) DO UPDATE SET value = value + 1;
+                    END;
                 ''')
+                self._backfill_stats(conn)
             logger.info("✅ Database initialized successfully")
         except sqlite3.Error as e:
             logger.error(f"❌ Failed to initialize database: {e}")
             raise
 
-    def upsert_user(self, telegram_id: int, first_name: str, username: Optional[str]) -> bool:
-        """Insert or update user information"""
+    _STATS_BACKFILL = (
+        "DELETE FROM counters",
+        "DELETE FROM daily_stats",
+        "INSERT INTO counters (name, value) SELECT 'bookings_total', COUNT(*) FROM bookings",
+        "INSERT INTO counters (name, value) SELECT 'bookings_' || status, COUNT(*) FROM bookings GROUP BY status",
+        "INSERT INTO counters (name, value) SELECT 'users_total', COUNT(*) FROM users",
+        '''INSERT INTO daily_stats (day, metric, value)
+           SELECT date(created_at), 'bookings:' || booking_type || ':' || status, COUNT(*)
+           FROM bookings GROUP BY 1, 2''',
+        '''INSERT INTO daily_stats (day, metric, value)
+           SELECT date(first_seen), 'new_users', COUNT(*) FROM users GROUP BY 1''',
+        '''INSERT INTO daily_stats (day, metric, value)
+           SELECT date(last_seen), 'active_users', COUNT(*) FROM users GROUP BY 1''',
+        "INSERT OR IGNORE INTO counters (name, value) VALUES ('stats_initialized', 1)",
+    )
+
+    def _backfill_stats(self, conn: sqlite3.Connection):
+        """Seed counters/daily_stats from existing rows the first time the triggers are installed
+
+        One BEGIN IMMEDIATE transaction that re-checks the marker after taking
+        the write lock, so worker processes starting together backfill once.
+        """
+        initialized = "SELECT 1 FROM counters WHERE name = 'stats_initialized'"
+        if conn.execute(initialized).fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute(initialized).fetchone():
+                conn.rollback()  # another process got there first
+                return
+            for statement in self._STATS_BACKFILL:
+                conn.execute(statement)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logger.info("📊 Statistics tables backfilled from existing data")
+
+    def _get_counters(self) -> Dict[str, int]:
+        """All maintained counters (a handful of rows)"""
         try:
-            # Sanitize inputs
-            first_name = sanitize_input(first_name, max_length=100)
-            username = sanitize_input(username, max_length=50) if username else ""
-            
             with self._get_connection() as conn:
-                conn.execute('''
-                    INSERT INTO users (telegram_id, first_name, username)
-                    VALUES (?, ?, ?)
+                return {row[0]: row[1] for row in conn.execute('SELECT name, value FROM counters')}
+        except sqlite3.Error as e:
+            logger.error(f"❌ get_counters error: {e}")
+            return {}
+
+    def _get_daily_stats(self, days: int) -> List[sqlite3.Row]:
+        """Daily rollup rows for the last `days` days (UTC)"""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.execute(
+                    '''SELECT day, metric, value FROM daily_stats
+                       WHERE day > date('now', ?)
+                       ORDER BY day''',
+                    (f"-{int(days)} days",)
+                )
+                return cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"❌ get_daily_stats error: {e}")
+            return []
+
+    def _upsert_activity_batch(self, batch: Dict[int, List], ai_questions: int = 0) -> bool:
+        """Apply coalesced activity for many users in one transaction"""
+        try:
+            with self._get_connection() as conn:
+                if ai_questions:
+                    conn.execute(
+                        '''INSERT INTO counters (name, value) VALUES ('ai_questions_total', ?)
+                           ON CONFLICT(name) DO UPDATE SET value = value + excluded.value''',
+                        (ai_questions,)
+                    )
+                    conn.execute(
+                        '''INSERT INTO daily_stats (day, metric, value) VALUES (date('now'), 'ai_questions', ?)
+                           ON CONFLICT(day, metric) DO UPDATE SET value = value + excluded.value''',
+                        (ai_questions,)
+                    )
+                conn.executemany('''
+                    INSERT INTO users (telegram_id, first_name, username, last_seen, total_msgs)
+                    VALUES (?, ?, ?, ?, ?)
                     ON CONFLICT(telegram_id) DO UPDATE SET
-                        last_seen = CURRENT_TIMESTAMP,
-                        total_msgs = total_msgs + 1,
+                        last_seen = excluded.last_seen,
+                        total_msgs = total_msgs + excluded.total_msgs + 1,
                         first_name = excluded.first_name,
                         username = excluded.username
-                ''', (telegram_id, first_name, username))
+                ''', [
+                    # A new user's first message is the insert itself and counts as 0
+                    (telegram_id, first_name, username, seen_at, count - 1)
+                    for telegram_id, (first_name, username, count, seen_at) in batch.items()
+                ])
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"❌ upsert_activity_batch error ({len(batch)} users): {e}")
+            return False
+
+    def _load_user_data(self, user_id: int) -> Optional[Tuple[bytes, bool]]:
+        try:
+            with self._get_connection() as conn:
+                row = conn.execute(
+                    "SELECT data, compressed FROM user_data WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            return (bytes(row[0]), bool(row[1])) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"❌ load_user_data error for {user_id}: {e}")
+            return None
+
+    def _load_conversations(self, name: str) -> List[Tuple[str, str]]:
+        try:
+            with self._get_connection() as conn:
+                return conn.execute(
+                    "SELECT key, state FROM conversations WHERE name = ?", (name,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"❌ load_conversations error for {name}: {e}")
+            return []
+
+    def _save_persistence_batch(
+        self,
+        users: Dict[int, Optional[Tuple[bytes, bool]]],
+        conversations: Dict[Tuple[str, str], Optional[str]]
+    ) -> bool:
+        try:
+            with self._get_connection() as conn:
+                conn.executemany('''
+                    INSERT INTO user_data (user_id, data, compressed, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        data = excluded.data,
+                        compressed = excluded.compressed,
+                        updated_at = excluded.updated_at
+                ''', [(uid, row[0], int(row[1])) for uid, row in users.items() if row is not None])
+                conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = ?",
+                    [(uid,) for uid, row in users.items() if row is None]
+                )
+                conn.executemany('''
+                    INSERT INTO conversations (name, key, state) VALUES (?, ?, ?)
+                    ON CONFLICT(name, key) DO UPDATE SET state = excluded.state
+                ''', [(name, key, state) for (name, key), state in conversations.items() if state is not None])
+                conn.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    [(name, key) for (name, key), state in conversations.items() if state is None]
+                )
             return True
         except sqlite3.Error as e:
-            logger.error(f"❌ upsert_user error: {e}")
+            logger.error(f"❌ save_persistence_batch error ({len(users)} users, {len(conversations)} states): {e}")
             return False
 
-    def save_booking(
+    def _save_booking(
         self,
         telegram_id: int,
         name: str,
@@ -414,8 +2434,11 @@ class Database:
         booking_type: str,
         details: str,
         date: str
-    ) -> bool:
-        """Save a new booking to the database"""
+    ) -> Optional[int]:
+        """Save a new booking and queue its admin notification in one transaction
+
+        Returns the new booking id, or None on failure.
+        """
         try:
             # Sanitize all inputs
             name = sanitize_input(name, max_length=200)
@@ -425,116 +2448,944 @@ class Database:
             date = sanitize_input(date, max_length=200)
             
             with self._get_connection() as conn:
-                conn.execute(
+                cursor = conn.execute(
                     '''INSERT INTO bookings 
                        (telegram_id, name, phone, booking_type, details, preferred_date) 
                        VALUES (?, ?, ?, ?, ?, ?)''',
                     (telegram_id, name, phone, booking_type, details, date)
                 )
-            logger.info(f"✅ Booking saved for user {telegram_id}")
-            return True
+                booking_id = cursor.lastrowid
+                conn.execute(
+                    'INSERT INTO notification_outbox (booking_id) VALUES (?)',
+                    (booking_id,)
+                )
+            logger.info(f"✅ Booking {booking_id} saved for user {telegram_id}")
+            return booking_id
         except sqlite3.Error as e:
             logger.error(f"❌ save_booking error: {e}")
-            return False
+            return None
 
-    def get_all_bookings(self) -> List[Tuple]:
-        """Get all bookings from the database"""
+    def _get_due_notifications(self, limit: int) -> List[sqlite3.Row]:
+        """Outbox entries that are unsent and due, joined with their booking"""
         try:
             with self._get_connection() as conn:
                 cursor = conn.execute(
-                    '''SELECT name, phone, booking_type, details, preferred_date, status, created_at 
-                       FROM bookings 
-                       ORDER BY created_at DESC'''
+                    '''SELECT o.id AS outbox_id, o.attempts, b.id, b.telegram_id, b.name, b.phone,
+                              b.booking_type, b.details, b.preferred_date, b.created_at
+                       FROM notification_outbox o
+                       JOIN bookings b ON b.id = o.booking_id
+                       WHERE o.sent_at IS NULL AND o.attempts < ? AND o.next_attempt_at <= ?
+                       ORDER BY o.id
+                       LIMIT ?''',
+                    (OUTBOX_MAX_ATTEMPTS, time.time(), limit)
                 )
                 return cursor.fetchall()
         except sqlite3.Error as e:
-            logger.error(f"❌ get_all_bookings error: {e}")
+            logger.error(f"❌ get_due_notifications error: {e}")
             return []
 
-    def count_bookings(self) -> int:
-        """Count total number of bookings"""
+    def _mark_notification_sent(self, outbox_id: int) -> bool:
+        try:
+            with self._get_connection() as conn:
+                conn.execute(
+                    'UPDATE notification_outbox SET sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1 WHERE id = ?',
+                    (outbox_id,)
+                )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"❌ mark_notification_sent error: {e}")
+            return False
+
+    def _mark_notification_failed(self, outbox_id: int, error: str, next_attempt_at: float, permanent: bool) -> bool:
+        try:
+            with self._get_connection() as conn:
+                conn.execute(
+                    '''UPDATE notification_outbox
+                       SET attempts = MAX(attempts + 1, ?), last_error = ?, next_attempt_at = ?
+                       WHERE id = ?''',
+                    (OUTBOX_MAX_ATTEMPTS if permanent else 0, error[:500], next_attempt_at, outbox_id)
+                )
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"❌ mark_notification_failed error: {e}")
+            return False
+
+    def _get_bookings_page(
+        self,
+        status: Optional[str],
+        booking_type: Optional[str],
+        date_from: Optional[str],
+        date_to: Optional[str],
+        cursor: Optional[Tuple[str, int]],
+        backwards: bool,
+        limit: int
+    ) -> Tuple[List[sqlite3.Row], bool]:
+        """Keyset pagination on (created_at, id) — only one page is ever read"""
+        where, params = [], []
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if booking_type:
+            where.append("booking_type = ?")
+            params.append(booking_type)
+        if date_from:
+            where.append("created_at >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("created_at < date(?, '+1 day')")
+            params.append(date_to)
+        if cursor:
+            where.append("(created_at, id) > (?, ?)" if backwards else "(created_at, id) < (?, ?)")
+            params.extend(cursor)
+
+        order = "ASC" if backwards else "DESC"
+        sql = (
+            "SELECT id, telegram_id, name, phone, booking_type, details, preferred_date, status, created_at "
+            "FROM bookings "
+            + (f"WHERE {' AND '.join(where)} " if where else "")
+            + f"ORDER BY created_at {order}, id {order} LIMIT ?"
+        )
+        params.append(limit + 1)
+
         try:
             with self._get_connection() as conn:
-                cursor = conn.execute('SELECT COUNT(*) FROM bookings')
-                result = cursor.fetchone()
-                return result[0] if result else 0
+                rows = conn.execute(sql, params).fetchall()
         except sqlite3.Error as e:
-            logger.error(f"❌ count_bookings error: {e}")
-            return 0
+            logger.error(f"❌ get_bookings_page error: {e}")
+            return [], False
 
-    def count_users(self) -> int:
-        """Count total number of users"""
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        return rows, has_more
+
+    def _update_booking_status(self, booking_id: int, status: str) -> bool:
+        """Update booking status (pending/confirmed/rejected)"""
+        if status not in ['pending', 'confirmed', 'rejected']:
+            logger.warning(f"⚠️ Invalid status: {status}")
+            return False
+            
         try:
             with self._get_connection() as conn:
-                cursor = conn.execute('SELECT COUNT(*) FROM users')
-                result = cursor.fetchone()
-                return result[0] if result else 0
+                cursor = conn.execute(
+                    'UPDATE bookings SET status = ? WHERE id = ?',
+                    (status, booking_id)
+                )
+                rows_affected = cursor.rowcount
+                if rows_affected > 0:
+                    logger.info(f"✅ Booking {booking_id} status updated to {status}")
+                    return True
+                else:
+                    logger.warning(f"⚠️ No booking found with id {booking_id}")
+                    return False
         except sqlite3.Error as e:
-            logger.error(f"❌ count_users error: {e}")
-            return 0
+            logger.error(f"❌ update_booking_status error: {e}")
+            return False
 
-    def get_pending_bookings(self) -> List[Tuple]:
-        """Get all pending bookings"""
+    def _get_booking_by_id(self, booking_id: int) -> Optional[Tuple]:
+        """Get booking details by ID"""
         try:
             with self._get_connection() as conn:
                 cursor = conn.execute(
-                    '''SELECT id, name, phone, booking_type, details, preferred_date, created_at 
+                    '''SELECT id, telegram_id, name, phone, booking_type, details, 
+                              preferred_date, status, created_at 
                        FROM bookings 
-                       WHERE status = 'pending' 
-                       ORDER BY created_at DESC'''
+                       WHERE id = ?''',
+                    (booking_id,)
                 )
-                return cursor.fetchall()
+                return cursor.fetchone()
         except sqlite3.Error as e:
-            logger.error(f"❌ get_pending_bookings error: {e}")
+            logger.error(f"❌ get_booking_by_id error: {e}")
+            return None
+
+
+# ─── Write-behind User Activity ──────────────────────────────────────────────
+class ActivityBuffer:
+    """Coalesces per-user activity (message counts, names, last_seen) in memory
+
+    Handlers call record() on every message; a background task flushes the
+    aggregated rows in one batched transaction every ACTIVITY_FLUSH_INTERVAL_MS
+    or as soon as ACTIVITY_FLUSH_MAX_ENTRIES users are pending. A crash loses
+    at most one flush interval of activity counters — never bookings.
+    """
+
+    def __init__(self, db: "Database"):
+        self.db = db
+        self._pending: Dict[int, List] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._ai_questions = 0
+        self.flushed_batches = 0
+
+    def record(self, telegram_id: int, first_name: str, username: Optional[str]):
+        """Register one message from a user (non-blocking)"""
+        first_name = sanitize_input(first_name, max_length=100)
+        username = sanitize_input(username, max_length=50) if username else ""
+        seen_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        entry = self._pending.get(telegram_id)
+        if entry:
+            entry[0], entry[1], entry[3] = first_name, username, seen_at
+            entry[2] += 1
+        else:
+            self._pending[telegram_id] = [first_name, username, 1, seen_at]
+
+        if len(self._pending) >= ACTIVITY_FLUSH_MAX_ENTRIES and self._wakeup:
+            self._wakeup.set()
+
+    def record_ai_question(self):
+        """Count one question sent to the AI (rolled up per day)"""
+        self._ai_questions += 1
+
+    async def start(self):
+        """Start the periodic flush task"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="activity-flush")
+
+    async def _run(self):
+        interval = ACTIVITY_FLUSH_INTERVAL_MS / 1000
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending activity in a single transaction"""
+        if not self._pending and not self._ai_questions:
+            return
+        batch, self._pending = self._pending, {}
+        ai_questions, self._ai_questions = self._ai_questions, 0
+        ok = await self.db._write(self.db._upsert_activity_batch, batch, ai_questions)
+        if ok:
+            self.flushed_batches += 1
+            return
+        self._ai_questions += ai_questions
+        # Put the batch back (merging with anything recorded meanwhile) and retry next round
+        for telegram_id, (first_name, username, count, seen_at) in batch.items():
+            entry = self._pending.get(telegram_id)
+            if entry:
+                entry[2] += count
+            else:
+                self._pending[telegram_id] = [first_name, username, count, seen_at]
+
+    async def stop(self):
+        """Stop the flush task and write whatever is still pending"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+# ─── Admin Notification Outbox ───────────────────────────────────────────────
+class NotificationRejected(Exception):
+    """A notification that can never be delivered as is (bad request, bot blocked, bad ADMIN_ID)"""
+
+
+class NotificationDispatcher:
+    """Drains notification_outbox to the admin in the background
+
+    Bookings enqueue their notification in the same transaction as the
+    booking row, so nothing is lost if Telegram is unreachable; failed sends
+    are retried with exponential backoff up to OUTBOX_MAX_ATTEMPTS. A send
+    that raises NotificationRejected is failed for good on the spot.
+    """
+
+    def __init__(self, db: "Database", send):
+        self.db = db
+        self.send = send  # async (bot, row) -> bool
+        self._bot = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self, bot):
+        """Start draining the outbox with the given bot"""
+        if self._task is None:
+            self._bot = bot
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="notification-outbox")
+
+    def wakeup(self):
+        """Ask the dispatcher to look at the outbox now (e.g. right after a booking)"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"❌ Notification outbox error: {type(e).__name__}: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def drain(self):
+        """Send every due notification once"""
+        for row in await self.db.get_due_notifications():
+            error = "send failed"
+            try:
+                if await self.send(self._bot, row):
+                    await self.db.mark_notification_sent(row["outbox_id"])
+                    continue
+            except NotificationRejected as e:
+                await self.db.mark_notification_failed(row["outbox_id"], str(e), time.time(), permanent=True)
+                logger.error(f"❌ Admin notification for booking {row['id']} rejected, not retrying: {e}")
+                continue
+            except Exception as e:
+                # Counted as an attempt, so a bug in send can't retry the row on every poll forever
+                error = f"{type(e).__name__}: {e}"
+
+            attempts = row["attempts"] + 1
+            delay = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            await self.db.mark_notification_failed(row["outbox_id"], error, time.time() + delay)
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"❌ Giving up notifying admin of booking {row['id']} after {attempts} attempts")
+            else:
+                logger.warning(f"⚠️ Admin notification for booking {row['id']} failed, retry in {delay:.0f}s")
+
+    async def stop(self):
+        """Stop the background task (undelivered entries stay in the outbox)"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+
+# ─── Message Router ───────────────────────────────────────────────────────────
+# (route, match mode, triggers) in priority order. Modes: "contains" anywhere in
+# the message, "exact" whole message, "prefix" start of the message.
+ROUTE_TRIGGERS = [
+    ("booking", "contains", (
+        "📅 احجز دلوقتي", "احجز كورس", "احجز جلسة تصوير",
+        "عايز احجز", "عاوز احجز", "محتاج احجز",
+        "حجز كورس", "حجز جلسة", "حجزلي", "احجزلي",
+        "عايز موعد", "عاوز موعد", "ابي احجز", "ابغى احجز",
+        "📅 احجز كورس دلوقتي", "📅 احجز جلسة تصوير",
+    )),
+    ("chat", "contains", ("💬 اسألنا",)),
+    ("courses", "exact", ("📚 كورسات السنتر",)),
+    ("studio", "exact", ("📸 استديو X.press",)),
+    ("contact", "exact", ("📞 تواصل معنا",)),
+    ("home", "prefix", ("🏠",)),
+]
+
+
+def normalize_trigger(text: str) -> str:
+    """normalize_arabic for routing: same letter folding, but emoji/punctuation are kept"""
+    if not text:
+        return ""
+    text = _ARABIC_DIACRITICS.sub("", text.lower()).translate(_ARABIC_CHAR_MAP)
+    return " ".join(text.split())
+
+
+# Normalized letter → every spelling that folds to it, e.g. "ا" → "اأإآٱ"
+_FOLD_VARIANTS: Dict[str, str] = {}
+for _source, _target in _ARABIC_CHAR_MAP.items():
+    _FOLD_VARIANTS[_target] = _FOLD_VARIANTS.get(_target, _target) + chr(_source)
+
+
+class TriggerTrie:
+    """Character trie of normalized triggers, compiled into one regex for a single C-speed scan
+
+    Letter variants become character classes and spaces match any whitespace
+    run, so raw message text can be scanned without normalizing it first.
+    Sibling branches start with different characters and optional tails are
+    greedy, so each hit is the longest trigger at that position; shorter
+    triggers there are recovered by walking the trie along the hit.
+    """
+
+    _END = ""
+
+    def __init__(self):
+        self._root: Dict = {}
+        self._pattern = None
+
+    def add(self, pattern: str, payload):
+        node = self._root
+        for ch in pattern:
+            node = node.setdefault(ch, {})
+        node.setdefault(self._END, []).append(payload)
+
+    def _add_variant_edges(self, node: Dict):
+        """Let raw spellings (أ/ة/ى, upper case) walk the trie by sharing the normalized child"""
+        for ch, child in list(node.items()):
+            if ch == self._END or child is node:
+                continue
+            for variant in set(_FOLD_VARIANTS.get(ch, ch) + ch.upper()):
+                node.setdefault(variant, child)
+            self._add_variant_edges(child)
+
+    @staticmethod
+    def _char_regex(ch: str) -> str:
+        if ch == " ":
+            return r"\s+"
+        variants = _FOLD_VARIANTS.get(ch)
+        return f"[{re.escape(variants)}]" if variants else re.escape(ch)
+
+    def _to_regex(self, node: Dict) -> str:
+        branches = [
+            self._char_regex(ch) + self._to_regex(child)
+            for ch, child in sorted(node.items()) if ch != self._END
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if self._END in node else body
+
+    def build(self):
+        """Compile the trie; call after the last add()"""
+        body = self._to_regex(self._root)
+        self._pattern = re.compile(body, re.IGNORECASE) if body else None
+        self._add_variant_edges(self._root)
+
+    def find(self, text: str) -> List[Tuple[int, int, object]]:
+        """(start, end, payload) for every trigger occurrence in text (diacritics already removed)"""
+        if self._pattern is None:
             return []
+        matches = []
+        search = self._pattern.search
+        m = search(text)
+        while m:
+            start = m.start()
+            node = self._root
+            in_space = False
+            for offset, ch in enumerate(m.group(), 1):
+                if ch.isspace():
+                    if in_space:
+                        continue
+                    in_space, ch = True, " "
+                else:
+                    in_space = False
+                node = node.get(ch)
+                if node is None:
+                    break
+                if self._END in node:
+                    matches.extend((start, start + offset, payload) for payload in node[self._END])
+            # Resume one character later so overlapping triggers are found too
+            m = search(text, start + 1)
+        return matches
+
+
+class MessageRouter:
+    """Compiles ROUTE_TRIGGERS into one automaton and routes a text message in a single pass"""
+
+    def __init__(self, triggers=ROUTE_TRIGGERS, extra_file: str = ROUTER_TRIGGERS_FILE):
+        extra = self._load_extra(extra_file)
+        self._matcher = TriggerTrie()
+        self.routes: List[str] = []
+        count = 0
+        for priority, (route, mode, phrases) in enumerate(triggers):
+            self.routes.append(route)
+            for phrase in list(phrases) + extra.pop(route, []):
+                pattern = normalize_trigger(phrase)
+                if pattern:
+                    self._matcher.add(pattern, (priority, route, mode))
+                    count += 1
+        if extra:
+            logger.warning(f"⚠️ Unknown routes in {extra_file}: {', '.join(extra)}")
+        self._matcher.build()
+        self._last_message = None
+        self._last_route: Optional[str] = None
+        logger.info(f"🧭 Message router compiled ({count} triggers, {len(self.routes)} routes)")
+
+    @staticmethod
+    def _load_extra(path: str) -> Dict[str, List[str]]:
+        if not path:
+            return {}
+        try:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+            return {str(route): [str(p) for p in phrases] for route, phrases in data.items()}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"❌ Couldn't load router triggers from {path}: {e}")
+            return {}
+
+    def route(self, text: str) -> Optional[str]:
+        """Highest-priority route whose trigger matches the text, or None"""
+        text = text.strip()
+        if _ARABIC_DIACRITICS.search(text):
+            text = _ARABIC_DIACRITICS.sub("", text)
+        best = None
+        for start, end, (priority, route, mode) in self._matcher.find(text):
+            if mode == "exact" and (start or end != len(text)):
+                continue
+            if mode == "prefix" and start:
+                continue
+            if best is None or priority < best[0]:
+                best = (priority, route)
+        return best[1] if best else None
+
+    def route_message(self, message) -> Optional[str]:
+        """route() memoized for the message being dispatched, so every RouteHandler shares one pass"""
+        if message is not self._last_message:
+            self._last_route = self.route(message.text) if message.text else None
+            self._last_message = message
+        return self._last_route
+
+
+class RouteHandler(BaseHandler):
+    """Text messages dispatched by route: one handler and one router pass for all its routes
+
+    check_update returns the matched route and handle_update calls its
+    callback, so PTB checks a single handler instead of one MessageHandler
+    and filter chain per button. `default`, if given, takes the other
+    non-command text messages (the AI fallback).
+    """
+
+    _DEFAULT = "*"
+
+    def __init__(self, router: MessageRouter, callbacks: Dict[str, object], default=None):
+        super().__init__(default or next(iter(callbacks.values())))
+        self.router = router
+        self.callbacks = callbacks
+        self.default = default
+
+    def check_update(self, update: object) -> Optional[str]:
+        if not isinstance(update, Update):
+            return None
+        message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+        if message is None or not message.text:
+            return None
+        route = self.router.route_message(message)
+        if route in self.callbacks:
+            return route
+        if self.default is not None and not filters.COMMAND.filter(message):
+            return self._DEFAULT
+        return None
+
+    async def handle_update(self, update, application, check_result, context):
+        callback = self.callbacks.get(check_result, self.default)
+        return await callback(update, context)
+
+
+# ─── Persistence ──────────────────────────────────────────────────────────────
+def _user_data_default(value):
+    """json.dumps hook for the session types kept in user_data (ChatHistory, BookingDraft)"""
+    to_json = getattr(value, "to_json", None)
+    if to_json is None:
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    return to_json()
+
+
+def user_data_json(data: Dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_user_data_default).encode("utf-8")
+
+
+def encode_user_data(data: Dict) -> Tuple[bytes, bool]:
+    """Compact JSON, zlib-compressed once it is big enough to benefit"""
+    raw = user_data_json(data)
+    if len(raw) >= PERSISTENCE_COMPRESS_MIN:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return packed, True
+    return raw, False
+
+
+def decode_user_data(blob: bytes, compressed: bool) -> Dict:
+    data = json.loads(zlib.decompress(blob) if compressed else blob)
+    history = data.get("chat_history")
+    if isinstance(history, list):  # stored before ChatHistory existed
+        data["chat_history"] = ChatHistory.from_messages(history, data.pop("chat_summary", ""))
+    elif isinstance(history, dict):
+        data["chat_history"] = ChatHistory.from_json(history)
+    if isinstance(data.get("booking"), dict):
+        data["booking"] = BookingDraft.from_json(data["booking"])
+    return data
+
+
+class SQLitePersistence(BasePersistence):
+    """user_data + conversation states in the bot's SQLite database
+
+    PTB calls update_* every update_interval for the users it saw since the
+    last run; blobs identical to what is already stored are skipped and the
+    rest of the round is written in a single transaction on the Database
+    writer thread. user_data is loaded lazily and applied once, on a user's
+    first update; the per-user bookkeeping goes away with drop_user_data.
+
+    Conversation states are stored as [state, last activity]. PTB doesn't
+    persist conversation_timeout jobs, so states older than their handler's
+    timeout are ended on load instead of being restored without one; the
+    deadlines of the others are kept in `restored` for EduBot to re-arm.
+    """
+
+    def __init__(
+        self,
+        db: "Database",
+        update_interval: float = PERSISTENCE_INTERVAL,
+        timeouts: Optional[Dict[str, float]] = None
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.timeouts = timeouts or {}  # conversation name -> conversation_timeout
+        self.restored: Dict[str, Dict[Tuple, float]] = {}  # name -> {key: deadline} of states restored with time left
+        self._loading: Dict[int, asyncio.Future] = {}  # loads in flight
+        self._loaded: Set[int] = set()  # users whose stored data is already in memory
+        self._digests: Dict[int, str] = {}
+        self._pending_users: Dict[int, Optional[Tuple[bytes, bool]]] = {}
+        self._pending_digests: Dict[int, Optional[str]] = {}
+        self._pending_states: Dict[Tuple[str, str], Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Future] = None
+
+    # ── Loading ───────────────────────────────────────────────────────────────
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {}  # loaded per user in refresh_user_data
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        rows = await self.db.load_conversations(name)
+        timeout = self.timeouts.get(name)
+        now = time.time()
+        conversations = {}
+        expired = 0
+        for key, stored in rows:
+            value = json.loads(stored)
+            if isinstance(value, list) and len(value) == 2:
+                state, last_activity = value
+            else:
+                state, last_activity = value, 0.0  # stored without a timestamp: age unknown
+            key = tuple(json.loads(key))
+            if timeout and now - last_activity > timeout:
+                # PTB ends END states on load and deletes them on the next flush
+                state = ConversationHandler.END
+                expired += 1
+            elif timeout and state != ConversationHandler.END:
+                self.restored.setdefault(name, {})[key] = last_activity + timeout
+            conversations[key] = state
+        if expired:
+            logger.info(f"⌛ Ended {expired} '{name}' conversations that timed out while the bot was down")
+        return conversations
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict):
+        """First update from a user: pull their stored user_data into memory
+
+        Called by PTB before every update; only the first one loads. After
+        that the in-memory dict is authoritative, so keys the handlers pop
+        (history, booking draft) stay gone.
+        """
+        if user_id in self._loaded:
+            return
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = self._loading[user_id] = asyncio.ensure_future(self._load_user(user_id))
+        try:
+            stored = await asyncio.shield(loading)
+        except Exception:
+            if self._loading.get(user_id) is loading:
+                del self._loading[user_id]
+            raise
+        if self._loading.get(user_id) is not loading:
+            return  # applied by a concurrent update of the same user, or dropped meanwhile
+        del self._loading[user_id]
+        self._loaded.add(user_id)
+        if stored:
+            for key, value in stored.items():
+                user_data.setdefault(key, value)
+
+    async def _load_user(self, user_id: int) -> Optional[Dict]:
+        if user_id in self._pending_users and self._pending_users[user_id] is None:
+            return None  # deletion not written yet; don't read the old row back
+        row = await self.db.load_user_data(user_id)
+        if row is None:
+            return None
+        self._digests[user_id] = hashlib.sha1(row[0]).hexdigest()
+        try:
+            return decode_user_data(*row)
+        except (ValueError, zlib.error) as e:
+            logger.error(f"❌ Corrupt persisted user_data for {user_id}: {e}")
+            return None
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict):
+        pass
+
+    # ── Writing (batched per update_persistence round) ───────────────────────
+    async def update_user_data(self, user_id: int, data: Dict):
+        try:
+            row = encode_user_data(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"❌ user_data of {user_id} is not serializable: {e}")
+            return
+        digest = hashlib.sha1(row[0]).hexdigest()
+        if self._digests.get(user_id) == digest:
+            metrics.incr("persistence_unchanged")
+            return
+        self._pending_users[user_id] = row
+        self._pending_digests[user_id] = digest
+        await self._flush_soon()
+
+    async def drop_user_data(self, user_id: int):
+        # Forget the user entirely; a later update loads (nothing) from scratch
+        self._loading.pop(user_id, None)
+        self._loaded.discard(user_id)
+        self._digests.pop(user_id, None)
+        self._pending_users[user_id] = None
+        self._pending_digests[user_id] = None
+        await self._flush_soon()
+
+    async def update_conversation(self, name: str, key, new_state):
+        key_json = json.dumps(list(key))
+        self._pending_states[(name, key_json)] = (
+            None if new_state is None else json.dumps([new_state, round(time.time(), 1)])
+        )
+        await self._flush_soon()
+
+    async def update_chat_data(self, chat_id: int, data: Dict):
+        pass
+
+    async def update_bot_data(self, data: Dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def flush(self):
+        """Called by Application.shutdown: write whatever is still pending"""
+        await self._flush_soon()
+
+    async def _flush_soon(self):
+        """Join (or start) the write for the current round of update_* calls"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_batch())
+        await asyncio.shield(self._flush_task)
+
+    async def _flush_batch(self):
+        # update_persistence gathers all update_* calls; let the whole round queue up first
+        await asyncio.sleep(0)
+        users, digests, states = self._pending_users, self._pending_digests, self._pending_states
+        self._pending_users, self._pending_digests, self._pending_states = {}, {}, {}
+        self._flush_task = None
+        if not users and not states:
+            return
+
+        if await self.db.save_persistence_batch(users, states):
+            for user_id, digest in digests.items():
+                if digest is not None:
+                    self._digests[user_id] = digest
+            metrics.incr("persistence_writes", len(users) + len(states))
+            logger.debug(f"💽 Persisted {len(users)} user_data, {len(states)} conversation states")
+        else:
+            # Keep the data for the next round (newer values queued meanwhile win)
+            for user_id, row in users.items():
+                self._pending_users.setdefault(user_id, row)
+                self._pending_digests.setdefault(user_id, digests[user_id])
+            for key, state in states.items():
+                self._pending_states.setdefault(key, state)
+
+
+# ─── Session Lifetime ─────────────────────────────────────────────────────────
+class SessionTracker:
+    """Last activity per user/chat; idle ones have their user_data/chat_data evicted
+
+    PTB keeps a user_data and chat_data dict for everyone who ever wrote to
+    the bot; the reaper bounds that to users seen within the idle TTL.
+    Eviction goes through Application.drop_*_data, so persistence forgets
+    them too (their conversations have timed out by then).
+    """
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL):
+        # Never evict while a conversation could still be waiting for its timeout
+        self.idle_ttl = max(idle_ttl, BOOKING_TIMEOUT, CHAT_TIMEOUT)
+        self._users: Dict[int, float] = {}
+        self._chats: Dict[int, float] = {}
+        self.live = 0
+        self.bytes_held = 0
+        self.evicted = 0
+
+    async def touch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """TypeHandler callback (group -1): runs before every other handler"""
+        now = time.monotonic()
+        if update.effective_user is not None:
+            self._users[update.effective_user.id] = now
+        if update.effective_chat is not None:
+            self._chats[update.effective_chat.id] = now
+
+    def start(self, app: Application, interval: float = SESSION_REAP_INTERVAL):
+        if app.job_queue is None:
+            logger.warning("⚠️ No JobQueue (pip install \"python-telegram-bot[job-queue]\"): idle sessions won't be evicted")
+            return
+        app.job_queue.run_repeating(self._reap_job, interval=interval, first=interval, name="session-reaper")
+
+    async def _reap_job(self, context: ContextTypes.DEFAULT_TYPE):
+        self.reap(context.application)
+
+    def reap(self, app: Application, now: Optional[float] = None) -> int:
+        """Drop data of users/chats idle for longer than idle_ttl; returns users evicted"""
+        cutoff = (now if now is not None else time.monotonic()) - self.idle_ttl
+        idle_users = [user_id for user_id, seen in self._users.items() if seen < cutoff]
+        idle_chats = [chat_id for chat_id, seen in self._chats.items() if seen < cutoff]
+        for user_id in idle_users:
+            del self._users[user_id]
+            app.drop_user_data(user_id)
+        for chat_id in idle_chats:
+            del self._chats[chat_id]
+            app.drop_chat_data(chat_id)
+        self.evicted += len(idle_users)
+        self.measure(app)
+        if idle_users:
+            logger.info(f"🧹 Evicted {len(idle_users)} idle sessions ({self.live} live, ~{self.bytes_held // 1024} KB)")
+        return len(idle_users)
+
+    def measure(self, app: Application):
+        """Refresh the live-session gauges (serialized size stands in for memory held)"""
+        live = [data for data in app.user_data.values() if data]
+        self.live = len(live)
+        self.bytes_held = sum(len(user_data_json(data)) for data in live)
+
+
+# ─── Update Processing ────────────────────────────────────────────────────────
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates of different chats concurrently (up to a limit), each chat's in arrival order
+
+    process_update skips BaseUpdateProcessor's semaphore; otherwise queued
+    updates of a single busy chat would hold concurrency slots. The real
+    limit is applied after the per-chat lock, which is FIFO and therefore
+    keeps ConversationHandler state transitions in order.
+
+    PTB's update fetcher turns every queued update into a task right away,
+    so update_queue stays empty however far behind we are. `pending` counts
+    updates handed to the processor and not finished yet (waiting on their
+    chat, on a slot, or running); UpdateQueue and the webhook server use it
+    to stop taking updates in while it is at max_pending.
+    """
+
+    def __init__(self, max_concurrent: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING):
+        super().__init__(max_concurrent_updates=max_concurrent)
+        self.limit = max_concurrent
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._chats: Dict[int, List] = {}  # chat_id -> [asyncio.Lock, pending updates]
+        self._room = asyncio.Event()
+        self._room.set()
+        self.in_flight = 0
+        self.pending = 0
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[int]:
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, "effective_user", None)
+        return user.id if user is not None else None
+
+    @property
+    def busy_chats(self) -> int:
+        return len(self._chats)
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.max_pending
+
+    async def wait_for_room(self):
+        """Wait until fewer than max_pending updates are outstanding"""
+        while self.saturated:
+            await self._room.wait()
+
+    async def process_update(self, update: object, coroutine) -> None:
+        self.pending += 1
+        if self.saturated:
+            self._room.clear()
+        try:
+            await self.do_process_update(update, coroutine)
+        finally:
+            self.pending -= 1
+            if not self.saturated:
+                self._room.set()
 
-    def update_booking_status(self, booking_id: int, status: str) -> bool:
-        """Update booking status (pending/confirmed/rejected)"""
-        if status not in ['pending', 'confirmed', 'rejected']:
-            logger.warning(f"⚠️ Invalid status: {status}")
-            return False
-            
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            async with self._slots:
+                await self._run(coroutine)
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
         try:
-            with self._get_connection() as conn:
-                cursor = conn.execute(
-                    'UPDATE bookings SET status = ? WHERE id = ?',
-                    (status, booking_id)
-                )
-                rows_affected = cursor.rowcount
-                if rows_affected > 0:
-                    logger.info(f"✅ Booking {booking_id} status updated to {status}")
-                    return True
-                else:
-                    logger.warning(f"⚠️ No booking found with id {booking_id}")
-                    return False
-        except sqlite3.Error as e:
-            logger.error(f"❌ update_booking_status error: {e}")
-            return False
+            async with entry[0]:
+                async with self._slots:
+                    await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
 
-    def get_booking_by_id(self, booking_id: int) -> Optional[Tuple]:
-        """Get booking details by ID"""
+    async def _run(self, coroutine):
+        self.in_flight += 1
         try:
-            with self._get_connection() as conn:
-                cursor = conn.execute(
-                    '''SELECT id, telegram_id, name, phone, booking_type, details, 
-                              preferred_date, status, created_at 
-                       FROM bookings 
-                       WHERE id = ?''',
-                    (booking_id,)
-                )
-                return cursor.fetchone()
-        except sqlite3.Error as e:
-            logger.error(f"❌ get_booking_by_id error: {e}")
-            return None
+            await coroutine
+        finally:
+            self.in_flight -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class UpdateQueue(asyncio.Queue):
+    """Application.update_queue that holds back new updates while the processor is saturated
+
+    The polling Updater awaits put() for each fetched update, so a full
+    processor pauses getUpdates and Telegram keeps the rest. Control items
+    (PTB's stop signal) are never held back.
+    """
+
+    def __init__(self, processor: PerChatUpdateProcessor):
+        super().__init__()
+        self.processor = processor
+
+    async def put(self, item):
+        if isinstance(item, Update):
+            await self.processor.wait_for_room()
+        await super().put(item)
 
 
 # ─── Bot ──────────────────────────────────────────────────────────────────────
 class EduBot:
     """Main bot class with all handlers"""
     
-    def __init__(self):
+    def __init__(self, worker: int = 0, control=None):
+        self.worker = worker
+        self.control = control  # queue to the supervisor (multi-process mode only)
         self.db = Database()
         self.ai = GroqAI()
+        self.notifier = NotificationDispatcher(self.db, self._notify_admin)
+        self.admission = AdmissionController()
+        self.router = MessageRouter()
+        self.updates = PerChatUpdateProcessor()
+        self.sessions = SessionTracker()
+        self.watcher = KnowledgeWatcher(self.ai)
         logger.info("🤖 EduBot initialized")
 
     # ── Helpers ───────────────────────────────────────────────────────────────
@@ -562,14 +3413,57 @@ class EduBot:
         except (ValueError, TypeError):
             return False
 
-    async def _notify_admin(self, context: ContextTypes.DEFAULT_TYPE, booking: Dict, user_id: int, booking_id: int):
-        """Notify admin of new booking with action buttons"""
-        if not ADMIN_ID or not self._is_admin(int(ADMIN_ID)):
-            logger.warning("⚠️ ADMIN_ID not configured or invalid")
+    def _knowledge_line(self) -> str:
+        """Knowledge version, load time and watcher backend, for admins"""
+        kb = self.ai.kb
+        loaded = datetime.fromtimestamp(kb.loaded_at).strftime("%Y-%m-%d %H:%M:%S")
+        watching = f" | مراقبة: {self.watcher.backend}" if self.watcher.backend else ""
+        return f"📖 المعرفة: نسخة {kb.version} | اتحملت {loaded} ({kb.build_seconds * 1000:.0f} ms){watching}"
+
+    def _wake_outbox(self):
+        """Let the outbox dispatcher (worker 0 in multi-process mode) send new notifications now"""
+        if self.worker == 0:
+            self.notifier.wakeup()
+        else:
+            self.broadcast("outbox")
+
+    def broadcast(self, command: str):
+        """Tell the other worker processes about a shared change (no-op with a single process)"""
+        if self.control is None:
             return
-            
         try:
-            btype_label = "📚 كورس" if booking.get("type") == "course" else "📸 جلسة تصوير"
+            self.control.put_nowait((command, self.worker))
+        except queue.Full:
+            logger.warning(f"⚠️ Control queue full, '{command}' not broadcast")
+
+    async def apply_control(self, command: str):
+        """Apply a change another worker made (relayed by the supervisor)"""
+        if command == "reload":
+            await self.ai.reload_knowledge()
+        elif command == "outbox":
+            self.notifier.wakeup()
+        else:
+            logger.warning(f"⚠️ Unknown control command: {command}")
+
+    async def _notify_admin(self, bot, booking: sqlite3.Row) -> bool:
+        """Notify admin of new booking with action buttons (called by the outbox dispatcher)
+
+        Returns False for failures worth retrying; raises NotificationRejected
+        when Telegram refuses the message itself or ADMIN_ID is unusable.
+        """
+        if not ADMIN_ID:
+            raise NotificationRejected("ADMIN_ID not configured")
+        try:
+            admin_id = int(ADMIN_ID)
+        except ValueError:
+            raise NotificationRejected(f"ADMIN_ID is not a Telegram user id: {ADMIN_ID!r}")
+
+        def md(value) -> str:
+            return escape_markdown(str(value), version=1)
+
+        booking_id = booking["id"]
+        try:
+            btype_label = "📚 كورس" if booking["booking_type"] == "course" else "📸 جلسة تصوير"
             keyboard = InlineKeyboardMarkup([
                 [
                     InlineKeyboardButton("✅ تأكيد", callback_data=f"confirm_{booking_id}"),
@@ -579,27 +3473,32 @@ class EduBot:
             
             message_text = (
                 f"🔔 *حجز جديد!*\n\n"
-                f"👤 الاسم: {booking['name']}\n"
-                f"📞 التليفون: {booking['phone']}\n"
+                f"👤 الاسم: {md(booking['name'])}\n"
+                f"📞 التليفون: {md(booking['phone'])}\n"
                 f"🎯 النوع: {btype_label}\n"
-                f"📌 التفاصيل: {booking.get('details', 'لا يوجد')}\n"
-                f"📅 الموعد: {booking.get('date', 'غير محدد')}\n"
-                f"🆔 Telegram ID: `{user_id}`\n"
+                f"📌 التفاصيل: {md(booking['details'] or 'لا يوجد')}\n"
+                f"📅 الموعد: {md(booking['preferred_date'] or 'غير محدد')}\n"
+                f"🆔 Telegram ID: `{booking['telegram_id']}`\n"
                 f"🔖 Booking ID: `{booking_id}`\n"
-                f"🕐 {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+                f"🕐 {str(booking['created_at'])[:16]}"
             )
             
-            await context.bot.send_message(
-                chat_id=int(ADMIN_ID),
+            await bot.send_message(
+                chat_id=admin_id,
                 text=message_text,
                 reply_markup=keyboard,
                 parse_mode="Markdown"
             )
             logger.info(f"✅ Admin notified of booking {booking_id}")
+            return True
+        except (BadRequest, Forbidden) as e:
+            # Unparseable message, unknown chat, bot blocked: the same message would fail again
+            raise NotificationRejected(f"{type(e).__name__}: {e}") from e
         except (TelegramError, ValueError, TypeError) as e:
             logger.error(f"❌ Failed to notify admin: {type(e).__name__}: {e}")
         except Exception as e:
             logger.error(f"❌ Unexpected error notifying admin: {type(e).__name__}: {e}")
+        return False
 
     async def _send_long_message(
         self,
@@ -623,12 +3522,125 @@ class EduBot:
             except TelegramError as e:
                 logger.error(f"❌ Failed to send message chunk {i+1}/{len(chunks)}: {e}")
 
+    async def _edit_stream_message(self, message, text: str) -> bool:
+        """Edit a streamed reply in place; returns False when Telegram asks us to back off"""
+        try:
+            await message.edit_text(text)
+            return True
+        except RetryAfter as e:
+            logger.warning(f"⏳ Telegram edit rate limit hit, backing off {e.retry_after}s")
+            return False
+        except BadRequest as e:
+            # "Message is not modified" and similar are harmless here
+            logger.debug(f"Stream edit skipped: {e}")
+            return True
+        except TelegramError as e:
+            logger.error(f"❌ Failed to edit streamed message: {e}")
+            return True
+
+    async def _reply_streaming(self, update: Update, chunks: AsyncIterator[str], reply_markup=None) -> str:
+        """Send a placeholder and progressively edit it as AI deltas arrive
+
+        Deltas are coalesced so the message is edited at most once per
+        STREAM_EDIT_INTERVAL; when the text outgrows a Telegram message the
+        current one is finalized and the answer continues in a new message.
+        """
+        sent = await update.message.reply_text(STREAM_PLACEHOLDER, reply_markup=reply_markup)
+        full_text = ""
+        offset = 0          # where the current Telegram message starts in full_text
+        rendered = ""       # text currently shown in the current message
+        next_edit_at = 0.0
+
+        async for delta in chunks:
+            full_text += delta
+            current = full_text[offset:]
+
+            # Roll over into a new message before hitting Telegram's limit
+            while len(current) > MAX_MESSAGE_LENGTH:
+                cut = current.rfind("\n", 0, MAX_MESSAGE_LENGTH)
+                if cut <= 0:
+                    cut = current.rfind(" ", 0, MAX_MESSAGE_LENGTH)
+                if cut <= 0:
+                    cut = MAX_MESSAGE_LENGTH
+                await self._edit_stream_message(sent, current[:cut])
+                offset += cut
+                while offset < len(full_text) and full_text[offset].isspace():
+                    offset += 1
+                current = full_text[offset:]
+                sent = await update.message.reply_text(current[:MAX_MESSAGE_LENGTH].strip() or STREAM_PLACEHOLDER)
+                rendered = current[:MAX_MESSAGE_LENGTH]
+                next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+
+            now = time.monotonic()
+            if now >= next_edit_at and current.strip() and current != rendered:
+                if await self._edit_stream_message(sent, current):
+                    rendered = current
+                    next_edit_at = now + STREAM_EDIT_INTERVAL
+                else:
+                    next_edit_at = now + STREAM_EDIT_INTERVAL * 3
+
+        current = full_text[offset:]
+        if not full_text.strip():
+            await self._edit_stream_message(sent, f"مش قادر أرد دلوقتي. تواصل معنا مباشرة على {CENTER['phone']} 😊")
+        elif current != rendered:
+            # Final edit must land even if we were rate limited a moment ago
+            if not await self._edit_stream_message(sent, current):
+                await asyncio.sleep(STREAM_EDIT_INTERVAL)
+                await self._edit_stream_message(sent, current)
+        return full_text
+
+    async def _reply_ai(
+        self,
+        update: Update,
+        text: str,
+        history: Optional[ChatHistory] = None,
+        reply_markup=None
+    ) -> Optional[str]:
+        """Answer a free-text question with the AI (streamed when AI_STREAMING is on)"""
+        try:
+            async with self.admission.admit(update.effective_user.id):
+                return await self._reply_ai_admitted(update, text, history, reply_markup)
+        except AdmissionRejected as e:
+            if e.reason == "rate_limited":
+                msg = f"⏳ براحة شوية 😊 استنى حوالي {max(1, round(e.retry_after))} ثانية وابعت سؤالك تاني."
+            else:
+                msg = (
+                    f"🙏 في ضغط كبير على المساعد دلوقتي — انت رقم {e.position} في الطابور.\n"
+                    f"جرب تاني كمان دقيقة، أو كلمنا على {CENTER['phone']}"
+                )
+            logger.info(f"🚦 AI request from {update.effective_user.id} rejected: {e.reason}")
+            await update.message.reply_text(msg, reply_markup=reply_markup)
+            return None
+
+    async def _reply_ai_admitted(
+        self,
+        update: Update,
+        text: str,
+        history: Optional[ChatHistory],
+        reply_markup
+    ) -> Optional[str]:
+        self.db.record_ai_question()
+        if AI_STREAMING:
+            response = await self._reply_streaming(update, self.ai.ask_stream(text, history), reply_markup)
+            return response or None
+
+        await update.message.chat.send_action("typing")
+        response = await self.ai.ask(text, history)
+        if response:
+            await self._send_long_message(update, response, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(
+                f"مش قادر أرد دلوقتي. تواصل معنا مباشرة على {CENTER['phone']} 😊",
+                reply_markup=reply_markup
+            )
+        return response
+
     # ── /start ────────────────────────────────────────────────────────────────
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         try:
             user = update.effective_user
-            self.db.upsert_user(user.id, user.first_name, user.username)
+            self.db.record_activity(user.id, user.first_name, user.username)
             
             welcome_message = (
                 f"👋 أهلاً وسهلاً يا *{user.first_name}*!\n\n"
@@ -747,15 +3759,15 @@ class EduBot:
     async def book_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start booking conversation"""
         try:
-            context.user_data["booking"] = {}
+            context.user_data["booking"] = BookingDraft()
             text = update.message.text
 
             # Auto-detect booking type from message
             if "كورس" in text:
-                context.user_data["booking"]["type"] = "course"
+                context.user_data["booking"].type = "course"
                 return await self._ask_name(update)
             elif any(w in text for w in ["تصوير", "جلسة", "استديو"]):
-                context.user_data["booking"]["type"] = "studio"
+                context.user_data["booking"].type = "studio"
                 return await self._ask_name(update)
             else:
                 keyboard = [["📚 حجز كورس", "📸 حجز جلسة تصوير"], ["🏠 رجوع"]]
@@ -782,9 +3794,9 @@ class EduBot:
                 return ConversationHandler.END
                 
             if "كورس" in text:
-                context.user_data["booking"]["type"] = "course"
+                context.user_data["booking"].type = "course"
             elif any(w in text for w in ["تصوير", "جلسة"]):
-                context.user_data["booking"]["type"] = "studio"
+                context.user_data["booking"].type = "studio"
             else:
                 await update.message.reply_text("من فضلك اختار من الزرارين 👆")
                 return BOOK_TYPE
@@ -820,7 +3832,7 @@ class EduBot:
                 await update.message.reply_text("⚠️ اكتب اسمك الكامل من فضلك (على الأقل 3 حروف).")
                 return BOOK_NAME
                 
-            context.user_data["booking"]["name"] = name
+            context.user_data["booking"].name = name
             await update.message.reply_text(
                 f"تمام يا *{name}* 👍\n\n📞 رقم تليفونك؟",
                 parse_mode="Markdown"
@@ -846,8 +3858,8 @@ class EduBot:
                 )
                 return BOOK_PHONE
                 
-            context.user_data["booking"]["phone"] = phone
-            btype = context.user_data["booking"].get("type")
+            context.user_data["booking"].phone = phone
+            btype = context.user_data["booking"].type
 
             if btype == "course":
                 keyboard = [[c["name"]] for c in COURSES.values()] + [["🏠 رجوع"]]
@@ -883,7 +3895,7 @@ class EduBot:
                 await update.message.reply_text("تمام! رجعنا للقائمة الرئيسية 😊", reply_markup=MAIN_KEYBOARD)
                 return ConversationHandler.END
                 
-            context.user_data["booking"]["details"] = text
+            context.user_data["booking"].details = text
             await update.message.reply_text(
                 "📅 *إيه الوقت اللي بيناسبك؟*\n\n"
                 "اكتب مثلاً: _الخميس الجاي الساعة 4 العصر_\n"
@@ -903,19 +3915,19 @@ class EduBot:
         """Get preferred date/time"""
         try:
             date_text = sanitize_input(update.message.text.strip(), max_length=200)
-            context.user_data["booking"]["date"] = date_text
+            context.user_data["booking"].date = date_text
             
             b = context.user_data["booking"]
-            btype_label = "📚 كورس" if b.get("type") == "course" else "📸 جلسة تصوير"
+            btype_label = "📚 كورس" if b.type == "course" else "📸 جلسة تصوير"
             
             keyboard = [["✅ تأكيد الحجز", "❌ إلغاء"]]
             summary_msg = (
                 f"📋 *ملخص الحجز:*\n\n"
-                f"👤 الاسم: {b['name']}\n"
-                f"📞 التليفون: {b['phone']}\n"
+                f"👤 الاسم: {b.name}\n"
+                f"📞 التليفون: {b.phone}\n"
                 f"🎯 النوع: {btype_label}\n"
-                f"📌 التفاصيل: {b['details']}\n"
-                f"📅 الوقت: {b['date']}\n\n"
+                f"📌 التفاصيل: {b.details}\n"
+                f"📅 الوقت: {b.date}\n\n"
                 "✅ البيانات صح؟"
             )
             
@@ -940,7 +3952,7 @@ class EduBot:
             text = update.message.text
 
             if self._is_cancel(text):
-                context.user_data["booking"] = {}
+                context.user_data.pop("booking", None)
                 await update.message.reply_text(
                     "تمام! الحجز اتلغى.\nلو عايز تحجز تاني اضغط على زرار \"📅 احجز دلوقتي\" 😊",
                     reply_markup=MAIN_KEYBOARD
@@ -948,36 +3960,25 @@ class EduBot:
                 return ConversationHandler.END
 
             if self._is_confirm(text):
-                b = context.user_data.get("booking", {})
+                b = context.user_data.get("booking") or BookingDraft()
                 
                 # Save to database
-                success = self.db.save_booking(
+                booking_id = await self.db.save_booking(
                     user_id,
-                    b.get("name", ""),
-                    b.get("phone", ""),
-                    b.get("type", ""),
-                    b.get("details", ""),
-                    b.get("date", "")
+                    b.name,
+                    b.phone,
+                    b.type,
+                    b.details,
+                    b.date
                 )
                 
-                if success:
-                    # Get the booking ID of the just-created booking
-                    # We'll get all bookings for this user and take the most recent one
-                    try:
-                        with self.db._get_connection() as conn:
-                            cursor = conn.execute(
-                                'SELECT id FROM bookings WHERE telegram_id = ? ORDER BY created_at DESC LIMIT 1',
-                                (user_id,)
-                            )
-                            result = cursor.fetchone()
-                            booking_id = result[0] if result else None
-                    except Exception as e:
-                        logger.error(f"❌ Failed to get booking ID: {e}")
-                        booking_id = None
+                if booking_id:
+                    # The admin notification is already in the outbox; let the dispatcher send it now
+                    self._wake_outbox()
                     
-                    btype_label = "كورس" if b.get("type") == "course" else "جلسة تصوير"
+                    btype_label = "كورس" if b.type == "course" else "جلسة تصوير"
                     await update.message.reply_text(
-                        f"🎉 *تم الحجز بنجاح يا {b['name']}!*\n\n"
+                        f"🎉 *تم الحجز بنجاح يا {b.name}!*\n\n"
                         f"هيتواصل معك فريقنا قريباً لتأكيد الـ {btype_label}.\n\n"
                         f"📞 {CENTER['phone']}\n"
                         f"📍 {CENTER['address']}\n\n"
@@ -985,19 +3986,13 @@ class EduBot:
                         reply_markup=MAIN_KEYBOARD,
                         parse_mode="Markdown"
                     )
-                    
-                    # Notify admin with booking ID
-                    if booking_id:
-                        await self._notify_admin(context, b, user_id, booking_id)
-                    else:
-                        logger.warning("⚠️ Could not get booking ID for admin notification")
                 else:
                     await update.message.reply_text(
                         "❌ حصل خطأ في حفظ الحجز. حاول مرة أخرى أو تواصل معنا مباشرة.",
                         reply_markup=MAIN_KEYBOARD
                     )
                 
-                context.user_data["booking"] = {}
+                context.user_data.pop("booking", None)
                 return ConversationHandler.END
 
             # Invalid response
@@ -1018,20 +4013,24 @@ class EduBot:
     async def book_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel booking conversation"""
         try:
-            context.user_data["booking"] = {}
+            context.user_data.pop("booking", None)
             await update.message.reply_text("تم الإلغاء 😊", reply_markup=MAIN_KEYBOARD)
             return ConversationHandler.END
         except Exception as e:
             logger.error(f"❌ Error in book_cancel: {e}")
             return ConversationHandler.END
 
+    async def booking_timeout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Booking left unfinished for BOOKING_TIMEOUT: drop the draft and tell the user"""
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        await self._session_expired(context, "booking", context.user_data, chat_id)
+
     # ══════════════════════════════════════════════════════════════
     #  AI CHAT — مع تاريخ المحادثة
     # ══════════════════════════════════════════════════════════════
     async def chat_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start AI chat conversation"""
         try:
-            context.user_data.setdefault("chat_history", [])
             await update.message.reply_text(
                 "💬 اسألني أي سؤال عن الكورسات، الاستديو، الباقات، أو أي حاجة تانية!\n\n"
                 "_اكتب 'رجوع' أو '🏠' للخروج_",
@@ -1053,34 +4052,26 @@ class EduBot:
             text = update.message.text
             
             if self._is_back(text):
-                context.user_data["chat_history"] = []
+                context.user_data.pop("chat_history", None)
                 await update.message.reply_text("رجعنا للقائمة الرئيسية 😊", reply_markup=MAIN_KEYBOARD)
                 return ConversationHandler.END
 
             user = update.effective_user
-            self.db.upsert_user(user.id, user.first_name, user.username)
-
-            # Show typing indicator
-            await update.message.chat.send_action("typing")
-
-            history = context.user_data.get("chat_history", [])
-            response = await self.ai.ask(text, history)
+            self.db.record_activity(user.id, user.first_name, user.username)
 
+            history: Optional[ChatHistory] = context.user_data.get("chat_history")
+            back_keyboard = ReplyKeyboardMarkup([["🏠 رجوع"]], resize_keyboard=True)
+            response = self.ai.intents.answer(text)
             if response:
-                # Save to history
-                history.append({"role": "user", "content": text})
-                history.append({"role": "assistant", "content": response})
-                context.user_data["chat_history"] = history[-10:]  # Keep last 10 messages
-
-                await update.message.reply_text(
-                    response,
-                    reply_markup=ReplyKeyboardMarkup([["🏠 رجوع"]], resize_keyboard=True)
-                )
+                await update.message.reply_text(response, reply_markup=back_keyboard)
             else:
-                await update.message.reply_text(
-                    f"مش قادر أرد دلوقتي. تواصل معنا مباشرة على {CENTER['phone']} 😊",
-                    reply_markup=ReplyKeyboardMarkup([["🏠 رجوع"]], resize_keyboard=True)
-                )
+                response = await self._reply_ai(update, text, history, reply_markup=back_keyboard)
+
+            if response:
+                # Save to history; turns over the capacity/token budget move into the running summary
+                if history is None:
+                    history = context.user_data["chat_history"] = ChatHistory()
+                history.add_exchange(text, response)
             return CHAT_INPUT
         except Exception as e:
             logger.error(f"❌ Error in chat_input: {e}")
@@ -1090,6 +4081,73 @@ class EduBot:
             )
             return CHAT_INPUT
 
+    async def chat_timeout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """AI chat idle for CHAT_TIMEOUT: forget the history and leave chat mode"""
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        await self._session_expired(context, "chat", context.user_data, chat_id)
+
+    # conversation name -> (user_data key it keeps, notice sent when it times out)
+    _SESSION_EXPIRY = {
+        "booking": ("booking", "⏰ الحجز اتلغى عشان مفيش رد من فترة.\nتقدر تبدأ حجز جديد في أي وقت من القائمة 👇"),
+        "chat": ("chat_history", "⏰ المحادثة خلصت عشان مفيش نشاط من فترة.\nلو عندك سؤال تاني اضغط 💬 اسألنا 😊"),
+    }
+
+    async def _session_expired(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        name: str,
+        user_data: Dict,
+        chat_id: Optional[int]
+    ) -> bool:
+        """Drop the conversation's data from user_data and tell the chat; True if there was data"""
+        data_key, text = self._SESSION_EXPIRY[name]
+        had_data = user_data.pop(data_key, None) is not None
+        metrics.incr("sessions_expired")
+        if chat_id is None:
+            return had_data
+        try:
+            await context.bot.send_message(chat_id, text, reply_markup=MAIN_KEYBOARD)
+        except TelegramError as e:
+            logger.warning(f"⚠️ Could not send session-expired notice: {e}")
+        return had_data
+
+    def _arm_restored_timeouts(self, app: Application):
+        """Schedule conversation_timeout for conversations restored from the database
+
+        PTB only arms the timeout when it handles an update, so a restored
+        conversation whose user never writes again would keep its state and
+        draft forever.
+        """
+        persistence = app.persistence
+        if app.job_queue is None or not isinstance(persistence, SQLitePersistence):
+            return
+        now = time.time()
+        armed = 0
+        for handler in self.conversations:
+            for key, deadline in persistence.restored.pop(handler.name, {}).items():
+                if WORKERS > 1 and key[0] % WORKERS != self.worker:
+                    continue  # another worker owns this chat
+                app.job_queue.run_once(
+                    self._restored_timeout, max(0.0, deadline - now),
+                    data=(handler, key), name=f"restored-timeout-{handler.name}",
+                )
+                armed += 1
+        if armed:
+            logger.info(f"⌛ Armed timeouts for {armed} restored conversations")
+
+    async def _restored_timeout(self, context: ContextTypes.DEFAULT_TYPE):
+        """A restored conversation reached its timeout without any update since the restart"""
+        handler, key = context.job.data
+        if key not in handler._conversations or key in handler.timeout_jobs:
+            return  # already ended, or the user came back and PTB armed its own timeout
+        handler._update_state(ConversationHandler.END, key)
+        app = context.application
+        chat_id, user_id = key
+        user_data = app.user_data[user_id]
+        await app.persistence.refresh_user_data(user_id, user_data)  # the draft may only be on disk
+        if await self._session_expired(context, handler.name, user_data, chat_id):
+            app.mark_data_for_update_persistence(user_ids=user_id)
+
     # ── General Message ───────────────────────────────────────────────────────
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle general messages not caught by other handlers"""
@@ -1101,18 +4159,14 @@ class EduBot:
                 return
 
             user = update.effective_user
-            self.db.upsert_user(user.id, user.first_name, user.username)
+            self.db.record_activity(user.id, user.first_name, user.username)
 
-            await update.message.chat.send_action("typing")
-            response = await self.ai.ask(text)
-            
-            if response:
-                await update.message.reply_text(response, reply_markup=MAIN_KEYBOARD)
-            else:
-                await update.message.reply_text(
-                    f"مش قادر أرد دلوقتي. تواصل معنا على {CENTER['phone']} 😊",
-                    reply_markup=MAIN_KEYBOARD
-                )
+            local = self.ai.intents.answer(text)
+            if local:
+                await update.message.reply_text(local, reply_markup=MAIN_KEYBOARD)
+                return
+
+            await self._reply_ai(update, text, reply_markup=MAIN_KEYBOARD)
         except Exception as e:
             logger.error(f"❌ Error in handle_message: {e}")
             await update.message.reply_text(
@@ -1148,7 +4202,7 @@ class EduBot:
                     return
                 
                 # Get booking details
-                booking = self.db.get_booking_by_id(booking_id)
+                booking = await self.db.get_booking_by_id(booking_id)
                 
                 if not booking:
                     await query.edit_message_reply_markup(reply_markup=None)
@@ -1157,11 +4211,11 @@ class EduBot:
                 
                 # Update status based on action
                 if action == "confirm":
-                    success = self.db.update_booking_status(booking_id, "confirmed")
+                    success = await self.db.update_booking_status(booking_id, "confirmed")
                     status_label = "✅ تم تأكيد الحجز"
                     status_emoji = "✅"
                 elif action == "reject":
-                    success = self.db.update_booking_status(booking_id, "rejected")
+                    success = await self.db.update_booking_status(booking_id, "rejected")
                     status_label = "❌ تم رفض الحجز"
                     status_emoji = "❌"
                 else:
@@ -1219,63 +4273,273 @@ class EduBot:
                 pass
 
     # ── Admin Commands ─────────────────────────────────────────────────────────
+    _BOOKING_STATUS_CODES = {"pending": "p", "confirmed": "c", "rejected": "r"}
+    _BOOKING_TYPE_CODES = {"course": "c", "studio": "s"}
+
+    def _parse_bookings_filters(self, args: List[str]) -> Dict[str, Optional[str]]:
+        """Parse /bookings arguments: [pending|confirmed|rejected] [course|studio] [from=YYYY-MM-DD] [to=YYYY-MM-DD]"""
+        parsed = {"status": None, "type": None, "from": None, "to": None}
+        for arg in args:
+            arg = arg.strip().lower()
+            if arg in self._BOOKING_STATUS_CODES:
+                parsed["status"] = arg
+            elif arg in self._BOOKING_TYPE_CODES:
+                parsed["type"] = arg
+            elif arg.startswith(("from=", "to=")):
+                key, _, value = arg.partition("=")
+                datetime.strptime(value, "%Y-%m-%d")  # raises ValueError on bad dates
+                parsed[key] = value
+            else:
+                raise ValueError(f"Unknown filter: {arg}")
+        return parsed
+
+    def _encode_bookings_nav(self, parsed: Dict[str, Optional[str]], direction: str, row: sqlite3.Row) -> str:
+        """Pack filters + keyset cursor into callback data (well under Telegram's 64 bytes)"""
+        status = self._BOOKING_STATUS_CODES.get(parsed["status"], "-")
+        btype = self._BOOKING_TYPE_CODES.get(parsed["type"], "-")
+        date_from = parsed["from"].replace("-", "") if parsed["from"] else "-"
+        date_to = parsed["to"].replace("-", "") if parsed["to"] else "-"
+        stamp = re.sub(r"\D", "", str(row["created_at"]))[:14]
+        return f"bk:{status}{btype}:{date_from}:{date_to}:{direction}:{stamp}:{row['id']}"
+
+    def _decode_bookings_nav(self, data: str) -> Tuple[Dict[str, Optional[str]], Tuple[str, int], bool]:
+        """Inverse of _encode_bookings_nav → (filters, cursor, backwards)"""
+        _, codes, date_from, date_to, direction, stamp, booking_id = data.split(":")
+        statuses = {v: k for k, v in self._BOOKING_STATUS_CODES.items()}
+        types = {v: k for k, v in self._BOOKING_TYPE_CODES.items()}
+
+        def as_date(value: str) -> Optional[str]:
+            return f"{value[:4]}-{value[4:6]}-{value[6:8]}" if value != "-" else None
+
+        parsed = {
+            "status": statuses.get(codes[0]),
+            "type": types.get(codes[1]),
+            "from": as_date(date_from),
+            "to": as_date(date_to),
+        }
+        created_at = f"{stamp[:4]}-{stamp[4:6]}-{stamp[6:8]} {stamp[8:10]}:{stamp[10:12]}:{stamp[12:14]}"
+        return parsed, (created_at, int(booking_id)), direction == "p"
+
+    async def _render_bookings_page(
+        self,
+        parsed: Dict[str, Optional[str]],
+        cursor: Optional[Tuple[str, int]] = None,
+        backwards: bool = False
+    ) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """Fetch one page and build its text plus prev/next buttons"""
+        rows, has_more = await self.db.get_bookings_page(
+            parsed["status"], parsed["type"], parsed["from"], parsed["to"], cursor, backwards
+        )
+        if not rows:
+            if cursor is None:
+                return "📭 لا توجد حجوزات حتى الآن.", None
+            return "📭 مفيش حجوزات تانية في الاتجاه ده.", None
+
+        labels = [v for v in (parsed["status"], parsed["type"]) if v]
+        if parsed["from"] or parsed["to"]:
+            labels.append(f"{parsed['from'] or '…'} → {parsed['to'] or '…'}")
+        header = f"📋 *الحجوزات*" + (f" ({' | '.join(labels)})" if labels else "")
+        msg = f"{header}\n{'─' * 25}\n\n"
+
+        def md(value) -> str:
+            return escape_markdown(str(value), version=1)
+
+        # Stop before the limit instead of slicing: the "older" cursor then
+        # starts right after the last booking shown, and no entity is cut
+        shown = 0
+        for booking in rows:
+            btype_label = "📚 كورس" if booking["booking_type"] == "course" else "📸 استديو"
+            status = booking["status"]
+            status_label = "✅" if status == "confirmed" else ("❌" if status == "rejected" else "⏳")
+            entry = (
+                f"#{booking['id']} {btype_label} {status_label}\n"
+                f"👤 {md(booking['name'])} | 📞 {md(booking['phone'])}\n"
+                f"📌 {md(booking['details'])}\n"
+                f"📅 {md(booking['preferred_date'])}\n"
+                f"🕐 {str(booking['created_at'])[:16]}\n{'─' * 20}\n"
+            )
+            if shown and len(msg) + len(entry) > BOOKING_SUMMARY_MAX_LENGTH:
+                break
+            msg += entry
+            shown += 1
+        truncated = shown < len(rows)
+        rows = rows[:shown]
+
+        has_newer = has_more if backwards else cursor is not None
+        has_older = True if backwards else has_more or truncated
+        buttons = []
+        if has_newer:
+            buttons.append(InlineKeyboardButton("⬅️ الأحدث", callback_data=self._encode_bookings_nav(parsed, "p", rows[0])))
+        if has_older:
+            buttons.append(InlineKeyboardButton("الأقدم ➡️", callback_data=self._encode_bookings_nav(parsed, "n", rows[-1])))
+        return msg, InlineKeyboardMarkup([buttons]) if buttons else None
+
     async def show_bookings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Show all bookings (admin only)"""
+        """Show bookings one page at a time (admin only)
+
+        Usage: /bookings [pending|confirmed|rejected] [course|studio] [from=YYYY-MM-DD] [to=YYYY-MM-DD]
+        """
         try:
             if not self._is_admin(update.effective_user.id):
                 await update.message.reply_text("❌ هذا الأمر متاح للمشرف فقط.")
                 return
-                
-            bookings = self.db.get_all_bookings()
-            
-            if not bookings:
-                await update.message.reply_text("📭 لا توجد حجوزات حتى الآن.")
-                return
-            
-            msg = f"📋 *الحجوزات ({len(bookings)} حجز)*\n{'─' * 25}\n\n"
-            
-            for i, booking in enumerate(bookings, 1):
-                name, phone, btype, details, date, status, created = booking
-                btype_label = "📚 كورس" if btype == "course" else "📸 استديو"
-                status_label = "✅" if status == "confirmed" else ("❌" if status == "rejected" else "⏳")
-                
-                entry = (
-                    f"#{i} {btype_label} {status_label}\n"
-                    f"👤 {name} | 📞 {phone}\n"
-                    f"📌 {details}\n"
-                    f"📅 {date}\n"
-                    f"🕐 {created[:16]}\n{'─' * 20}\n"
+
+            try:
+                parsed = self._parse_bookings_filters(context.args or [])
+            except ValueError:
+                await update.message.reply_text(
+                    "⚠️ فلتر غير صحيح.\n"
+                    "مثال: /bookings pending course from=2026-01-01 to=2026-01-31"
                 )
-                
-                # Split into multiple messages if too long
-                if len(msg) + len(entry) > BOOKING_SUMMARY_MAX_LENGTH:
-                    await update.message.reply_text(msg, parse_mode="Markdown")
-                    msg = ""
-                    
-                msg += entry
-            
-            if msg:
-                await update.message.reply_text(msg, parse_mode="Markdown")
+                return
+
+            msg, keyboard = await self._render_bookings_page(parsed)
+            await update.message.reply_text(msg, reply_markup=keyboard, parse_mode="Markdown")
         except Exception as e:
             logger.error(f"❌ Error in show_bookings: {e}")
             await update.message.reply_text("❌ حصل خطأ في عرض الحجوزات.")
 
+    async def bookings_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle next/prev buttons under /bookings by editing the same message"""
+        query = update.callback_query
+        try:
+            if not self._is_admin(query.from_user.id):
+                await query.answer("⛔ غير مصرح", show_alert=True)
+                return
+            await query.answer()
+
+            parsed, cursor, backwards = self._decode_bookings_nav(query.data)
+            msg, keyboard = await self._render_bookings_page(parsed, cursor, backwards)
+            await query.edit_message_text(msg, reply_markup=keyboard, parse_mode="Markdown")
+        except ValueError as e:
+            logger.error(f"❌ Invalid bookings navigation data {query.data!r}: {e}")
+        except Exception as e:
+            logger.error(f"❌ Error in bookings_page_callback: {type(e).__name__}: {e}")
+
+    async def _stats_trend(self, days: int) -> str:
+        """Per-day trend (bookings, new/active users, AI questions) from the daily rollups"""
+        per_day: Dict[str, Dict[str, int]] = {}
+        by_type: Dict[str, int] = {}
+        for row in await self.db.get_daily_stats(days):
+            day = per_day.setdefault(row["day"], {})
+            metric = row["metric"]
+            if metric.startswith("bookings:"):
+                day["bookings"] = day.get("bookings", 0) + row["value"]
+                _, btype, status = metric.split(":", 2)
+                key = f"{btype}:{status}"
+                by_type[key] = by_type.get(key, 0) + row["value"]
+            else:
+                day[metric] = day.get(metric, 0) + row["value"]
+
+        msg = f"📈 *آخر {days} يوم*\n_📋 حجوزات | 🆕 جدد | 🟢 نشطين | 🤖 أسئلة_\n\n"
+        if not per_day:
+            return msg + "مفيش بيانات في الفترة دي."
+        for day, values in sorted(per_day.items()):
+            msg += (
+                f"`{day[5:]}` 📋{values.get('bookings', 0)} 🆕{values.get('new_users', 0)} "
+                f"🟢{values.get('active_users', 0)} 🤖{values.get('ai_questions', 0)}\n"
+            )
+        totals = lambda col: sum(v.get(col, 0) for v in per_day.values())
+        msg += (
+            f"\n*الإجمالي:* 📋{totals('bookings')} 🆕{totals('new_users')} 🤖{totals('ai_questions')}\n"
+            + " | ".join(f"{k}: {v}" for k, v in sorted(by_type.items()))
+        )
+        return msg
+
     async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Show bot statistics (admin only)"""
+        """Show bot statistics (admin only); /stats 7 or /stats 30 shows the daily trend"""
         try:
             if not self._is_admin(update.effective_user.id):
                 await update.message.reply_text("❌ هذا الأمر متاح للمشرف فقط.")
                 return
+
+            if context.args:
+                try:
+                    days = max(1, min(int(context.args[0]), 90))
+                except ValueError:
+                    await update.message.reply_text("⚠️ استخدم: /stats أو /stats 7 أو /stats 30")
+                    return
+                await self._send_long_message(update, await self._stats_trend(days), parse_mode="Markdown")
+                return
                 
-            total_bookings = self.db.count_bookings()
-            total_users = self.db.count_users()
-            pending = len(self.db.get_pending_bookings())
+            db_ok = await self.db.health_check()
+            counters = await self.db.get_counters()
+            total_bookings = counters.get("bookings_total", 0)
+            total_users = counters.get("users_total", 0)
+            pending = counters.get("bookings_pending", 0)
             
+            pool = self.ai.pool_stats()
+            cache = self.ai.cache.stats()
+            tokens_saved = metrics.counters.get("prompt_tokens_saved", 0)
+            prompt_tokens = metrics.summary("prompt_tokens")
+            prompt_line = (
+                f"🧮 حجم البرومبت: متوسط ~{prompt_tokens['avg']:.0f} | p95 ~{prompt_tokens['p95']:.0f} توكن\n"
+                if prompt_tokens else ""
+            )
+            admission = self.admission
+            coalesced = metrics.counters.get("ai_coalesced", 0)
+            retries = metrics.counters.get("groq_retries", 0)
+            retries_denied = metrics.counters.get("groq_retry_budget_exhausted", 0)
+            updates = self.updates
+            sessions = self.sessions
+            sessions.measure(context.application)
+            worker_note = f" | عملية {self.worker + 1}/{WORKERS}" if WORKERS > 1 else ""
+            persisted = metrics.counters.get("persistence_writes", 0)
+            unchanged = metrics.counters.get("persistence_unchanged", 0)
+            intent_hits = metrics.counters.get("intent_hits", 0)
+            intent_total = intent_hits + metrics.counters.get("intent_misses", 0)
+            intent_latency = metrics.summary("intent_latency")
+            intent_line = (
+                f"⚡ ردود سريعة بدون AI: {intent_hits}/{intent_total} ({intent_hits / intent_total:.0%}) | "
+                f"p95 {intent_latency['p95'] * 1000:.2f}ms\n"
+                if intent_total and intent_latency else ""
+            )
+            breaker = self.ai.breaker
+            breaker_state = {
+                CircuitBreaker.CLOSED: "✅ شغال",
+                CircuitBreaker.HALF_OPEN: "🟡 بيجرب",
+                CircuitBreaker.OPEN: f"⛔ مفصول (يجرب بعد {breaker.retry_in():.0f}s)",
+            }[breaker.state]
+            ttft = metrics.summary("groq_ttft")
+            ttft_line = (
+                f"⚡ أول توكن: متوسط {ttft['avg']:.2f}s | p95 {ttft['p95']:.2f}s ({ttft['count']} رد)\n"
+                if ttft else ""
+            )
+
             stats_msg = (
                 f"📊 *إحصائيات البوت*\n\n"
                 f"👥 عدد المستخدمين: {total_users}\n"
                 f"📋 إجمالي الحجوزات: {total_bookings}\n"
-                f"⏳ قيد الانتظار: {pending}\n\n"
+                f"⏳ قيد الانتظار: {pending}\n"
+                f"🤖 أسئلة للذكاء الاصطناعي: {counters.get('ai_questions_total', 0)}\n"
+                f"🗄️ قاعدة البيانات: {'✅' if db_ok else '❌'}\n\n"
+                f"🔌 *اتصالات Groq:*\n"
+                f"الطلبات: {pool['requests']} | اتصالات جديدة: {pool['new_connections']}\n"
+                f"نسبة إعادة الاستخدام: {pool['reuse_rate']:.0%} | HTTP/2: {'✅' if pool['http2'] else '❌'}\n"
+                f"{ttft_line}"
+                f"🔁 إعادة محاولات: {retries} | اترفضت (الميزانية): {retries_denied}\n"
+                f"🛡️ قاطع الدائرة: {breaker_state} | أخطاء {breaker.failure_rate():.0%} | "
+                f"اتفصل {breaker.opened_count} مرة | ردود محلية: "
+                f"{metrics.counters.get('ai_fallback_answers', 0)}\n"
+                f"{intent_line}"
+                f"💾 كاش الردود: {cache['hits']} hit / {cache['misses']} miss "
+                f"({cache['hit_rate']:.0%}) | {cache['size']} محفوظ\n"
+                f"🔗 أسئلة متطابقة اتدمجت: {coalesced}\n"
+                f"📑 توكنز اتوفرت بالاسترجاع: ~{tokens_saved}\n"
+                f"{self._knowledge_line()}"
+                f"{' | ⚠️ آخر تحديث اترفض' if self.ai.kb_error else ''}\n"
+                f"{prompt_line}"
+                f"🧑‍💻 جلسات في الذاكرة: {sessions.live} (~{sessions.bytes_held // 1024} KB) | "
+                f"اتشالت: {sessions.evicted} | انتهت مهلتها: {metrics.counters.get('sessions_expired', 0)}\n"
+                f"💽 حفظ الجلسات: {persisted} كتابة | {unchanged} من غير تغيير\n"
+                f"🧵 تحديثات بتتعالج: {updates.in_flight}/{updates.limit} | مستنية: {updates.pending} | محادثات نشطة: {updates.busy_chats}"
+                f"{worker_note}\n"
+                f"🚦 طلبات AI شغالة: {admission.in_flight}/{admission.max_concurrent} | "
+                f"في الطابور: {admission.waiting}\n"
+                f"محدودة بالمعدل: {metrics.counters.get('ai_rate_limited', 0)} | "
+                f"اتأجلت: {metrics.counters.get('ai_queued', 0)} | "
+                f"اترفضت (ضغط): {metrics.counters.get('ai_shed', 0)}\n\n"
+                f"📈 للاتجاه اليومي: /stats 7 أو /stats 30\n"
                 f"🕐 {datetime.now().strftime('%Y-%m-%d %H:%M')}"
             )
             
@@ -1291,12 +4555,17 @@ class EduBot:
                 await update.message.reply_text("❌ هذا الأمر متاح للمشرف فقط.")
                 return
                 
-            success = self.ai.reload_knowledge()
+            success = await self.ai.reload_knowledge()
             
             if success:
-                await update.message.reply_text("✅ تم إعادة تحميل قاعدة المعرفة بنجاح!")
+                self.broadcast("reload")
+                await update.message.reply_text(
+                    f"✅ تم إعادة تحميل قاعدة المعرفة بنجاح!\n{self._knowledge_line()}"
+                )
             else:
-                await update.message.reply_text("❌ فشل إعادة تحميل قاعدة المعرفة. راجع السجلات.")
+                await update.message.reply_text(
+                    f"❌ فشل إعادة تحميل قاعدة المعرفة، النسخة الحالية لسه شغالة.\n{self.ai.kb_error}"
+                )
         except Exception as e:
             logger.error(f"❌ Error in reload_cmd: {e}")
             await update.message.reply_text("❌ حصل خطأ في إعادة التحميل.")
@@ -1322,23 +4591,46 @@ class EduBot:
             except Exception as e:
                 logger.error(f"❌ Unexpected error in error_handler: {e}")
 
+    # ── Lifecycle ─────────────────────────────────────────────────────────────
+    async def post_init(self, app: Application):
+        """Open long-lived resources once the Application is initialized"""
+        await self.ai.start()
+        await self.db.start()
+        self.sessions.start(app)
+        self._arm_restored_timeouts(app)
+        if KNOWLEDGE_WATCH:
+            await self.watcher.start()
+        if self.worker == 0:
+            # One outbox dispatcher per database, or the admin gets every notification N times
+            await self.notifier.start(app.bot)
+
+    async def post_shutdown(self, app: Application):
+        """Release long-lived resources on shutdown"""
+        await self.notifier.stop()
+        await self.watcher.stop()
+        await self.ai.close()
+        await self.db.close()
+
     # ── Build App ─────────────────────────────────────────────────────────────
     def build(self) -> Application:
         """Build and configure the application with all handlers"""
-        app = Application.builder().token(TELEGRAM_TOKEN).build()
-
-        # Booking conversation triggers
-        BOOK_TRIGGER = (
-            r"📅 احجز دلوقتي|احجز كورس|احجز جلسة تصوير|"
-            r"عايز احجز|عاوز احجز|محتاج احجز|"
-            r"حجز كورس|حجز جلسة|حجزلي|احجزلي|"
-            r"عايز موعد|عاوز موعد|ابي احجز|ابغى احجز|"
-            r"📅 احجز كورس دلوقتي|📅 احجز جلسة تصوير"
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .concurrent_updates(self.updates)
+            .update_queue(UpdateQueue(self.updates))
+            .persistence(SQLitePersistence(self.db, timeouts={"booking": BOOKING_TIMEOUT, "chat": CHAT_TIMEOUT}))
         )
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+        app = builder.build()
 
+        # Text triggers are routed in one pass (see ROUTE_TRIGGERS)
         # Booking conversation handler
         booking_conv = ConversationHandler(
-            entry_points=[MessageHandler(filters.Regex(BOOK_TRIGGER), self.book_start)],
+            entry_points=[RouteHandler(self.router, {"booking": self.book_start})],
             states={
                 BOOK_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.book_get_type)],
                 BOOK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.book_get_name)],
@@ -1346,31 +4638,41 @@ class EduBot:
                 BOOK_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.book_get_details)],
                 BOOK_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.book_get_date)],
                 BOOK_CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.book_confirm)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, self.booking_timeout)],
             },
             fallbacks=[
                 CommandHandler("cancel", self.book_cancel),
                 MessageHandler(filters.Regex(r"^/start$"), self.start),
             ],
-            allow_reentry=True
+            allow_reentry=True,
+            conversation_timeout=BOOKING_TIMEOUT or None,
+            name="booking",
+            persistent=True
         )
 
         # Chat conversation handler
         chat_conv = ConversationHandler(
-            entry_points=[MessageHandler(
-                filters.Regex(r"💬 اسألنا$|💬 اسألنا عن الكورسات|💬 اسألنا عن الاستديو"),
-                self.chat_start
-            )],
+            entry_points=[RouteHandler(self.router, {"chat": self.chat_start})],
             states={
                 CHAT_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.chat_input)],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, self.chat_timeout)],
             },
             fallbacks=[
                 CommandHandler("cancel", self.book_cancel),
                 MessageHandler(filters.Regex(r"^/start$"), self.start),
             ],
-            allow_reentry=True
+            allow_reentry=True,
+            conversation_timeout=CHAT_TIMEOUT or None,
+            name="chat",
+            persistent=True
         )
 
+        self.conversations = [booking_conv, chat_conv]
+
         # Register handlers in order of priority
+        # 0. Session activity (group -1 sees every update, then the normal handlers run)
+        app.add_handler(TypeHandler(Update, self.sessions.touch), group=-1)
+
         # 1. Commands
         app.add_handler(CommandHandler("start", self.start))
         app.add_handler(CommandHandler("bookings", self.show_bookings))
@@ -1382,16 +4684,15 @@ class EduBot:
         app.add_handler(chat_conv)
 
         # 3. Inline callbacks
-        app.add_handler(CallbackQueryHandler(self.admin_callback))
-
-        # 4. Static button handlers
-        app.add_handler(MessageHandler(filters.Regex(r"^📚 كورسات السنتر$"), self.show_courses))
-        app.add_handler(MessageHandler(filters.Regex(r"^📸 استديو X\.press$"), self.show_studio))
-        app.add_handler(MessageHandler(filters.Regex(r"^📞 تواصل معنا$"), self.contact))
-        app.add_handler(MessageHandler(filters.Regex(r"^🏠"), self.start))
+        app.add_handler(CallbackQueryHandler(self.bookings_page_callback, pattern=r"^bk:"))
+        app.add_handler(CallbackQueryHandler(self.admin_callback, pattern=r"^(confirm|reject)_\d+$"))
 
-        # 5. Fallback — AI responds to any other text message
-        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        # 4. Static buttons, and the AI fallback for any other text message
+        app.add_handler(RouteHandler(
+            self.router,
+            {"courses": self.show_courses, "studio": self.show_studio, "contact": self.contact, "home": self.start},
+            default=self.handle_message,
+        ))
 
         # Error handler
         app.add_error_handler(self.error_handler)
@@ -1400,6 +4701,350 @@ class EduBot:
         return app
 
 
+# ─── Webhook Server ───────────────────────────────────────────────────────────
+class WebhookServer:
+    """Minimal asyncio HTTP/1.1 server feeding Telegram webhook posts into the update queue
+
+    POST WEBHOOK_PATH  — verified by X-Telegram-Bot-Api-Secret-Token; answers 503
+                         with Retry-After while WEBHOOK_MAX_QUEUE updates are unfinished,
+                         so Telegram keeps the update and redelivers it later
+    GET  /healthz      — process is up
+    GET  /readyz       — application running and not saturated
+    """
+
+    _REASONS = {
+        200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+        405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+        431: "Request Header Fields Too Large", 503: "Service Unavailable",
+    }
+
+    def __init__(self, app: Application, secret: str, path: str = WEBHOOK_PATH, max_queue: int = WEBHOOK_MAX_QUEUE):
+        self.app = app
+        self.secret = secret
+        self.path = path
+        self.max_queue = max_queue
+        self.ready = False
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: set = set()
+
+    async def start(self, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        bound = self._server.sockets[0].getsockname()
+        logger.info(f"🌐 Webhook server listening on {bound[0]}:{bound[1]}{self.path}")
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1] if self._server else 0
+
+    async def stop(self):
+        self.ready = False
+        if self._server is not None:
+            self._server.close()
+            # Idle keep-alive connections would otherwise be cancelled mid-read at loop teardown
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def backlog(self) -> int:
+        """Updates received and not finished: still queued, or held by the update processor"""
+        processor = self.app.update_processor
+        pending = processor.pending if isinstance(processor, PerChatUpdateProcessor) else 0
+        return self.app.update_queue.qsize() + pending
+
+    def _saturated(self) -> bool:
+        return self.backlog() >= self.max_queue
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One connection: parse requests until close (keep-alive supported)"""
+        self._connections.add(writer)
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), WEBHOOK_IDLE_TIMEOUT)
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, close=True)
+                    break
+
+                headers: Dict[str, str] = {}
+                too_large = False
+                for _ in range(WEBHOOK_MAX_HEADERS + 1):
+                    try:
+                        header = await reader.readline()
+                    except ValueError:  # a single line over the stream limit
+                        too_large = True
+                        break
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                else:
+                    too_large = True
+                if too_large:
+                    await self._respond(writer, 431, close=True)
+                    break
+
+                if "transfer-encoding" in headers:
+                    await self._respond(writer, 411, close=True)
+                    break
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0 or length > WEBHOOK_MAX_BODY:
+                    await self._respond(writer, 413 if length > 0 else 400, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, extra = await self._dispatch(method, target.split("?", 1)[0], headers, body)
+                close = version != "HTTP/1.1" or headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, extra, close=close)
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"❌ Webhook connection error: {type(e).__name__}: {e}")
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, str]]:
+        if path == "/healthz":
+            return 200, {}
+        if path == "/readyz":
+            return (200 if self.ready and self.app.running and not self._saturated() else 503), {}
+        if path != self.path:
+            return 404, {}
+        if method != "POST":
+            return 405, {}
+
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            metrics.incr("webhook_forbidden")
+            logger.warning("⛔ Webhook request with a wrong secret token")
+            return 403, {}
+
+        if not self.ready or self._saturated():
+            # Telegram keeps undelivered updates and retries, so nothing is lost
+            metrics.incr("webhook_backpressure")
+            return 503, {"Retry-After": "1"}
+
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"⚠️ Malformed webhook update: {e}")
+            return 400, {}
+        if update is None:
+            return 400, {}
+
+        await self.app.update_queue.put(update)
+        metrics.incr("webhook_updates")
+        return 200, {}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, headers: Optional[Dict[str, str]] = None, close: bool = False):
+        body = self._REASONS.get(status, "").encode()
+        lines = [f"HTTP/1.1 {status} {self._REASONS.get(status, '')}", f"Content-Length: {len(body)}",
+                 "Content-Type: text/plain", f"Connection: {'close' if close else 'keep-alive'}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+async def run_webhook(app: Application):
+    """Webhook mode: manual Application lifecycle around the embedded HTTP server
+
+    The webhook stays registered on shutdown, so Telegram holds updates sent
+    while the bot is down and delivers them after the restart.
+    """
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required when BOT_MODE=webhook")
+
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(app, secret, WEBHOOK_PATH, WEBHOOK_MAX_QUEUE)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # e.g. Windows; Ctrl+C still raises KeyboardInterrupt
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+        )
+        await app.start()
+        server.ready = True
+        logger.info("✅ Bot is running in webhook mode! Press Ctrl+C to stop.")
+        await stop.wait()
+    finally:
+        await server.stop()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# ─── Multi-process Workers ───────────────────────────────────────────────────
+class WorkerPool:
+    """Supervisor of multi-process mode: receives updates once and shards them by chat
+
+    Each worker process runs a complete EduBot (own event loop, Groq client
+    and database threads) on the shared WAL database. Every update of a chat
+    goes to the same worker through one FIFO queue, so per-chat ordering
+    holds. Workers report shared changes (knowledge reload, new outbox
+    entries) on the control queue and the supervisor relays them.
+    """
+
+    def __init__(self, size: int = WORKERS):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(WORKER_QUEUE_SIZE) for _ in range(size)]
+        self.control = self._ctx.Queue()
+        self.processes: List = [None] * size
+        self.dispatched = [0] * size
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    @staticmethod
+    def shard(update: Update, size: int) -> int:
+        key = PerChatUpdateProcessor._chat_key(update)
+        return key % size if key is not None else 0
+
+    def build(self) -> Application:
+        """Application that only forwards updates; polling/webhook work as usual"""
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .post_init(self.start)
+            .post_shutdown(self.stop)
+        )
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+        app = builder.build()
+        app.add_handler(TypeHandler(Update, self.forward))
+        return app
+
+    def _spawn(self, index: int):
+        proc = self._ctx.Process(
+            target=run_worker, args=(index, self.queues[index], self.control), name=f"edu-worker-{index}"
+        )
+        proc.start()
+        self.processes[index] = proc
+        logger.info(f"👷 Worker {index} started (pid {proc.pid})")
+
+    async def start(self, app: Application):
+        for index in range(self.size):
+            self._spawn(index)
+        self._tasks = [
+            asyncio.create_task(self._relay_control(), name="worker-control"),
+            asyncio.create_task(self._watch(), name="worker-watchdog"),
+        ]
+
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Hand the update to its chat's worker (updates are processed one at a time here, so order holds)"""
+        index = self.shard(update, self.size)
+        item = ("update", update.to_json())
+        try:
+            self.queues[index].put_nowait(item)
+        except queue.Full:
+            # Waiting here backs up the update queue, and the webhook answers 503
+            metrics.incr("worker_backpressure")
+            await asyncio.to_thread(self.queues[index].put, item)
+        self.dispatched[index] += 1
+
+    async def _relay_control(self):
+        while not self._stopping:
+            try:
+                command, origin = await asyncio.to_thread(self.control.get, True, 1.0)
+            except queue.Empty:
+                continue
+            targets = [0] if command == "outbox" else [i for i in range(self.size) if i != origin]
+            for index in targets:
+                await asyncio.to_thread(self.queues[index].put, ("control", command))
+            logger.info(f"📣 '{command}' from worker {origin} relayed to {len(targets)} worker(s)")
+
+    async def _watch(self):
+        while not self._stopping:
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            for index, proc in enumerate(self.processes):
+                if not self._stopping and not proc.is_alive():
+                    logger.error(f"❌ Worker {index} exited (code {proc.exitcode}), restarting")
+                    metrics.incr("worker_restarts")
+                    self._spawn(index)
+
+    async def stop(self, app: Application):
+        """Let every worker drain its queue and shut down cleanly"""
+        self._stopping = True
+        for q in self.queues:
+            await asyncio.to_thread(q.put, None)
+        for index, proc in enumerate(self.processes):
+            await asyncio.to_thread(proc.join, WORKER_STOP_TIMEOUT)
+            if proc.is_alive():
+                logger.warning(f"⚠️ Worker {index} did not stop in time, terminating")
+                proc.terminate()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info(f"✅ Workers stopped (updates per worker: {self.dispatched})")
+
+
+def run_worker(index: int, updates, control):
+    """Worker process entry point"""
+    # Ctrl+C / SIGTERM reach the whole process group; workers stop when the supervisor says so
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    bot = EduBot(worker=index, control=control)
+    asyncio.run(serve_worker(bot, bot.build(), updates))
+
+
+async def serve_worker(bot: EduBot, app: Application, updates):
+    """Feed updates from the supervisor into a started Application until the stop sentinel"""
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await app.start()
+        logger.info(f"✅ Worker {bot.worker} ready")
+        while True:
+            try:
+                item = await loop.run_in_executor(None, updates.get, True, 1.0)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.error("❌ Supervisor is gone, worker exiting")
+                    break
+                continue
+            if item is None:
+                break
+            kind, payload = item
+            if kind == "update":
+                await app.update_queue.put(Update.de_json(json.loads(payload), app.bot))
+            else:
+                await bot.apply_control(payload)
+    finally:
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
 # ─── Entry Point ──────────────────────────────────────────────────────────────
 def main():
     """Main entry point for the bot"""
@@ -1408,12 +5053,20 @@ def main():
         logger.info(f"📍 Database: edu_bookings.db")
         logger.info(f"📖 Knowledge: {KNOWLEDGE_FILE}")
         logger.info(f"👮 Admin ID: {ADMIN_ID if ADMIN_ID else 'Not configured'}")
+        logger.info(f"📡 Mode: {BOT_MODE}")
         
-        bot = EduBot()
-        app = bot.build()
-        
+        if WORKERS > 1:
+            logger.info(f"👷 Workers: {WORKERS}")
+            app = WorkerPool(WORKERS).build()
+        else:
+            app = EduBot().build()
+
+        if BOT_MODE == "webhook":
+            asyncio.run(run_webhook(app))
+            return
+
         logger.info("✅ Bot is running! Press Ctrl+C to stop.")
-        app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=DROP_PENDING_UPDATES)
         
     except KeyboardInterrupt:
         logger.info("⏹️ Bot stopped by user")
@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# main.py exits at import time without a token; tests never reach the Bot API
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:TEST")
+os.environ.setdefault("KNOWLEDGE_FILE", str(ROOT / "knowledge.txt"))
+os.environ.setdefault("KNOWLEDGE_WATCH", "0")
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from main import AdmissionController, AdmissionRejected
+
+
+def test_shed_request_keeps_the_users_rate_token():
+    async def run():
+        admission = AdmissionController(rate_per_minute=0.001, burst=1, max_concurrent=1, max_queue=0)
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.admit(1):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected) as shed:
+            async with admission.admit(2):
+                pass
+        assert shed.value.reason == "queue_full"
+
+        release.set()
+        await holder
+        async with admission.admit(2):  # the shed attempt didn't spend user 2's only token
+            pass
+
+    asyncio.run(run())
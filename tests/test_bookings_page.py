@@ -0,0 +1,47 @@
+import asyncio
+
+from main import BOOKING_SUMMARY_MAX_LENGTH, EduBot
+
+
+class FakeDatabase:
+    def __init__(self, rows, has_more=False):
+        self.rows = rows
+        self.has_more = has_more
+
+    async def get_bookings_page(self, status, booking_type, date_from, date_to, cursor, backwards):
+        return self.rows, self.has_more
+
+
+def booking(booking_id, name="Ali", details="Python course"):
+    return {
+        "id": booking_id, "telegram_id": 1, "name": name, "phone": "01000000000",
+        "booking_type": "course", "details": details, "preferred_date": "Saturday",
+        "status": "pending", "created_at": f"2026-01-{booking_id:02d} 10:00:00",
+    }
+
+
+def render(rows, has_more=False):
+    bot = EduBot.__new__(EduBot)
+    bot.db = FakeDatabase(rows, has_more)
+    filters = {"status": None, "type": None, "from": None, "to": None}
+    return asyncio.run(bot._render_bookings_page(filters))
+
+
+def test_overflowing_page_continues_after_the_last_booking_shown():
+    rows = [booking(n, details="x" * 900) for n in range(8, 0, -1)]  # newest first
+
+    msg, keyboard = render(rows)
+
+    assert len(msg) <= BOOKING_SUMMARY_MAX_LENGTH
+    shown = [row["id"] for row in rows if f"#{row['id']} " in msg]
+    assert 0 < len(shown) < len(rows)
+    assert shown == [row["id"] for row in rows[:len(shown)]]
+    older = keyboard.inline_keyboard[0][-1].callback_data
+    assert older.endswith(f":{shown[-1]}")  # next page starts right after it
+
+
+def test_markdown_in_user_fields_is_escaped():
+    msg, _ = render([booking(1, name="_ali_*bold*", details="`code` [link]")])
+
+    assert "\\_ali\\_\\*bold\\*" in msg
+    assert "\\`code\\` \\[link]" in msg
@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+
+import main
+from main import CircuitBreaker, GroqAI
+
+
+def make_ai(monkeypatch, outcomes):
+    """GroqAI whose attempts succeed or raise ConnectError in the given order, without backoff waits"""
+    monkeypatch.setattr(main, "decorrelated_jitter", lambda previous: 0.0)
+    ai = GroqAI()
+    ai.breaker = CircuitBreaker(window=20, min_calls=5, failure_rate=0.5, cooldown=60)
+    attempts = iter(outcomes)
+
+    async def stream(messages, timeout):
+        if not next(attempts):
+            raise httpx.ConnectError("down")
+        yield "answer"
+
+    ai._stream_completion = stream
+    return ai
+
+
+async def ask(ai, kb=None):
+    return "".join([delta async for delta in ai._generate([{"role": "user", "content": "بكام الكورس"}], kb=kb)])
+
+
+def test_one_request_failing_every_retry_counts_once(monkeypatch):
+    ai = make_ai(monkeypatch, [True, True, False, False, False])
+
+    async def run():
+        for _ in range(3):
+            await ask(ai)
+
+    asyncio.run(run())
+
+    assert list(ai.breaker._outcomes) == [False, False, True]
+    assert ai.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_once_most_requests_fail(monkeypatch):
+    ai = make_ai(monkeypatch, [True, True] + [False] * 9)
+
+    async def run():
+        return [await ask(ai) for _ in range(5)]
+
+    answers = asyncio.run(run())
+
+    assert ai.breaker.state == CircuitBreaker.OPEN
+    assert answers[-1].startswith("⚠️")  # local fallback once open
+
+
+def test_fallback_answers_from_the_requests_snapshot(monkeypatch):
+    ai = make_ai(monkeypatch, [])
+    ai.breaker._open()
+    snapshot = ai.kb
+    ai.kb = None  # a reload swapped something else in mid-request
+
+    answer = asyncio.run(ask(ai, kb=snapshot))
+
+    assert answer.startswith("⚠️")
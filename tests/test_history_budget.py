@@ -0,0 +1,42 @@
+from main import (
+    AI_PROMPT_TOKEN_BUDGET, AI_SUMMARY_TOKEN_BUDGET, ChatHistory, GroqAI, estimate_tokens,
+)
+
+
+def long_answer(n):
+    return f"الرد رقم {n}. " + "تفاصيل الكورس والمواعيد والأسعار " * 40
+
+
+def test_old_turns_fold_into_the_summary_within_the_token_budget():
+    history = ChatHistory(capacity=16)
+    for n in range(10):
+        history.add_exchange(f"سؤال رقم {n}؟", long_answer(n), max_tokens=600)
+
+    turns = list(history)
+    assert history.tokens <= 600 or len(turns) == 2
+    assert turns[-1].content == long_answer(9)  # the newest exchange stays verbatim
+    assert turns[0].role == "user"               # never starts mid-exchange
+    assert "- سأل: سؤال رقم 0؟" in history.summary
+    assert estimate_tokens(history.summary) <= AI_SUMMARY_TOKEN_BUDGET
+
+
+def test_full_ring_summarizes_instead_of_dropping():
+    history = ChatHistory(capacity=4)
+    for n in range(3):
+        history.add_exchange(f"سؤال {n}؟", f"رد {n}.")
+
+    assert [turn.content for turn in history] == ["سؤال 1؟", "رد 1.", "سؤال 2؟", "رد 2."]
+    assert history.summary == "- سأل: سؤال 0؟ ← الرد: رد 0."
+
+
+def test_prompt_stays_within_budget_and_keeps_the_newest_turns():
+    history = ChatHistory(capacity=64)
+    for n in range(30):
+        history.add_exchange(f"سؤال رقم {n}؟", long_answer(n), max_tokens=10**6)
+
+    messages = GroqAI()._build_messages("وده بكام؟", history)
+
+    assert sum(estimate_tokens(m["content"]) for m in messages) <= AI_PROMPT_TOKEN_BUDGET
+    assert messages[-1] == {"role": "user", "content": "وده بكام؟"}
+    assert messages[-2]["content"] == long_answer(29)
+    assert len(messages) - 2 < len(history)  # older turns were left out
@@ -0,0 +1,42 @@
+import pytest
+
+from main import CENTER, IntentClassifier, load_knowledge
+
+
+@pytest.fixture(scope="module")
+def intents():
+    classifier = IntentClassifier()
+    classifier.rebuild(load_knowledge())
+    return classifier
+
+
+@pytest.mark.parametrize("question, intent, expected", [
+    ("العنوان فين", "address", CENTER["address"]),
+    ("رقم التليفون", "phone", CENTER["phone"]),
+    ("مواعيدكم", "hours", CENTER["hours"]),
+    ("السلام عليكم", "greeting", CENTER["name"]),
+])
+def test_common_questions_are_answered_locally(intents, question, intent, expected):
+    assert intents.classify(question)[0] == intent
+    assert expected in intents.answer(question)
+
+
+def test_faq_entries_from_knowledge_are_answered_locally(intents):
+    assert "شهادة معتمدة" in intents.answer("هل في شهادة")
+    assert "فودافون كاش" in intents.answer("الدفع ازاي")
+
+
+@pytest.mark.parametrize("question", [
+    "عايز اعرف الفرق بين كورس بايثون وكورس جافا ومين المدرب وهل في شهادة",  # long: a real question
+    "ممكن تقسيط",                                                          # nothing matches
+    "العنوان ورقم التليفون",                                               # two intents, no clear winner
+])
+def test_everything_else_goes_to_the_llm(intents, question):
+    assert intents.answer(question) is None
+
+
+def test_rebuild_picks_up_new_faq_entries():
+    classifier = IntentClassifier()
+    classifier.rebuild("## ❓ أسئلة شائعة\n### س: فيه جراج للعربيات؟\nج: أيوه، جراج مجاني قدام السنتر.\n")
+
+    assert classifier.answer("فيه جراج") == "أيوه، جراج مجاني قدام السنتر."
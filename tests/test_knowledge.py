@@ -0,0 +1,44 @@
+import pytest
+
+import main
+from main import KnowledgeError, compile_knowledge, estimate_tokens
+
+MINIMAL = """# comment for editors
+## 🤖 هوية المساعد / Identity
+**الاسم / Name:** إيدو
+This line is English only.
+---
+## 📞 معلومات الاتصال
+  - التليفون: 01000000000
+## 📚 الكورسات
+- بايثون: 1500 جنيه
+## 📸 استديو التصوير
+- باقة ساعة: 300 جنيه
+## 📝 تعليمات التحديث
+- حدّث الأسعار كل شهر
+"""
+
+
+def test_compile_strips_noise_and_maintenance_sections():
+    compiled = compile_knowledge(MINIMAL)
+
+    assert "comment for editors" not in compiled
+    assert "English only" not in compiled and "Identity" not in compiled and "Name" not in compiled
+    assert "---" not in compiled and "**" not in compiled
+    assert "حدّث الأسعار" not in compiled  # KNOWLEDGE_DROP_SECTIONS
+    assert "الاسم: إيدو" in compiled
+    assert " - التليفون: 01000000000" in compiled  # nested items keep one space
+
+
+def test_compile_rejects_knowledge_missing_a_required_section():
+    without_courses = MINIMAL.replace("## 📚 الكورسات", "## 📚 حاجات تانية")
+
+    with pytest.raises(KnowledgeError, match="الكورسات"):
+        compile_knowledge(without_courses)
+
+
+def test_shipped_knowledge_compiles_smaller():
+    text = open(main.KNOWLEDGE_FILE, encoding="utf-8").read()
+
+    assert estimate_tokens(compile_knowledge(text)) < estimate_tokens(text)
+
@@ -0,0 +1,57 @@
+from main import GroqAI, KnowledgeIndex, estimate_tokens, load_knowledge
+
+TEXT = """## 🎯 هوية البوت
+أنت إيدو المساعد الذكي
+## 📚 الكورسات
+### كورس بايثون
+بايثون للمبتدئين، السعر 1500 جنيه، المدة شهرين
+### كورس التصميم
+فوتوشوب والستريتور، السعر 1200 جنيه
+## 📸 استديو التصوير
+باقة ساعة تصوير بسعر 300 جنيه مع إضاءة
+"""
+
+
+def titles(index, hits):
+    return [index.sections[i][0] for i in hits]
+
+
+def test_search_ranks_the_matching_section_first():
+    index = KnowledgeIndex()
+    index.rebuild(TEXT)
+
+    assert titles(index, index.search("كورس البايثون بكام"))[0] == "📚 الكورسات › كورس بايثون"
+    assert titles(index, index.search("الاستديو والإضاءة"))[0] == "📸 استديو التصوير"
+    assert index.search("طقس") == []
+
+
+def test_select_sends_pinned_sections_plus_matches_only():
+    index = KnowledgeIndex()
+    index.rebuild(TEXT)
+
+    selected = index.select("فوتوشوب", top_k=1)
+
+    assert "أنت إيدو" in selected         # identity section is pinned
+    assert "فوتوشوب" in selected
+    assert "بايثون" not in selected and "إضاءة" not in selected
+
+
+def test_incremental_update_reindexes_only_changed_sections():
+    index = KnowledgeIndex()
+    total, changed = index.rebuild(TEXT)
+    assert changed == total
+
+    updated, changed = index.updated(TEXT.replace("1200", "1300"))
+
+    assert changed == 1
+    assert "1300" in dict(updated.sections)["📚 الكورسات › كورس التصميم"]
+    assert "1200" in dict(index.sections)["📚 الكورسات › كورس التصميم"]  # old index untouched
+
+
+def test_prompt_carries_a_fraction_of_the_knowledge():
+    knowledge = load_knowledge()
+    ai = GroqAI()
+
+    prompt = ai._system_prompt_for("مواعيد كورس بايثون", ai.kb)
+
+    assert estimate_tokens(prompt) < estimate_tokens(knowledge)
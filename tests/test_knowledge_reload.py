@@ -0,0 +1,89 @@
+import asyncio
+import shutil
+from pathlib import Path
+
+import pytest
+
+import main
+from main import GroqAI, KnowledgeError, KnowledgeWatcher
+
+SHIPPED = Path(__file__).resolve().parent.parent / "knowledge.txt"
+NEW_FAQ = "\n## ❓ سؤال جديد\n- هل في كورس روبوتات؟ أيوه كل سبت\n"
+
+
+@pytest.fixture
+def knowledge_file(monkeypatch, tmp_path):
+    path = tmp_path / "knowledge.txt"
+    shutil.copy(SHIPPED, path)
+    monkeypatch.setattr(main, "KNOWLEDGE_FILE", str(path))
+    return path
+
+
+def insert_faq(path):
+    text = path.read_text(encoding="utf-8")
+    path.write_text(text.replace("## ⚠️ ملاحظات مهمة", NEW_FAQ + "\n## ⚠️ ملاحظات مهمة"), encoding="utf-8")
+
+
+def test_reload_swaps_in_a_new_snapshot_and_leaves_the_old_one_intact(knowledge_file):
+    ai = GroqAI()
+    old = ai.kb
+    old_prompt, old_sections = old.system_prompt, list(old.index.sections)
+    insert_faq(knowledge_file)
+
+    assert asyncio.run(ai.reload_knowledge())
+
+    assert ai.kb is not old and ai.kb.version != old.version
+    assert "روبوتات" in ai.kb.knowledge
+    # A request still holding the old snapshot sees a consistent old version
+    assert "روبوتات" not in old.knowledge
+    assert old.system_prompt == old_prompt and old.index.sections == old_sections
+
+
+def test_broken_edit_keeps_the_current_snapshot(knowledge_file):
+    ai = GroqAI()
+    old = ai.kb
+    knowledge_file.write_text("## 🎯 هوية البوت\nبس كده\n", encoding="utf-8")
+
+    assert not asyncio.run(ai.reload_knowledge())
+
+    assert ai.kb is old
+    assert "missing required sections" in ai.kb_error
+
+
+def test_reload_never_falls_back_for_a_missing_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "KNOWLEDGE_FILE", str(tmp_path / "gone.txt"))
+
+    with pytest.raises(KnowledgeError):
+        main.load_knowledge(fallback=False)
+    assert "أنت إيدو" in main.load_knowledge()  # startup still gets the built-in fallback
+
+
+class FakeAI:
+    def __init__(self):
+        self.reloads = 0
+
+    async def reload_knowledge(self):
+        self.reloads += 1
+        return True
+
+
+def test_polling_watcher_reloads_once_per_change_and_ignores_deletion(monkeypatch, knowledge_file):
+    monkeypatch.setattr(main, "KNOWLEDGE_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(main, "KNOWLEDGE_DEBOUNCE", 0.05)
+    ai = FakeAI()
+    watcher = KnowledgeWatcher(ai, str(knowledge_file))
+
+    async def run():
+        watcher._stop = asyncio.Event()
+        task = asyncio.create_task(watcher._watch_polling())
+        await asyncio.sleep(0.1)
+        insert_faq(knowledge_file)
+        await asyncio.sleep(0.4)
+        assert ai.reloads == 1
+        knowledge_file.unlink()
+        await asyncio.sleep(0.4)
+        watcher._stop.set()
+        await task
+
+    asyncio.run(run())
+    assert ai.reloads == 1  # a deleted file never triggers a reload
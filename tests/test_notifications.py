@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import main
+from main import Database, EduBot, NotificationDispatcher, NotificationRejected
+
+
+@pytest.mark.parametrize("admin_id", ["", "not-a-number"])
+def test_unusable_admin_id_is_rejected_not_retried(monkeypatch, admin_id):
+    monkeypatch.setattr(main, "ADMIN_ID", admin_id)
+    bot = EduBot.__new__(EduBot)
+
+    with pytest.raises(NotificationRejected):
+        asyncio.run(bot._notify_admin(None, {"id": 1}))
+
+
+def outbox_run(tmp_path, send, rounds=1, rewind=False):
+    """Save one booking, drain the outbox `rounds` times; returns (sends, outbox row)"""
+    async def run():
+        db = Database(str(tmp_path / "bookings.db"))
+        calls = []
+
+        async def recording_send(bot, row):
+            calls.append(row["id"])
+            return await send(len(calls))
+
+        dispatcher = NotificationDispatcher(db, recording_send)
+        try:
+            booking_id = await db.save_booking(1, "Ali", "01000000000", "course", "Python", "Saturday")
+            for _ in range(rounds):
+                await dispatcher.drain()
+                if rewind:  # make a backed-off retry due now
+                    with db._get_connection() as conn:
+                        conn.execute("UPDATE notification_outbox SET next_attempt_at = 0")
+            with db._get_connection() as conn:
+                row = conn.execute(
+                    "SELECT attempts, sent_at, last_error FROM notification_outbox WHERE booking_id = ?",
+                    (booking_id,)
+                ).fetchone()
+            return calls, dict(row)
+        finally:
+            await db.close()
+
+    return asyncio.run(run())
+
+
+def test_booking_notification_is_sent_once(tmp_path):
+    async def ok(attempt):
+        return True
+
+    calls, row = outbox_run(tmp_path, ok, rounds=3)
+
+    assert len(calls) == 1
+    assert row["sent_at"] is not None
+
+
+def test_failed_send_is_retried_after_backoff(tmp_path):
+    async def flaky(attempt):
+        return attempt > 1
+
+    calls, row = outbox_run(tmp_path, flaky, rounds=1)
+    assert len(calls) == 1 and row["sent_at"] is None and row["attempts"] == 1  # backing off
+
+    (tmp_path / "retry").mkdir()
+    calls, row = outbox_run(tmp_path / "retry", flaky, rounds=2, rewind=True)
+    assert len(calls) == 2 and row["sent_at"] is not None
+
+
+def test_rejected_notification_is_never_retried(tmp_path):
+    async def rejected(attempt):
+        raise NotificationRejected("Forbidden: bot was blocked by the user")
+
+    calls, row = outbox_run(tmp_path, rejected, rounds=3, rewind=True)
+
+    assert len(calls) == 1
+    assert row["sent_at"] is None and row["attempts"] == main.OUTBOX_MAX_ATTEMPTS
+    assert "blocked" in row["last_error"]
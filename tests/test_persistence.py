@@ -0,0 +1,88 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+from main import BookingDraft, ChatHistory, ConversationHandler, EduBot, SQLitePersistence
+
+
+class FakeDatabase:
+    def __init__(self, conversations):
+        self.conversations = conversations
+
+    async def load_conversations(self, name):
+        return self.conversations.get(name, [])
+
+
+def test_conversations_that_timed_out_while_down_are_ended_on_load():
+    now = time.time()
+    db = FakeDatabase({"booking": [
+        ("[1, 1]", json.dumps([3, now - 60])),    # 1 minute idle
+        ("[2, 2]", json.dumps([3, now - 5000])),  # past the timeout
+        ("[3, 3]", "3"),                          # no timestamp
+    ]})
+    persistence = SQLitePersistence(db, timeouts={"booking": 900})
+
+    restored = asyncio.run(persistence.get_conversations("booking"))
+
+    assert restored == {(1, 1): 3, (2, 2): ConversationHandler.END, (3, 3): ConversationHandler.END}
+
+
+def test_restored_conversations_keep_their_deadline():
+    now = time.time()
+    db = FakeDatabase({"booking": [("[1, 1]", json.dumps([3, now - 60]))]})
+    persistence = SQLitePersistence(db, timeouts={"booking": 900})
+
+    asyncio.run(persistence.get_conversations("booking"))
+
+    assert abs(persistence.restored["booking"][(1, 1)] - (now + 840)) < 1
+
+
+class FakeApplication:
+    def __init__(self, stored):
+        self.user_data = defaultdict(dict)
+        self.stored = stored
+        self.persistence = self
+        self.marked = []
+
+    async def refresh_user_data(self, user_id, user_data):
+        user_data.update(self.stored.get(user_id, {}))
+
+    def mark_data_for_update_persistence(self, user_ids):
+        self.marked.append(user_ids)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append(chat_id)
+
+
+def test_restored_conversation_times_out_without_a_new_update():
+    handler = ConversationHandler(entry_points=[], states={}, fallbacks=[], name="booking")
+    handler._conversations = {(5, 7): 3}
+    app = FakeApplication({7: {"booking": BookingDraft(name="Ali"), "chat_history": ChatHistory()}})
+    context = SimpleNamespace(job=SimpleNamespace(data=(handler, (5, 7))), application=app, bot=FakeBot())
+
+    asyncio.run(EduBot._restored_timeout(EduBot.__new__(EduBot), context))
+
+    assert (5, 7) not in handler._conversations
+    assert "booking" not in app.user_data[7] and "chat_history" in app.user_data[7]
+    assert app.marked == [7]
+    assert context.bot.sent == [5]
+
+
+def test_restored_timeout_leaves_conversations_the_user_resumed():
+    handler = ConversationHandler(entry_points=[], states={}, fallbacks=[], name="booking")
+    handler._conversations = {(5, 7): 3}
+    handler.timeout_jobs[(5, 7)] = object()  # PTB armed its own timeout on a new update
+    app = FakeApplication({7: {"booking": BookingDraft(name="Ali")}})
+    context = SimpleNamespace(job=SimpleNamespace(data=(handler, (5, 7))), application=app, bot=FakeBot())
+
+    asyncio.run(EduBot._restored_timeout(EduBot.__new__(EduBot), context))
+
+    assert handler._conversations == {(5, 7): 3}
+    assert context.bot.sent == []
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+from main import ResponseCache
+
+
+def expired_rows(cache):
+    return cache._db.execute("SELECT COUNT(*) FROM response_cache WHERE expires_at < ?", (time.time(),)).fetchone()[0]
+
+
+def test_expired_answers_are_purged_every_n_writes(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / "cache.db"), purge_every=3)
+    cache._db.execute("INSERT INTO response_cache VALUES ('old', 'stale', 1.0)")
+    cache._db.commit()
+
+    async def run():
+        await cache.set("a", "1")
+        await cache.set("b", "2")
+        assert expired_rows(cache) == 1  # no full-table delete on every write
+        assert await cache.get("old") is None
+        await cache.set("c", "3")
+        assert expired_rows(cache) == 0
+
+    asyncio.run(run())
+    plan = cache._db.execute(
+        "EXPLAIN QUERY PLAN DELETE FROM response_cache WHERE expires_at < 1"
+    ).fetchall()
+    assert "idx_response_cache_expires" in str(plan)
+    cache.close()
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from main import MessageRouter, RouteHandler, Update
+
+
+def text_update(text, update_id=1, command=False):
+    message = {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "A"},
+    }
+    if command:
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.de_json({"update_id": update_id, "message": message}, None)
+
+
+def make_handler(called):
+    def callback(name):
+        async def record(update, context):
+            called.append(name)
+        return record
+
+    router = MessageRouter(extra_file="")
+    routes = {name: callback(name) for name in ("courses", "studio", "contact", "home")}
+    return RouteHandler(router, routes, default=callback("ai"))
+
+
+def dispatch(handler, update):
+    check = handler.check_update(update)
+    if check is None:
+        return None
+    asyncio.run(handler.handle_update(update, None, check, None))
+    return check
+
+
+def test_buttons_dispatch_to_their_callbacks():
+    called = []
+    handler = make_handler(called)
+    for text in ("📚 كورسات السنتر", "📸 استديو X.press", "📞 تواصل معنا", "🏠 الرئيسية"):
+        dispatch(handler, text_update(text))
+    assert called == ["courses", "studio", "contact", "home"]
+
+
+def test_other_text_goes_to_the_default_and_commands_are_left_alone():
+    called = []
+    handler = make_handler(called)
+    dispatch(handler, text_update("الكورس بكام؟"))
+    # exact-mode route only matches the whole message
+    dispatch(handler, text_update("عايز اعرف عن 📚 كورسات السنتر"))
+    assert dispatch(handler, text_update("/unknown", command=True)) is None
+    assert called == ["ai", "ai"]
+
+
+def test_entry_point_handler_only_takes_its_route():
+    called = []
+
+    async def book(update, context):
+        called.append("booking")
+
+    handler = RouteHandler(MessageRouter(extra_file=""), {"booking": book})
+    assert dispatch(handler, text_update("عايز أحجز كورس")) == "booking"
+    assert dispatch(handler, text_update("📚 كورسات السنتر")) is None
+    assert called == ["booking"]
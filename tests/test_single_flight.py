@@ -0,0 +1,61 @@
+import asyncio
+
+import main
+from main import GroqAI
+
+
+def make_ai(monkeypatch, release):
+    monkeypatch.setattr(main, "GROQ_API_KEY", "test-key")
+    ai = GroqAI()
+    ai.calls = 0
+
+    async def stream(messages, timeout):
+        ai.calls += 1
+        yield "الكورس "
+        await release.wait()
+        yield "بـ 1500 جنيه"
+
+    ai._stream_completion = stream
+    return ai
+
+
+def test_identical_concurrent_questions_make_one_upstream_call(monkeypatch):
+    async def run():
+        release = asyncio.Event()
+        ai = make_ai(monkeypatch, release)
+        asking = [asyncio.create_task(ai.ask("الكورس بكام؟")) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        release.set()
+        answers = await asyncio.gather(*asking)
+        again = await ai.ask("الكورس   بكام؟")  # same normalized question: cache, no call
+        return ai, answers, again
+
+    ai, answers, again = asyncio.run(run())
+
+    assert ai.calls == 1
+    assert answers == ["الكورس بـ 1500 جنيه"] * 5
+    assert again == answers[0]
+    assert not ai._flights
+
+
+def test_flight_is_cancelled_only_when_the_last_caller_leaves(monkeypatch):
+    async def run():
+        release = asyncio.Event()
+        ai = make_ai(monkeypatch, release)
+        first = asyncio.create_task(ai.ask("المواعيد امتى؟"))
+        second = asyncio.create_task(ai.ask("المواعيد امتى؟"))
+        await asyncio.sleep(0.05)
+        flight = next(iter(ai._flights.values()))
+
+        first.cancel()
+        await asyncio.sleep(0.05)
+        assert not flight.task.done()  # the other caller still wants the answer
+
+        second.cancel()
+        await asyncio.sleep(0.05)
+        assert flight.task.cancelled() or flight.done
+        assert not ai._flights
+        return ai
+
+    ai = asyncio.run(run())
+    assert ai.calls == 1
@@ -0,0 +1,97 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import main
+from main import PerChatUpdateProcessor, UpdateQueue
+
+
+def fake_update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), effective_user=None)
+
+
+async def handle(log, chat_id, seq):
+    log.append(("start", chat_id, seq))
+    for _ in range(3):
+        await asyncio.sleep(random.random() / 1000)
+    log.append(("end", chat_id, seq))
+
+
+def test_updates_of_one_chat_never_interleave():
+    async def scenario():
+        processor = PerChatUpdateProcessor(max_concurrent=8)
+        log = []
+        tasks = [
+            asyncio.ensure_future(processor.process_update(fake_update(chat), handle(log, chat, seq)))
+            for seq in range(20)
+            for chat in range(5)
+        ]
+        await asyncio.gather(*tasks)
+        return log
+
+    random.seed(7)
+    log = asyncio.run(scenario())
+    for chat in range(5):
+        events = [(kind, seq) for kind, c, seq in log if c == chat]
+        # strictly start/end pairs, in arrival order
+        assert events == [(kind, seq) for seq in range(20) for kind in ("start", "end")]
+
+
+def test_different_chats_run_concurrently_up_to_the_limit():
+    async def scenario():
+        processor = PerChatUpdateProcessor(max_concurrent=3)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            peak = max(peak, processor.in_flight)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(processor.process_update(fake_update(chat), work()) for chat in range(10)))
+        return peak
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_pending_updates_are_bounded():
+    async def scenario():
+        processor = PerChatUpdateProcessor(max_concurrent=2, max_pending=5)
+        queue = UpdateQueue(processor)
+        release = asyncio.Event()
+        update = main.Update(update_id=1)
+
+        tasks = [asyncio.ensure_future(processor.process_update(fake_update(chat % 2), release.wait()))
+                 for chat in range(5)]
+        await asyncio.sleep(0)
+        assert processor.pending == 5 and processor.saturated
+
+        put = asyncio.ensure_future(queue.put(update))
+        await asyncio.sleep(0.01)
+        assert not put.done() and queue.qsize() == 0  # intake paused
+
+        release.set()
+        await asyncio.gather(*tasks)
+        await asyncio.wait_for(put, 1)
+        assert processor.pending == 0 and queue.qsize() == 1
+
+    asyncio.run(scenario())
+
+
+def test_webhook_reports_saturation_from_pending_updates():
+    async def scenario():
+        processor = PerChatUpdateProcessor(max_concurrent=2, max_pending=1000)
+        app = SimpleNamespace(update_processor=processor, update_queue=UpdateQueue(processor))
+        server = main.WebhookServer(app, secret="s", max_queue=10)
+        release = asyncio.Event()
+
+        tasks = [asyncio.ensure_future(processor.process_update(fake_update(chat % 4), release.wait()))
+                 for chat in range(10)]
+        await asyncio.sleep(0)
+        assert app.update_queue.qsize() == 0
+        assert server.backlog() == 10 and server._saturated()
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert server.backlog() == 0 and not server._saturated()
+
+    asyncio.run(scenario())
@@ -0,0 +1,80 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from telegram import Bot
+
+from main import PerChatUpdateProcessor, Update, WebhookServer
+
+SECRET = "test-secret"
+UPDATE = {"update_id": 1, "message": {
+    "message_id": 1, "date": 0, "text": "hi",
+    "chat": {"id": 10, "type": "private"}, "from": {"id": 10, "is_bot": False, "first_name": "A"},
+}}
+
+
+def post(body, secret=SECRET, extra_headers=()):
+    head = [
+        "POST /telegram HTTP/1.1", "Host: localhost", f"Content-Length: {len(body)}",
+        f"X-Telegram-Bot-Api-Secret-Token: {secret}", "Connection: close", *extra_headers,
+    ]
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+
+async def exchange(raw, max_queue=10, queued=0):
+    """Start a WebhookServer on a free port, send raw bytes, return (status, headers, app)"""
+    app = SimpleNamespace(
+        bot=Bot("123456:TEST"), running=True,
+        update_queue=asyncio.Queue(), update_processor=PerChatUpdateProcessor(),
+    )
+    for _ in range(queued):
+        app.update_queue.put_nowait(object())
+    server = WebhookServer(app, SECRET, "/telegram", max_queue)
+    await server.start("127.0.0.1", 0)
+    server.ready = True
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(raw)
+        await writer.drain()
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        await server.stop()
+    head = response.split("\r\n\r\n", 1)[0].split("\r\n")
+    headers = dict(line.split(": ", 1) for line in head[1:])
+    return int(head[0].split()[1]), headers, app
+
+
+def test_valid_update_is_queued():
+    status, _, app = asyncio.run(exchange(post(json.dumps(UPDATE).encode())))
+
+    assert status == 200
+    assert isinstance(app.update_queue.get_nowait(), Update)
+
+
+def test_wrong_secret_is_forbidden():
+    status, _, app = asyncio.run(exchange(post(json.dumps(UPDATE).encode(), secret="wrong")))
+
+    assert status == 403
+    assert app.update_queue.empty()
+
+
+def test_malformed_body_is_rejected():
+    status, _, _ = asyncio.run(exchange(post(b"{not json")))
+
+    assert status == 400
+
+
+def test_full_queue_asks_telegram_to_retry():
+    status, headers, _ = asyncio.run(exchange(post(json.dumps(UPDATE).encode()), max_queue=2, queued=2))
+
+    assert status == 503
+    assert headers["Retry-After"] == "1"
+
+
+def test_header_count_is_limited():
+    flood = [f"X-Filler-{n}: x" for n in range(100)]
+    status, _, app = asyncio.run(exchange(post(json.dumps(UPDATE).encode(), extra_headers=flood)))
+
+    assert status == 431
+    assert app.update_queue.empty()